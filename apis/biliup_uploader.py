@@ -1,19 +1,26 @@
 import subprocess
 import logging
 import os
+from contextlib import nullcontext
+
+from apis.job_manager import JobCancelled
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def upload_to_bilibili(biliup_path: str, config_file: str = "config.yaml"):
+def upload_to_bilibili(biliup_path: str, config_file: str = "config.yaml", control=None, priority=None):
     """
     在指定的 biliup-rs 目录下执行上传命令。
 
     Args:
         biliup_path: biliup-rs 工具所在的目录路径。
         config_file: biliup-rs 使用的配置文件名 (相对于 biliup_path)。
+        control: 可选的 JobControl (见 apis.job_manager)，任务取消时结束 biliup 进程。
+        priority: 可选的 ProcessPriority (见 apis.process_priority)，设置 biliup 进程的 CPU / IO 优先级。
     """
     command = ["./biliup", "upload", "-c", config_file]
+    if priority is not None:
+        command = priority.wrap(command)
     command_str = " ".join(command) # 用于日志记录
 
     logger.info(f"准备在目录 {biliup_path} 执行上传命令: {command_str}")
@@ -30,22 +37,31 @@ def upload_to_bilibili(biliup_path: str, config_file: str = "config.yaml"):
              logger.warning(f"无法找到 biliup 可执行文件或没有执行权限: {biliup_executable}")
              # 根据需要可能需要抛出错误
 
-        result = subprocess.run(
+        with subprocess.Popen(
             command,
             cwd=biliup_path, # 在指定目录下执行
-            check=True,      # 如果命令返回非零退出码则抛出异常
-            capture_output=True, # 捕获 stdout 和 stderr
+            stdout=subprocess.PIPE, # 捕获 stdout 和 stderr
+            stderr=subprocess.PIPE,
             text=True,       # 以文本模式处理输出
             encoding='utf-8' # 显式指定编码
-        )
-        logger.info(f"biliup-rs 上传命令标准输出:\n{result.stdout}")
-        if result.stderr:
-            logger.warning(f"biliup-rs 上传命令标准错误输出:\n{result.stderr}")
+        ) as proc, (control.track(proc) if control is not None else nullcontext()):
+            stdout, stderr = proc.communicate()
+        if proc.returncode != 0:
+            if control is not None:
+                control.check()
+            # 如果命令返回非零退出码则抛出异常
+            raise subprocess.CalledProcessError(proc.returncode, command, output=stdout, stderr=stderr)
+        logger.info(f"biliup-rs 上传命令标准输出:\n{stdout}")
+        if stderr:
+            logger.warning(f"biliup-rs 上传命令标准错误输出:\n{stderr}")
         logger.info("Bilibili 上传命令执行成功。")
 
     except FileNotFoundError as e:
         logger.error(f"执行上传命令失败: {e}。请检查 BILIUP_RS_PATH 是否正确配置，并且该目录下包含 biliup 可执行文件。")
         raise # 重新抛出异常，让 main.py 捕获
+    except JobCancelled:
+        logger.warning("Bilibili 上传已取消，biliup-rs 进程已结束。")
+        raise
     except subprocess.CalledProcessError as e:
         logger.error(f"biliup-rs 上传命令执行失败，返回码: {e.returncode}")
         logger.error(f"标准输出:\n{e.stdout}")
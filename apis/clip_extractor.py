@@ -0,0 +1,125 @@
+import os
+import bisect
+import shlex
+import logging
+
+from apis.ffmpeg_progress import run_ffmpeg
+from apis.segment_encoder import slice_ass
+
+logger = logging.getLogger(__name__)
+
+
+def snap_to_keyframes(keyframes, start: float, end: float, duration: float = None):
+    """
+    将片段边界对齐到关键帧：开始时间取不晚于 start 的关键帧，结束时间取不早于 end 的关键帧，
+    直接复制流时片段开头不会出现无法解码的帧。
+    """
+    start = max(0.0, start)
+    if duration:
+        end = min(end, duration)
+    if keyframes:
+        i = bisect.bisect_right(keyframes, start) - 1
+        start = keyframes[i] if i >= 0 else 0.0
+        j = bisect.bisect_left(keyframes, end)
+        if j < len(keyframes):
+            end = keyframes[j]
+        elif duration:
+            end = duration
+    return start, end
+
+
+def merge_ranges(ranges) -> list:
+    """合并重叠或相邻的时间段"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(item) for item in merged]
+
+
+def clip_command(video: str, output: str, start: float, end: float) -> list:
+    """直接复制音视频流截取 [start, end) 的命令"""
+    return [
+        "ffmpeg", "-hide_banner",
+        "-ss", f"{start:.3f}",
+        "-i", video,
+        "-t", f"{end - start:.3f}",
+        "-map", "0:v:0", "-map", "0:a?",
+        "-c", "copy", "-avoid_negative_ts", "make_zero", "-movflags", "+faststart",
+        "-y", output,
+    ]
+
+
+def extract_clip(video: str, output: str, start: float, end: float, ass: str = None, backend=None,
+                 control=None, priority=None) -> dict:
+    """
+    截取单个片段。默认直接复制流，几秒内完成；提供 ass 和 backend 时只烧录该片段时间内的弹幕并重新压制。
+
+    Args:
+        video: 源视频 (通常为 FLV)。
+        output: 输出文件。
+        start / end: 片段时间 (秒)，复制流时应先用 snap_to_keyframes 对齐关键帧。
+        ass: 完整录播的 ASS 文件，提供时截取对应时间段的弹幕烧录到片段中。
+        backend: 烧录弹幕时使用的压制后端 (见 apis.encoder_backends)。
+        control: 可选的 JobControl，任务取消时结束 ffmpeg。
+        priority: 可选的 ProcessPriority，设置 ffmpeg 的 CPU / IO 优先级。
+
+    Returns:
+        包含 output、start、end、burned 和烧录的弹幕事件数 (events) 的字典。
+    """
+    clip_ass = None
+    events = None
+    try:
+        if ass and backend is not None:
+            clip_ass = os.path.splitext(output)[0] + ".ass"
+            events = slice_ass(ass, clip_ass, start, end)
+            cmd = backend.build_command(video, clip_ass, output, start=start, end=end)
+        else:
+            cmd = clip_command(video, output, start, end)
+        logger.info(f"截取片段 {start:.1f}s - {end:.1f}s: {shlex.join(cmd)}")
+        run_ffmpeg(cmd, duration=end - start, control=control, priority=priority)
+    except BaseException:
+        if os.path.exists(output):
+            os.remove(output)
+        raise
+    finally:
+        if clip_ass and os.path.exists(clip_ass):
+            os.remove(clip_ass)
+    return {"output": output, "start": start, "end": end, "burned": clip_ass is not None, "events": events}
+
+
+def extract_highlights(video: str, peaks, folder: str, before: float = 30.0, after: float = 30.0,
+                       keyframes=None, duration: float = None, ass: str = None, backend=None,
+                       control=None, priority=None) -> list:
+    """
+    按弹幕密度峰值截取片段：每个峰值取前 before 秒到后 after 秒，重叠的片段合并，边界对齐关键帧。
+
+    Args:
+        peaks: DanmakuIndex.peaks 返回的峰值列表，或 (start, end) 时间段列表。
+        folder: 片段输出目录，文件名为 "录播名.clip-开始秒-结束秒.mp4"。
+        keyframes: 源视频的关键帧时间列表，用于对齐片段边界。
+        其它参数见 extract_clip。
+
+    Returns:
+        每个片段的 extract_clip 结果。
+    """
+    ranges = []
+    for peak in peaks:
+        if isinstance(peak, dict):
+            ranges.append((peak["time"] - before, peak["time"] + after))
+        else:
+            ranges.append((float(peak[0]), float(peak[1])))
+    os.makedirs(folder, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(video))[0]
+    results = []
+    for start, end in merge_ranges(snap_to_keyframes(keyframes, s, e, duration) for s, e in ranges):
+        if end <= start:
+            continue
+        if control is not None:
+            control.check()
+        output = os.path.join(folder, f"{stem}.clip-{int(start):06d}-{int(end):06d}.mp4")
+        results.append(extract_clip(video, output, start, end, ass=ass, backend=backend,
+                                    control=control, priority=priority))
+    return results
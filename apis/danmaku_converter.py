@@ -1,87 +1,181 @@
 import os
 import logging
-import fnmatch
 from dmconvert import convert_xml_to_ass
-import subprocess
-import json
+import time
+
+from apis.dir_index import DirectoryIndex
+from apis.process_pool import run_in_processes
+from apis.media_probe import probe
+from apis.danmaku_stream import convert_xml_to_ass_streaming
+from apis.danmaku_layout import layout_danmaku
+from apis.danmaku_index import build_danmaku_index
 
 logger = logging.getLogger(__name__)
-def convert_to_ass(xml_file, ass_file):
-    """将弹幕文件转换为ASS格式"""
+def convert_to_ass(xml_file, ass_file, streaming=False, resolution=None, layout=None, build_index=False):
+    """
+    将弹幕文件转换为ASS格式
+
+    streaming 为 True 时使用流式转换，边解析边写入，内存占用不随弹幕数量增长。
+    resolution 为 (宽, 高)，提供时不再探测对应视频的分辨率。
+    layout 为弹幕排版参数字典 (max_on_screen、merge_window)，提供时合并刷屏弹幕并限制同屏数量，
+    见 apis.danmaku_layout.layout_danmaku。
+    build_index 为 True 时同时生成列式弹幕索引 (见 apis.danmaku_index)，用于查找弹幕密度峰值和截取片段。
+
+    Returns:
+        转换统计 (弹幕数量、写入的事件数量等)，dmconvert 转换时为 None。
+    """
     # 默认分辨率，仅在无法获取视频分辨率时使用
     font_size = 38
     sc_font_size = 30
     resolution_x = 1920
     resolution_y = 1080
     
-    # 尝试获取对应视频的分辨率
-    video_file = os.path.splitext(xml_file)[0] + ".flv"
-    if os.path.exists(video_file):
-        try:
-            # 使用ffprobe获取视频分辨率
-            cmd = [
-                "ffprobe", 
-                "-v", "error", 
-                "-select_streams", "v:0", 
-                "-show_entries", "stream=width,height", 
-                "-of", "json", 
-                video_file
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                if "streams" in data and len(data["streams"]) > 0:
-                    stream = data["streams"][0]
-                    resolution_x = stream.get("width", resolution_x)
-                    resolution_y = stream.get("height", resolution_y)
-                    logger.info(f"检测到视频分辨率: {resolution_x}x{resolution_y}")
-        except Exception as e:
-            logger.warning(f"获取视频分辨率失败: {e}，将使用默认分辨率")
+    if resolution is not None:
+        resolution_x, resolution_y = resolution
     else:
-        logger.warning(f"未找到对应视频文件: {video_file}，将使用默认分辨率")
+        # 尝试获取对应视频的分辨率
+        video_file = os.path.splitext(xml_file)[0] + ".flv"
+        if os.path.exists(video_file):
+            try:
+                info = probe(video_file, keyframes=False)
+                resolution_x = info["width"] or resolution_x
+                resolution_y = info["height"] or resolution_y
+                logger.info(f"检测到视频分辨率: {resolution_x}x{resolution_y}")
+            except Exception as e:
+                logger.warning(f"获取视频分辨率失败: {e}，将使用默认分辨率")
+        else:
+            logger.warning(f"未找到对应视频文件: {video_file}，将使用默认分辨率")
         
-    convert_xml_to_ass(font_size, sc_font_size, resolution_x, resolution_y, xml_file, ass_file)
+    stats = None
+    if layout is not None:
+        stats = layout_danmaku(font_size, sc_font_size, resolution_x, resolution_y, xml_file, ass_file, **layout)
+    elif streaming:
+        stats = convert_xml_to_ass_streaming(font_size, sc_font_size, resolution_x, resolution_y, xml_file, ass_file)
+    else:
+        convert_xml_to_ass(font_size, sc_font_size, resolution_x, resolution_y, xml_file, ass_file)
 
     logger.info(f"ASS 文件已生成: {ass_file}")
+    if build_index:
+        try:
+            indexed = build_danmaku_index(xml_file)
+            stats = {**(stats or {}), "indexed": indexed}
+        except Exception as e:
+            # 索引只用于高光片段，生成失败不影响转换结果
+            logger.warning(f"生成 {xml_file} 的弹幕索引失败: {e}")
+    return stats
+
+def convert_task(xml_file, ass_file, streaming, resolution, layout=None, build_index=False):
+    """子进程中执行的转换任务，返回转换统计"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    return convert_to_ass(xml_file, ass_file, streaming, resolution, layout, build_index)
 
-def process_folder(folder="."):
-    """处理文件夹中的所有XML文件"""
+def process_folder(folder=".", ledger=None, streaming=False, workers=0, timeout=None, probe_cache=None,
+                   layout=None, index=None, build_index=False):
+    """
+    处理文件夹中的所有XML文件
+
+    Args:
+        folder: 需要处理的文件夹。
+        ledger: 可选的 JobLedger，提供时会跳过已转换过且未被改写的XML文件。
+        streaming: 是否使用流式转换。
+        workers: 并行转换的子进程数，为 0 时在当前线程中逐个转换。
+        timeout: 并行模式下单个文件的转换超时时间 (秒)，超时的子进程会被强制结束。
+        probe_cache: 可选的 ProbeCache，提供时一次性探测所有对应视频并复用缓存的分辨率。
+        layout: 弹幕排版参数，见 convert_to_ass。
+        index: 可选的 DirectoryIndex，与其它阶段共享同一次目录扫描。
+        build_index: 是否同时生成列式弹幕索引，见 convert_to_ass。
+
+    Returns:
+        包含已转换、跳过和出错文件以及每个文件转换结果的字典。
+    """
     folder = os.path.abspath(folder)
     logger.info(f"正在处理文件夹: {folder}")
+    summary = {"converted": [], "skipped": 0, "errors": [], "files": []}
     
-    # 获取所有XML文件，过滤掉未完成的XML文件
+    if index is None:
+        index = DirectoryIndex()
+
+    # 获取所有XML文件，.xml.part 等未完成的文件扩展名不同，不会被选中
     xml_files = []
-    for root, _, files in os.walk(folder):
-        for file in files:
-            # 排除 .xml.part 和其他可能未完成的XML文件
-            if (fnmatch.fnmatch(file.lower(), "*.xml") and 
-                not file.lower().endswith(".xml.part") and
-                not file.lower().endswith(".part")):
-                xml_files.append(os.path.join(root, file))
+    for snapshot in index.walk(folder):
+        xml_files.extend(entry.path for entry in snapshot.files(".xml"))
 
     if not xml_files:
-        logger.error("未找到XML文件！")
-        return
+        logger.info("未找到需要转换的XML文件")
+        return summary
 
     logger.info(f"找到 {len(xml_files)} 个XML文件")
     
-    # 处理每个XML文件
+    # 需要转换的文件: XML 路径 -> (ASS 路径, 转换前的 stat)
+    tasks = {}
     for xml_file in xml_files:
-        logger.info(f"\n处理文件: {xml_file}")
-        
+        try:
+            stat = index.stat(xml_file)
+        except OSError:
+            continue
+        if ledger is not None and ledger.is_done(xml_file, "convert", stat.st_size, stat.st_mtime):
+            summary["skipped"] += 1
+            continue
+
         # 检查是否有正在录制的对应FLV文件
         flv_file = os.path.splitext(xml_file)[0] + ".flv"
         flv_part_file = flv_file + ".part"
         
-        if os.path.exists(flv_part_file):
+        if index.exists(flv_part_file):
             logger.warning(f"对应的视频文件 {flv_part_file} 仍在录制中，跳过此XML文件")
             continue
             
-        ass_file = os.path.splitext(xml_file)[0] + ".ass"
-        try:
-            convert_to_ass(xml_file, ass_file)
+        tasks[xml_file] = (os.path.splitext(xml_file)[0] + ".ass", stat)
+
+    # 一次性探测所有对应视频，探测结果会被缓存供压制阶段复用
+    resolutions = {}
+    if probe_cache is not None:
+        flv_map = {xml_file: os.path.splitext(xml_file)[0] + ".flv" for xml_file in tasks}
+        infos = probe_cache.get_many([flv for flv in flv_map.values() if index.exists(flv)])
+        for xml_file, flv_file in flv_map.items():
+            info = infos.get(flv_file)
+            if info and info["width"] and info["height"]:
+                resolutions[xml_file] = (info["width"], info["height"])
+
+    if workers > 0:
+        logger.info(f"使用 {workers} 个子进程并行转换 {len(tasks)} 个XML文件")
+        file_results = run_in_processes(
+            convert_task,
+            [(xml_file, (xml_file, ass_file, streaming, resolutions.get(xml_file), layout, build_index))
+             for xml_file, (ass_file, _) in tasks.items()],
+            workers=workers,
+            timeout=timeout,
+        )
+    else:
+        file_results = []
+        for xml_file, (ass_file, _) in tasks.items():
+            logger.info(f"\n处理文件: {xml_file}")
+            started = time.time()
+            try:
+                stats = convert_to_ass(xml_file, ass_file, streaming, resolutions.get(xml_file), layout, build_index)
+                file_results.append({"key": xml_file, "status": "success", "result": stats, "error": None})
+            except Exception as e:
+                file_results.append({"key": xml_file, "status": "failed", "error": str(e)})
+            file_results[-1]["seconds"] = round(time.time() - started, 3)
+
+    for file_result in file_results:
+        xml_file = file_result["key"]
+        ass_file, stat = tasks[xml_file]
+        summary["files"].append({
+            "xml": xml_file,
+            "status": file_result["status"],
+            "seconds": file_result["seconds"],
+            "stats": file_result.get("result"),
+            "error": file_result["error"],
+        })
+        if file_result["status"] == "success":
+            summary["converted"].append(xml_file)
+            if ledger is not None:
+                ledger.mark_done(xml_file, "convert", stat.st_size, stat.st_mtime)
             # 继续删除转换完的xml文件
             # os.remove(xml_file)
-        except Exception as e:
-            logger.error(f"处理 {xml_file} 时出错: {e}")
-            continue
\ No newline at end of file
+        else:
+            logger.error(f"处理 {xml_file} 时出错 ({file_result['status']}): {file_result['error']}")
+            error_line = (file_result["error"] or "").strip().splitlines()[:1]
+            summary["errors"].append(f"{xml_file}: {error_line[0] if error_line else file_result['status']}")
+    return summary
@@ -0,0 +1,200 @@
+import os
+import json
+import array
+import hashlib
+import logging
+
+import numpy as np
+
+from apis.danmaku_stream import iter_danmaku
+
+logger = logging.getLogger(__name__)
+
+# 索引文件扩展名，与 XML 同名保存在同一目录
+INDEX_SUFFIX = ".dmidx"
+
+MAGIC = b"DMIDX1\n"
+
+# 各列数据的起始位置按该字节数对齐
+ALIGN = 64
+
+# 列名 -> 小端字节序的 NumPy 类型：出现时间 (秒)、弹幕类型、文本哈希
+COLUMNS = (("time", "<f4"), ("type", "<i1"), ("text_hash", "<u8"))
+
+
+def index_path(xml_file: str) -> str:
+    return os.path.splitext(xml_file)[0] + INDEX_SUFFIX
+
+
+def text_hash(text: str) -> int:
+    """弹幕文本的 64 位哈希，跨进程稳定，用于统计相同内容的弹幕"""
+    return int.from_bytes(hashlib.blake2b(text.strip().encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_index(path: str, columns: dict, meta: dict = None):
+    """
+    写入列式索引文件：魔数、8 字节头部长度、JSON 头部，之后是按 ALIGN 对齐的各列原始数据。
+
+    先写入临时文件再重命名，读取方不会看到写了一半的索引。
+    """
+    count = len(columns["time"])
+    layout = []
+    offset = 0
+    for name, dtype in COLUMNS:
+        offset = _aligned(offset)
+        layout.append({"name": name, "dtype": dtype, "offset": offset})
+        offset += count * np.dtype(dtype).itemsize
+    header = json.dumps({"version": 1, "count": count, "columns": layout, **(meta or {})}).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for column in layout:
+            f.seek(data_start + column["offset"])
+            f.write(np.ascontiguousarray(columns[column["name"]], dtype=column["dtype"]).tobytes())
+    os.replace(tmp, path)
+
+
+def build_danmaku_index(xml_file: str, path: str = None) -> int:
+    """
+    流式解析弹幕 XML，生成按出现时间排序的列式索引 (默认保存为同名的 .dmidx 文件)。
+
+    Returns:
+        索引中的弹幕数量。
+    """
+    path = path or index_path(xml_file)
+    stat = os.stat(xml_file)
+    times, types, hashes = array.array("f"), array.array("b"), array.array("Q")
+    for appear_time, danmaku_type, _, text in iter_danmaku(xml_file):
+        times.append(appear_time)
+        types.append(max(-128, min(127, danmaku_type)))
+        hashes.append(text_hash(text))
+    time_column = np.frombuffer(times, dtype=np.float32)
+    # iter_danmaku 只在有限窗口内重排，这里保证严格有序，按时间查找时可以二分
+    order = np.argsort(time_column, kind="stable")
+    write_index(path, {
+        "time": time_column[order],
+        "type": np.frombuffer(types, dtype=np.int8)[order],
+        "text_hash": np.frombuffer(hashes, dtype=np.uint64)[order],
+    }, meta={"xml_size": stat.st_size, "xml_mtime": stat.st_mtime})
+    logger.info(f"弹幕索引已生成: {path}，{len(order)} 条弹幕")
+    return len(order)
+
+
+class DanmakuIndex:
+    """
+    只读的列式弹幕索引，各列以内存映射方式打开，不会一次性读入内存。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} 不是弹幕索引文件")
+            header_len = int.from_bytes(f.read(8), "little")
+            self.meta = json.loads(f.read(header_len))
+        data_start = _aligned(len(MAGIC) + 8 + header_len)
+        self.count = self.meta["count"]
+        self.columns = {}
+        for column in self.meta["columns"]:
+            if self.count == 0:
+                self.columns[column["name"]] = np.empty(0, dtype=column["dtype"])
+            else:
+                self.columns[column["name"]] = np.memmap(path, dtype=column["dtype"], mode="r",
+                                                         offset=data_start + column["offset"], shape=(self.count,))
+
+    @classmethod
+    def open(cls, xml_file: str, rebuild: bool = True):
+        """
+        打开 XML 对应的索引；索引不存在或 XML 已变化时重新生成 (rebuild 为 False 时返回 None)。
+        """
+        path = index_path(xml_file)
+        if os.path.exists(path):
+            index = cls(path)
+            if not os.path.exists(xml_file) or not index.is_stale(xml_file):
+                return index
+        if not rebuild or not os.path.exists(xml_file):
+            return None
+        build_danmaku_index(xml_file, path)
+        return cls(path)
+
+    def is_stale(self, xml_file: str) -> bool:
+        stat = os.stat(xml_file)
+        return self.meta.get("xml_size") != stat.st_size or self.meta.get("xml_mtime") != stat.st_mtime
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.columns["time"]
+
+    @property
+    def types(self) -> np.ndarray:
+        return self.columns["type"]
+
+    @property
+    def text_hashes(self) -> np.ndarray:
+        return self.columns["text_hash"]
+
+    def density(self, bin_seconds: float = 10.0) -> np.ndarray:
+        """每 bin_seconds 秒的弹幕数量"""
+        if bin_seconds <= 0:
+            raise ValueError(f"区间长度必须大于 0: {bin_seconds}")
+        if self.count == 0:
+            return np.zeros(0, dtype=np.int64)
+        bins = np.floor(np.clip(self.times, 0, None) / bin_seconds).astype(np.int64)
+        return np.bincount(bins)
+
+    def peaks(self, bin_seconds: float = 10.0, top: int = 5, smooth: int = 3, min_gap: float = 120.0,
+              min_score: float = 1.0) -> list:
+        """
+        找出弹幕密度最高的时刻。
+
+        密度按 smooth 个区间做滑动平均后，从高到低选取峰值 (峰值位置取平滑窗口内弹幕数最多的区间)，
+        两个峰值之间至少相隔 min_gap 秒，平滑后的密度低于平均值 min_score 个标准差的时刻不算峰值。
+
+        Returns:
+            按时间排序的峰值列表，包含 time (峰值区间中点)、start / end (峰值区间)、count (区间内弹幕数)、
+            rate (平滑后的每秒弹幕数)、score (与平均密度相差的标准差倍数) 和 unique_ratio
+            (不同内容的弹幕占比，刷屏同一句话时接近 0)。
+        """
+        counts = self.density(bin_seconds)
+        if counts.size == 0 or top <= 0:
+            return []
+        smooth = max(1, min(smooth, counts.size))
+        smoothed = np.convolve(counts, np.ones(smooth) / smooth, mode="same")
+        std = smoothed.std()
+        scores = (smoothed - smoothed.mean()) / std if std > 0 else np.zeros_like(smoothed)
+        gap_bins = int(np.ceil(min_gap / bin_seconds)) if min_gap > 0 else 0
+        blocked = np.zeros(counts.size, dtype=bool)
+        picked = []
+        half = smooth // 2
+        for i in map(int, np.argsort(smoothed, kind="stable")[::-1]):
+            if len(picked) >= top or smoothed[i] <= 0 or scores[i] < min_score:
+                break
+            if blocked[i]:
+                continue
+            lo = max(0, i - half)
+            peak = lo + int(np.argmax(counts[lo:i + half + 1]))
+            picked.append((peak, i))
+            blocked[max(0, i - gap_bins):i + gap_bins + 1] = True
+
+        peaks = []
+        for peak, i in sorted(picked):
+            start, end = peak * bin_seconds, (peak + 1) * bin_seconds
+            lo, hi = (int(v) for v in np.searchsorted(self.times, [start, end]))
+            unique = np.unique(self.text_hashes[lo:hi]).size
+            peaks.append({
+                "time": round(start + bin_seconds / 2, 3),
+                "start": round(start, 3),
+                "end": round(end, 3),
+                "count": int(counts[peak]),
+                "rate": round(float(smoothed[i]) / bin_seconds, 3),
+                "score": round(float(scores[i]), 3),
+                "unique_ratio": round(unique / (hi - lo), 3) if hi > lo else None,
+            })
+        return peaks
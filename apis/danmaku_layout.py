@@ -0,0 +1,281 @@
+import math
+import logging
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from dmconvert.utils import format_time, get_str_len, remove_emojis
+from dmconvert.guardgift.gg_handler import draw_gift_and_guard
+from dmconvert.header.header import draw_ass_header
+from dmconvert.superchat.superchat_handler import draw_superchat
+
+from apis.danmaku_stream import ROLL_TIME, FIX_TIME, iter_danmaku, ass_color
+
+logger = logging.getLogger(__name__)
+
+# 同一屏幕上最多同时显示的弹幕数量
+MAX_ON_SCREEN = 60
+
+# 相同内容的弹幕在该时间窗口 (秒) 内合并为一条 "内容 x次数"
+MERGE_WINDOW = 10.0
+
+DANMAKU_TYPES = (1, 4, 5)
+
+# 每批排版的弹幕时间范围 (秒)，内存占用只与该范围内的弹幕数量有关，与录播总时长无关
+CHUNK_SECONDS = 600.0
+
+# 逐段移除碰撞的最大轮数，超过后 (通常是未限制密度的极端刷屏) 一次移除所有碰撞的弹幕
+EXACT_COLLISION_ROUNDS = 64
+
+
+def _to_arrays(batch):
+    """将一批弹幕转换为列数组，文本按内容去重后以编号表示"""
+    times, types, colors, text_ids = [], [], [], []
+    text_index = {}
+    texts = []
+    for appear_time, danmaku_type, color, text in batch:
+        text_id = text_index.get(text)
+        if text_id is None:
+            text_id = text_index[text] = len(texts)
+            texts.append(text)
+        times.append(appear_time)
+        types.append(danmaku_type)
+        colors.append(color)
+        text_ids.append(text_id)
+    return (
+        np.asarray(times, dtype=np.float64),
+        np.asarray(types, dtype=np.int8),
+        np.asarray(colors, dtype=np.int64),
+        np.asarray(text_ids, dtype=np.int64),
+        texts,
+    )
+
+
+def _read_chunks(xml_file, side_root, chunk_seconds):
+    """
+    按时间范围分批读取普通弹幕为列数组，每批覆盖 [k * chunk_seconds, (k + 1) * chunk_seconds)。
+
+    iter_danmaku 按出现时间排序输出，同一时刻只保留一批弹幕在内存中。
+    """
+    batch = []
+    chunk_end = None
+    for appear_time, danmaku_type, color, text in iter_danmaku(xml_file, side_root):
+        if danmaku_type not in DANMAKU_TYPES:
+            continue
+        if chunk_end is None or appear_time >= chunk_end:
+            if batch:
+                yield _to_arrays(batch)
+                batch = []
+            chunk_end = (math.floor(appear_time / chunk_seconds) + 1) * chunk_seconds
+        batch.append((appear_time, danmaku_type, color, remove_emojis(text, ".").strip()))
+    if batch:
+        yield _to_arrays(batch)
+
+
+def merge_repeats(times, types, colors, text_ids, window):
+    """
+    合并相同时间窗口内内容相同的弹幕 (刷屏)。
+
+    Returns:
+        (合并后每组第一条弹幕的下标, 每组的弹幕数量)，按出现时间排序。
+    """
+    if len(times) == 0 or window <= 0:
+        return np.arange(len(times)), np.ones(len(times), dtype=np.int64)
+    buckets = np.floor(times / window).astype(np.int64)
+    # 以 (文本, 时间窗口, 弹幕类型) 分组，组内按时间排序取第一条
+    order = np.lexsort((times, types, buckets, text_ids))
+    keys = np.stack([text_ids[order], buckets[order], types[order].astype(np.int64)], axis=1)
+    group_start = np.ones(len(order), dtype=bool)
+    group_start[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+    starts = np.flatnonzero(group_start)
+    counts = np.diff(np.append(starts, len(order)))
+    first = order[starts]
+    by_time = np.argsort(times[first], kind="stable")
+    return first[by_time], counts[by_time]
+
+
+def cap_density(times, counts, max_on_screen, display_time=ROLL_TIME):
+    """
+    限制同屏弹幕数量：将时间分为 1 秒的区间，每个区间最多保留 max_on_screen / display_time 条，
+    区间内优先保留合并次数多的弹幕。
+
+    Returns:
+        保留的弹幕的布尔掩码。
+    """
+    if len(times) == 0 or max_on_screen <= 0:
+        return np.ones(len(times), dtype=bool)
+    quota = max(1, int(round(max_on_screen / display_time)))
+    seconds = np.floor(times).astype(np.int64)
+    order = np.lexsort((times, -counts, seconds))
+    sorted_seconds = seconds[order]
+    first_in_bucket = np.searchsorted(sorted_seconds, sorted_seconds, side="left")
+    rank = np.arange(len(order)) - first_in_bucket
+    keep = np.zeros(len(times), dtype=bool)
+    keep[order[rank < quota]] = True
+    return keep
+
+
+def _roll_collides(prev_time, prev_width, time, width, resolution_x):
+    """向量化的滚动弹幕碰撞检测，判定方式与 dmconvert 的轨道分配一致"""
+    prev_velocity = (prev_width + resolution_x) / ROLL_TIME
+    velocity = (width + resolution_x) / ROLL_TIME
+    delta_t = time - prev_time
+    delta_x = delta_t * prev_velocity - (prev_width + width) / 2
+    delta_v = velocity - prev_velocity
+    with np.errstate(divide="ignore", invalid="ignore"):
+        catch_up = np.where(delta_v > 0, delta_t - delta_x / delta_v, 1.0)
+    # 前一条弹幕已经离开屏幕时不可能碰撞
+    gone = delta_t >= ROLL_TIME
+    return ~gone & ((delta_x < 0) | (catch_up <= 0))
+
+
+def assign_lanes(times, widths, rows, resolution_x, rolling, start=0, tail=None):
+    """
+    为同一类型的弹幕分配轨道并移除冲突。
+
+    弹幕按时间顺序轮流分配到各条轨道 (第 i 条使用轨道 (start + i) % rows)，使同一轨道上相邻弹幕的
+    间隔最大；随后向量化地检测每条轨道上相邻弹幕是否碰撞。连续碰撞时只移除每段中的第一条
+    (其前一条弹幕一定会保留)，然后重新检测新的相邻弹幕，直到没有碰撞，结果与按固定轨道逐条
+    检查 (与该轨道上一条保留的弹幕比较) 相同。这不是贪心分配：轨道被占用时弹幕直接移除，不会
+    改用其它空闲的轨道，因此比 dmconvert 逐条选择空闲轨道移除的弹幕更多。限制密度后碰撞段都很短；
+    超过 EXACT_COLLISION_ROUNDS 轮后改为每轮移除所有碰撞的弹幕，保证很快结束。
+
+    Args:
+        start: 第一条弹幕的轮转序号，分批排版时为之前各批的弹幕数量。
+        tail: 可选的 (轨道, 出现时间, 宽度) 数组，之前各批每条轨道上最后一条保留的弹幕，
+            本批的弹幕会与其检测碰撞。
+
+    Returns:
+        (轨道编号数组, 保留掩码)。
+    """
+    lanes = (start + np.arange(len(times))) % max(1, rows)
+    carried = 0
+    if tail is not None:
+        # 之前各批的弹幕时间更早，在每条轨道上排在最前面，不会被移除
+        carried = len(tail[0])
+        lanes = np.concatenate([tail[0], lanes])
+        times = np.concatenate([tail[1], times])
+        widths = np.concatenate([tail[2], widths])
+    keep = np.ones(len(times), dtype=bool)
+    rounds = 0
+    while True:
+        rounds += 1
+        idx = np.flatnonzero(keep)
+        if len(idx) < 2:
+            break
+        order = idx[np.lexsort((times[idx], lanes[idx]))]
+        same_lane = lanes[order[1:]] == lanes[order[:-1]]
+        prev, cur = order[:-1], order[1:]
+        if rolling:
+            collides = _roll_collides(times[prev], widths[prev], times[cur], widths[cur], resolution_x)
+        else:
+            collides = times[cur] - times[prev] < FIX_TIME
+        collides &= same_lane
+        if not collides.any():
+            break
+        if rounds <= EXACT_COLLISION_ROUNDS:
+            collides[1:] &= ~collides[:-1]
+        keep[cur[collides]] = False
+    return lanes[carried:], keep[carried:]
+
+
+def lane_tails(lanes, times, widths):
+    """返回每条轨道上最后一条弹幕的 (轨道, 出现时间, 宽度) 数组，用于下一批排版"""
+    order = np.lexsort((times, lanes))
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = lanes[order[1:]] != lanes[order[:-1]]
+    order = order[last]
+    return lanes[order], times[order], widths[order]
+
+
+def layout_danmaku(font_size, sc_font_size, resolution_x, resolution_y, xml_file, ass_file,
+                   max_on_screen=MAX_ON_SCREEN, merge_window=MERGE_WINDOW, chunk_seconds=CHUNK_SECONDS):
+    """
+    按弹幕密度排版并生成 ASS 文件，减少同屏重叠的事件数量以降低 libass 的渲染开销。
+
+    依次合并刷屏弹幕、限制同屏数量、分配轨道并移除碰撞的弹幕。参数顺序与
+    dmconvert.convert_xml_to_ass 相同，文件头和醒目留言与礼物仍使用 dmconvert 渲染。
+
+    弹幕按 chunk_seconds 秒 (向上取合并窗口的整数倍) 分批排版，内存占用只与一批内的弹幕数量有关；
+    每批结束时保留各轨道上最后一条弹幕用于下一批的碰撞检测。批次边界与合并窗口和限制密度的 1 秒区间
+    对齐 (合并窗口为整数秒时)，保留的弹幕与整个文件一起排版相同，只有出现时间相同的弹幕之间轨道可能互换。
+
+    Args:
+        max_on_screen: 同屏最多显示的弹幕数量，0 表示不限制。
+        merge_window: 合并相同内容弹幕的时间窗口 (秒)，0 表示不合并。
+        chunk_seconds: 每批排版的弹幕时间范围 (秒)。
+
+    Returns:
+        各阶段的事件数量：danmaku (原始)、merged (合并后)、capped (限制密度后)、
+        events (最终写入)、side_events (醒目留言/礼物)。
+    """
+    if merge_window > 0:
+        chunk_seconds = math.ceil(chunk_seconds / merge_window) * merge_window
+    rows = max(1, int(resolution_y / font_size))
+    side_root = ET.Element("i")
+    report = {"danmaku": 0, "merged": 0, "capped": 0, "events": 0}
+    # 弹幕类型 -> [已分配的弹幕数量, 各轨道上最后一条保留的弹幕]
+    no_tail = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+    lane_state = {danmaku_type: [0, no_tail] for danmaku_type in DANMAKU_TYPES}
+
+    draw_ass_header(ass_file, resolution_x, resolution_y, font_size, sc_font_size)
+    with open(ass_file, "a", encoding="utf-8") as f:
+        for times, types, colors, text_ids, texts in _read_chunks(xml_file, side_root, chunk_seconds):
+            report["danmaku"] += len(times)
+
+            first, counts = merge_repeats(times, types, colors, text_ids, merge_window)
+            times, types, colors, text_ids = times[first], types[first], colors[first], text_ids[first]
+            report["merged"] += len(times)
+
+            keep = cap_density(times, counts, max_on_screen)
+            times, types, colors, text_ids, counts = times[keep], types[keep], colors[keep], text_ids[keep], counts[keep]
+            report["capped"] += len(times)
+
+            display_texts = [
+                texts[text_id] if count == 1 else f"{texts[text_id]} x{count}"
+                for text_id, count in zip(text_ids.tolist(), counts.tolist())
+            ]
+            widths = np.asarray([get_str_len(text, font_size) for text in display_texts], dtype=np.float64)
+
+            y = np.zeros(len(times), dtype=np.int64)
+            keep = np.zeros(len(times), dtype=bool)
+            for danmaku_type in DANMAKU_TYPES:
+                idx = np.flatnonzero(types == danmaku_type)
+                if len(idx) == 0:
+                    continue
+                state = lane_state[danmaku_type]
+                lanes, lane_keep = assign_lanes(times[idx], widths[idx], rows, resolution_x, danmaku_type == 1,
+                                                start=state[0], tail=state[1])
+                kept = idx[lane_keep]
+                tail_lanes, tail_times, tail_widths = state[1]
+                state[0] += len(idx)
+                state[1] = lane_tails(np.concatenate([tail_lanes, lanes[lane_keep]]),
+                                      np.concatenate([tail_times, times[kept]]),
+                                      np.concatenate([tail_widths, widths[kept]]))
+                keep[idx] = lane_keep
+                if danmaku_type == 4:
+                    y[idx] = resolution_y - font_size * (lanes + 1) + 1
+                else:
+                    y[idx] = 1 + lanes * font_size
+
+            for i in np.flatnonzero(keep).tolist():
+                appear_time = float(times[i])
+                text = display_texts[i]
+                color = ass_color(int(colors[i]))
+                if types[i] == 1:
+                    half = int(widths[i] / 2)
+                    effect = f"\\move({resolution_x + half},{y[i]},{-half},{y[i]})"
+                    layer, style, end_time = 0, "R2L", appear_time + ROLL_TIME
+                else:
+                    effect = f"\\pos({int(resolution_x / 2)},{y[i]})"
+                    layer, style, end_time = 1, "TOP" if types[i] == 5 else "BTM", appear_time + FIX_TIME
+                f.write(f"Dialogue: {layer},{format_time(appear_time)},{format_time(end_time)},{style},,"
+                        f"0000,0000,0000,,{{{effect}}}{{{color}}}{text}\n")
+            report["events"] += int(keep.sum())
+
+    draw_gift_and_guard(ass_file, side_root, sc_font_size, resolution_y)
+    draw_superchat(ass_file, sc_font_size, resolution_y, side_root)
+    report["side_events"] = len(side_root)
+    logger.info(f"弹幕排版完成: 原始 {report['danmaku']} 条 -> 合并刷屏后 {report['merged']} 条 -> "
+                f"限制密度后 {report['capped']} 条 -> "
+                f"写入 {report['events']} 条，醒目留言/礼物 {len(side_root)} 条")
+    return report
@@ -0,0 +1,191 @@
+import heapq
+import logging
+import xml.etree.ElementTree as ET
+
+from dmconvert.utils import format_time, get_str_len, remove_emojis
+from dmconvert.guardgift.gg_handler import draw_gift_and_guard
+from dmconvert.header.header import draw_ass_header
+from dmconvert.superchat.superchat_handler import draw_superchat
+
+logger = logging.getLogger(__name__)
+
+# 滚动弹幕与固定弹幕的显示时长 (秒)，与 dmconvert 保持一致
+ROLL_TIME = 12
+FIX_TIME = 5
+
+# 弹幕乱序容忍窗口 (秒)：录播姬写入的弹幕基本按时间排序，只需在小窗口内重新排序
+REORDER_WINDOW = 30.0
+
+# 醒目留言、礼物和上舰元素数量较少，单独收集后交给 dmconvert 渲染
+SIDE_TAGS = ("sc", "gift", "guard")
+
+
+def ass_color(color: int) -> str:
+    """
+    将 XML 中的十进制 RGB 颜色转换为 ASS 的 BGR 颜色标签。
+
+    dmconvert 按十六进制字符串两两反转，颜色值小于 0x100000 时结果有误，这里按字节转换，其它颜色与 dmconvert 相同。
+    """
+    return f"\\c&H{color & 0xFF:02X}{(color >> 8) & 0xFF:02X}{(color >> 16) & 0xFF:02X}"
+
+
+def iter_danmaku(xml_file, side_root=None):
+    """
+    增量解析弹幕 XML，按出现时间依次返回普通弹幕。
+
+    每处理完一个元素就从树中清除，内存占用与文件大小无关。
+    提供 side_root 时，醒目留言、礼物和上舰元素会被追加到该元素下。
+
+    Yields:
+        (出现时间, 弹幕类型, 颜色, 文本) 元组。
+    """
+    heap = []
+    seq = 0
+    latest = 0.0
+    root = None
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == "d":
+            p_attrs = (elem.get("p") or "").split(",")
+            try:
+                appear_time = float(p_attrs[0])
+                danmaku_type = int(p_attrs[1])
+                color = int(p_attrs[3])
+            except (ValueError, IndexError):
+                logger.warning(f"跳过格式错误的弹幕: p={elem.get('p')}")
+            else:
+                heapq.heappush(heap, (appear_time, seq, danmaku_type, color, elem.text or ""))
+                seq += 1
+                latest = max(latest, appear_time)
+                while heap and heap[0][0] < latest - REORDER_WINDOW:
+                    appear_time, _, danmaku_type, color, text = heapq.heappop(heap)
+                    yield appear_time, danmaku_type, color, text
+        elif elem.tag in SIDE_TAGS:
+            if side_root is not None:
+                side_root.append(elem)
+        else:
+            continue
+        # 只保留根元素，已处理的子元素全部释放
+        if root is not None:
+            root.clear()
+    while heap:
+        appear_time, _, danmaku_type, color, text = heapq.heappop(heap)
+        yield appear_time, danmaku_type, color, text
+
+
+def count_danmaku(xml_file) -> int:
+    """增量解析弹幕 XML，只统计普通弹幕 (d 元素) 的数量，内存占用与文件大小无关"""
+    count = 0
+    root = None
+    for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+        if elem.tag == "d":
+            count += 1
+        if root is not None:
+            root.clear()
+    return count
+
+
+class LaneAllocator:
+    """
+    弹幕轨道分配，算法与 dmconvert 的滚动/底部弹幕分配一致，只保存每条轨道的最后一条弹幕。
+
+    与 dmconvert 相同，没有空闲轨道时放到最接近空闲的轨道上，但不更新该轨道的记录。
+    """
+    def __init__(self, font_size, resolution_x, resolution_y):
+        self.font_size = font_size
+        self.resolution_x = resolution_x
+        self.resolution_y = resolution_y
+        self.rows = max(1, int(resolution_y / font_size))
+        # 每条滚动轨道上最后一条弹幕的 (出现时间, 文本宽度)
+        self.roll_rows = [(-1.0, 0.0)] * self.rows
+        self.btm_rows = [-1.0] * self.rows
+
+    def roll_y(self, appear_time, text_length):
+        velocity = (text_length + self.resolution_x) / ROLL_TIME
+        best_row = 0
+        best_bias = float("-inf")
+        for i, (previous_time, previous_length) in enumerate(self.roll_rows):
+            if previous_time < 0:
+                self.roll_rows[i] = (appear_time, text_length)
+                return 1 + i * self.font_size
+            previous_velocity = (previous_length + self.resolution_x) / ROLL_TIME
+            delta_velocity = velocity - previous_velocity
+            # 两条弹幕出现时的初始间距，为负说明已经重叠
+            delta_x = (appear_time - previous_time) * previous_velocity - (previous_length + text_length) / 2
+            if delta_x < 0:
+                continue
+            if delta_velocity <= 0:
+                self.roll_rows[i] = (appear_time, text_length)
+                return 1 + i * self.font_size
+            bias = appear_time - previous_time - delta_x / delta_velocity
+            if bias > 0:
+                self.roll_rows[i] = (appear_time, text_length)
+                return 1 + i * self.font_size
+            if bias > best_bias:
+                best_bias = bias
+                best_row = i
+        return 1 + best_row * self.font_size
+
+    def btm_y(self, appear_time):
+        best_row = 0
+        best_bias = -1.0
+        for i, previous_time in enumerate(self.btm_rows):
+            delta_time = appear_time - previous_time
+            if previous_time < 0 or delta_time > FIX_TIME:
+                self.btm_rows[i] = appear_time
+                return self.resolution_y - self.font_size * (i + 1) + 1
+            if delta_time > best_bias:
+                best_bias = delta_time
+                best_row = i
+        return self.resolution_y - self.font_size * (best_row + 1) + 1
+
+
+def format_dialogue(appear_time, danmaku_type, color, text, lanes):
+    """生成单条弹幕的 Dialogue 行，与 dmconvert 相同，滚动弹幕 (类型 1) 以外的弹幕都显示在底部"""
+    text = remove_emojis(text, ".")
+    start_time = format_time(appear_time)
+    font_size = lanes.font_size
+    if danmaku_type == 1:
+        text_length = get_str_len(text, font_size)
+        x1 = lanes.resolution_x + int(text_length / 2)
+        x2 = -int(text_length / 2)
+        y = lanes.roll_y(appear_time, text_length)
+        layer, style, end_time = 0, "R2L", format_time(appear_time + ROLL_TIME)
+        effect = f"\\move({x1},{y},{x2},{y})"
+    else:
+        y = lanes.btm_y(appear_time)
+        layer, style, end_time = 1, "BTM", format_time(appear_time + FIX_TIME)
+        effect = f"\\pos({int(lanes.resolution_x / 2)},{y})"
+    return f"Dialogue: {layer},{start_time},{end_time},{style},,0000,0000,0000,,{{{effect}}}{{{ass_color(color)}}}{text}\n"
+
+
+def convert_xml_to_ass_streaming(font_size, sc_font_size, resolution_x, resolution_y, xml_file, ass_file):
+    """
+    流式地将弹幕 XML 转换为 ASS 文件。
+
+    参数顺序与 dmconvert.convert_xml_to_ass 相同。普通弹幕边解析边写入，
+    文件头和醒目留言与礼物仍使用 dmconvert 渲染。
+
+    Returns:
+        包含写入的普通弹幕数量和醒目留言/礼物数量的字典。
+    """
+    lanes = LaneAllocator(font_size, resolution_x, resolution_y)
+    side_root = ET.Element("i")
+    danmaku_count = 0
+    draw_ass_header(ass_file, resolution_x, resolution_y, font_size, sc_font_size)
+    with open(ass_file, "a", encoding="utf-8") as f:
+        for appear_time, danmaku_type, color, text in iter_danmaku(xml_file, side_root):
+            f.write(format_dialogue(appear_time, danmaku_type, color, text, lanes))
+            danmaku_count += 1
+
+    draw_gift_and_guard(ass_file, side_root, sc_font_size, resolution_y)
+    draw_superchat(ass_file, sc_font_size, resolution_y, side_root)
+    logger.info(f"流式转换完成: {danmaku_count} 条弹幕，{len(side_root)} 条醒目留言/礼物")
+    return {"danmaku": danmaku_count, "side_events": len(side_root)}
@@ -0,0 +1,137 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 录制中的文件后缀，如 xxx.flv.part
+PART_SUFFIX = ".part"
+
+
+def split_stem(name: str):
+    """
+    将文件名拆分为 (录播主文件名, 小写扩展名)。
+
+    录制中的文件保留两段扩展名，如 a.flv.part -> ("a", ".flv.part")。
+    """
+    stem, ext = os.path.splitext(name)
+    if ext.lower() == PART_SUFFIX:
+        stem, inner = os.path.splitext(stem)
+        ext = inner + ext
+    return stem, ext.lower()
+
+
+class FolderSnapshot:
+    """
+    单个目录的快照：子目录列表、按录播主文件名分组的文件 (os.DirEntry)，以及列举前读取的目录修改时间。
+
+    修改时间在列举目录之前读取，保证扫描期间新增的文件会在下一次扫描时被发现。
+    """
+    def __init__(self, path: str, dir_mtime: float, entries):
+        self.path = path
+        self.dir_mtime = dir_mtime
+        self.subdirs = []
+        # 主文件名 -> {扩展名: DirEntry}
+        self.stems = {}
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                self.subdirs.append(entry.path)
+            else:
+                stem, ext = split_stem(entry.name)
+                self.stems.setdefault(stem, {})[ext] = entry
+
+    def get(self, stem: str, ext: str):
+        """返回指定主文件名和扩展名的 DirEntry，不存在时返回 None"""
+        return self.stems.get(stem, {}).get(ext)
+
+    def has(self, stem: str, ext: str) -> bool:
+        return self.get(stem, ext) is not None
+
+    def files(self, ext: str) -> list:
+        """返回指定扩展名的所有文件，按文件名排序"""
+        entries = [files[ext] for files in self.stems.values() if ext in files]
+        return sorted(entries, key=lambda entry: entry.name)
+
+    def file_count(self) -> int:
+        return sum(len(files) for files in self.stems.values())
+
+
+class DirectoryIndex:
+    """
+    每个处理周期只用 os.scandir 列举一次的目录索引，由清理、弹幕转换和压制各阶段共享。
+
+    目录在第一次访问时扫描，之后直接复用快照；文件按录播主文件名分组，FLV / XML / ASS
+    的配对为 O(1) 查找。文件的 stat 结果缓存在 DirEntry 中，同一个文件在各阶段只 stat 一次。
+    """
+    def __init__(self):
+        # 目录路径 -> FolderSnapshot
+        self.folders = {}
+
+    def _scan(self, path: str):
+        try:
+            dir_mtime = os.stat(path).st_mtime
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.warning(f"无法读取目录 {path}: {e}")
+            return None
+        snapshot = FolderSnapshot(path, dir_mtime, entries)
+        self.folders[path] = snapshot
+        logger.debug(f"已索引目录 {path}: {snapshot.file_count()} 个文件，{len(snapshot.subdirs)} 个子目录")
+        return snapshot
+
+    def folder(self, path: str):
+        """返回单个目录的快照 (不递归)，首次访问时扫描；目录无法读取时返回 None"""
+        path = os.path.abspath(path)
+        snapshot = self.folders.get(path)
+        if snapshot is None:
+            snapshot = self._scan(path)
+        return snapshot
+
+    def rescan(self, path: str):
+        """重新列举目录，用于本周期内已经修改过的目录 (如合并录播分段后)"""
+        path = os.path.abspath(path)
+        self.folders.pop(path, None)
+        return self._scan(path)
+
+    def walk(self, folder: str):
+        """递归遍历目录，依次返回每个目录的快照，已扫描过的目录不会重复列举"""
+        stack = [os.path.abspath(folder)]
+        while stack:
+            snapshot = self.folder(stack.pop())
+            if snapshot is None:
+                continue
+            stack.extend(snapshot.subdirs)
+            yield snapshot
+
+    def entry(self, path: str):
+        """返回文件的 DirEntry，所在目录未索引或文件不存在时返回 None"""
+        snapshot = self.folders.get(os.path.dirname(os.path.abspath(path)))
+        if snapshot is None:
+            return None
+        return snapshot.get(*split_stem(os.path.basename(path)))
+
+    def exists(self, path: str) -> bool:
+        """文件是否存在；所在目录未索引时直接检查文件系统"""
+        path = os.path.abspath(path)
+        if os.path.dirname(path) not in self.folders:
+            return os.path.exists(path)
+        return self.entry(path) is not None
+
+    def stat(self, path: str) -> os.stat_result:
+        """返回文件的 stat 结果，优先复用 DirEntry 缓存的结果"""
+        entry = self.entry(path)
+        if entry is None:
+            return os.stat(path)
+        return entry.stat()
+
+    def discard(self, path: str):
+        """从索引中移除已删除的文件"""
+        snapshot = self.folders.get(os.path.dirname(os.path.abspath(path)))
+        if snapshot is None:
+            return
+        stem, ext = split_stem(os.path.basename(path))
+        files = snapshot.stems.get(stem)
+        if files is not None:
+            files.pop(ext, None)
+            if not files:
+                del snapshot.stems[stem]
@@ -0,0 +1,301 @@
+import os
+import time
+import logging
+import threading
+
+from apis import metrics
+from apis.job_manager import JobCancelled
+
+logger = logging.getLogger(__name__)
+
+# 支持的排序策略
+ORDER_POLICIES = ("smallest", "largest", "oldest")
+
+
+class EncodeJob:
+    """
+    单个压制任务，记录排队与执行时间。
+    """
+    def __init__(self, video: str, ass: str, mp4: str, hardware: bool = True, duration: float = None,
+                 stat: os.stat_result = None, room: str = None, priority: int = 1, mode: str = "burn"):
+        self.video = video
+        self.ass = ass
+        # 输出文件，softsub 模式下为 MKV
+        self.mp4 = mp4
+        self.hardware = hardware
+        # 输出模式 (见 apis.video_encoder.OUTPUT_MODES)，remux / softsub 只复制流，不重新编码
+        self.mode = mode
+        # 视频时长 (秒)，来自探测缓存，用于计算压制速度
+        self.duration = duration
+        # 所属房间与压制优先级，多个房间共享调度器时按优先级公平分配槽位
+        self.room = room
+        self.priority = max(1, priority)
+        try:
+            # 可以传入目录索引中已缓存的 stat 结果，避免重复 stat
+            if stat is None:
+                stat = os.stat(video)
+            self.size = stat.st_size
+            self.mtime = stat.st_mtime
+        except OSError:
+            self.size = 0
+            self.mtime = 0.0
+        self.status = "queued"
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # 实际完成压制的后端名称
+        self.backend = None
+        # 最近一次 ffmpeg 进度 (帧数、fps、速度、剩余时间等)
+        self.progress = None
+        # 任务结束后的回调，参数为任务本身
+        self.on_done = None
+        # 执行压制的函数，为 None 时使用调度器的 encode_func
+        self.encode_func = None
+        # 压制和结束回调都已完成
+        self.completed = False
+
+    def set_progress(self, progress: dict):
+        self.progress = progress
+
+    @property
+    def kind(self) -> str:
+        if self.mode != "burn":
+            return "copy"
+        return "hardware" if self.hardware else "software"
+
+    def to_dict(self) -> dict:
+        wait_seconds = None
+        encode_seconds = None
+        speed = None
+        if self.started_at is not None:
+            wait_seconds = round(self.started_at - self.queued_at, 3)
+            if self.finished_at is not None:
+                encode_seconds = round(self.finished_at - self.started_at, 3)
+                if self.duration and encode_seconds and self.status == "success":
+                    speed = round(self.duration / encode_seconds, 3)
+        return {
+            "video": self.video,
+            "mp4": self.mp4,
+            "room": self.room,
+            "mode": self.mode,
+            "kind": self.kind,
+            "backend": self.backend,
+            "size_bytes": self.size,
+            "duration": self.duration,
+            "status": self.status,
+            "error": self.error,
+            "wait_seconds": wait_seconds,
+            "encode_seconds": encode_seconds,
+            "speed": speed,
+            "progress": self.progress,
+        }
+
+
+class EncodeScheduler:
+    """
+    压制任务调度器：限制并发的 ffmpeg 数量，并分别限制硬件会话与软件编码的并发数。
+
+    多个房间共享同一个调度器时，空闲槽位优先分配给 (运行中的任务数 / 优先级) 最小的房间，
+    相同时分配给已分配的压制量 (文件大小 / 优先级 累计) 最少的房间，房间内再按排序策略选择任务。
+    因此一个房间的超长录播或大量积压不会占满所有槽位，其它房间的任务仍能及时开始。
+
+    只复制流的 remux / softsub 任务使用独立的 copy 槽位，不计入 max_workers 和房间份额，
+    不会排在数小时的压制任务后面。
+    """
+    def __init__(self, encode_func, max_workers: int = 2, hw_slots: int = 1,
+                 sw_slots: int = 1, order: str = "smallest", copy_slots: int = 2):
+        """
+        初始化 EncodeScheduler。
+
+        Args:
+            encode_func: 实际执行压制的函数，签名为 encode_func(job)；任务自带 encode_func 时使用任务的。
+            max_workers: 同时运行的 ffmpeg 进程总数上限。
+            hw_slots: 同时运行的硬件编码会话上限。
+            sw_slots: 同时运行的软件编码上限。
+            order: 排队顺序，可选 smallest（小文件优先）、largest（大文件优先）、oldest（旧文件优先）。
+            copy_slots: 同时运行的 remux / softsub 封装任务上限。
+        """
+        if order not in ORDER_POLICIES:
+            raise ValueError(f"不支持的排序策略: {order}，可选: {', '.join(ORDER_POLICIES)}")
+        self.encode_func = encode_func
+        self.max_workers = max(1, max_workers)
+        self.limits = {"hardware": max(1, hw_slots), "software": max(1, sw_slots), "copy": max(1, copy_slots)}
+        self.order = order
+        self._cond = threading.Condition()
+        self._running = {"hardware": 0, "software": 0, "copy": 0}
+        self._pending = []
+        self._jobs = []
+        self._threads = []
+        self._started = None
+        # 房间 -> 运行中的任务数 / 按优先级加权的已分配压制量
+        self._room_running = {}
+        self._room_served = {}
+
+    def order_key(self, size: int, mtime: float):
+        """按排序策略计算源文件的排队键，值越小越先压制；可以在创建压制任务之前用于安排其它阶段的顺序"""
+        if self.order == "smallest":
+            return size
+        if self.order == "largest":
+            return -size
+        return mtime
+
+    def _sort_key(self, job):
+        return self.order_key(job.size, job.mtime)
+
+    def _room_key(self, room, priority):
+        return self._room_running.get(room, 0) / priority, self._room_served.get(room, 0.0)
+
+    def _has_slot(self, job) -> bool:
+        if self._running[job.kind] >= self.limits[job.kind]:
+            return False
+        return job.kind == "copy" or self._running["hardware"] + self._running["software"] < self.max_workers
+
+    def _next_job(self):
+        """在持有锁的情况下选择下一个可以启动的任务：封装任务优先，再按公平份额选房间、按排序策略选任务"""
+        candidates = [job for job in self._pending if self._has_slot(job)]
+        if not candidates:
+            return None
+        copies = [job for job in candidates if job.kind == "copy"]
+        if copies:
+            return min(copies, key=self._sort_key)
+        rooms = {job.room: job.priority for job in candidates}
+        room = min(rooms, key=lambda r: self._room_key(r, rooms[r]))
+        return min((job for job in candidates if job.room == room), key=self._sort_key)
+
+    def _dispatch(self):
+        """在持有锁的情况下，启动所有有空闲槽位的任务"""
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            self._pending.remove(job)
+            self._running[job.kind] += 1
+            if job.kind != "copy":
+                self._room_running[job.room] = self._room_running.get(job.room, 0) + 1
+                self._room_served[job.room] = self._room_served.get(job.room, 0.0) + max(job.size, 1) / job.priority
+            thread = threading.Thread(target=self._worker, args=(job,), daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _worker(self, job):
+        job.started_at = time.time()
+        job.status = "running"
+        logger.info(f"开始压制任务 ({job.kind}): {job.video}，排队 {job.started_at - job.queued_at:.1f}s")
+        try:
+            (job.encode_func or self.encode_func)(job)
+            job.status = "success"
+        except JobCancelled as e:
+            job.status = "cancelled"
+            job.error = str(e)
+            logger.warning(f"压制任务已取消: {job.video}")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"压制任务失败: {job.video}: {e}")
+        finally:
+            job.finished_at = time.time()
+            self._record_metrics(job)
+            with self._cond:
+                self._running[job.kind] -= 1
+                if job.kind != "copy":
+                    self._room_running[job.room] -= 1
+                self._dispatch()
+                self._cond.notify_all()
+            try:
+                if job.on_done is not None:
+                    job.on_done(job)
+            finally:
+                with self._cond:
+                    job.completed = True
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _record_metrics(job):
+        metrics.QUEUE_DEPTH.dec(queue="encode")
+        metrics.ENCODE_BACKLOG_SECONDS.dec(job.duration or 0)
+        metrics.STAGE_RESULTS.inc(stage="encode", status=job.status)
+        if job.status != "success":
+            return
+        encode_seconds = job.finished_at - job.started_at
+        metrics.STAGE_SECONDS.observe(encode_seconds, stage="encode")
+        metrics.STAGE_BYTES_IN.inc(job.size, stage="encode")
+        try:
+            metrics.STAGE_BYTES_OUT.inc(os.path.getsize(job.mp4), stage="encode")
+        except OSError:
+            pass
+        if job.duration and encode_seconds > 0:
+            metrics.ENCODE_SPEED.observe(job.duration / encode_seconds, backend=job.backend or job.kind)
+
+    def submit(self, job):
+        """提交一个任务，有空闲槽位时立即开始，否则按排序策略排队"""
+        metrics.QUEUE_DEPTH.inc(queue="encode")
+        metrics.ENCODE_BACKLOG_SECONDS.inc(job.duration or 0)
+        with self._cond:
+            if self._started is None:
+                self._started = time.time()
+            job.queued_at = time.time()
+            waiting = [j for j in self._pending if j.kind != "copy"]
+            if job.kind != "copy" and not self._room_running.get(job.room) and all(j.room != job.room for j in waiting):
+                # 房间从空闲变为有任务时，已分配量追平其它活跃房间，避免长时间空闲的房间随后独占槽位
+                active = [self._room_served[r] for r in self._room_served
+                          if self._room_running.get(r) or any(j.room == r for j in waiting)]
+                if active:
+                    self._room_served[job.room] = max(self._room_served.get(job.room, 0.0), min(active))
+            self._jobs.append(job)
+            self._pending.append(job)
+            self._dispatch()
+
+    def join(self) -> dict:
+        """
+        等待所有已提交的任务完成。
+
+        Returns:
+            包含调度参数、每个任务耗时与汇总信息的字典。
+        """
+        with self._cond:
+            while self._pending or sum(self._running.values()):
+                self._cond.wait()
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join()
+        return self._summary(self._jobs, self._started)
+
+    def wait(self, jobs) -> dict:
+        """
+        只等待指定的任务完成 (包括结束回调)，用于多个流水线共享同一个调度器。
+        完成的任务会从调度器中移除。
+
+        Returns:
+            格式同 join()，只包含指定的任务。
+        """
+        jobs = list(jobs)
+        with self._cond:
+            while not all(job.completed for job in jobs):
+                self._cond.wait()
+            finished = set(map(id, jobs))
+            self._jobs = [job for job in self._jobs if id(job) not in finished]
+        started = min((job.queued_at for job in jobs), default=None)
+        return self._summary(jobs, started)
+
+    def _summary(self, jobs, started) -> dict:
+        job_dicts = [job.to_dict() for job in jobs]
+        return {
+            "order": self.order,
+            "max_workers": self.max_workers,
+            "hw_slots": self.limits["hardware"],
+            "sw_slots": self.limits["software"],
+            "copy_slots": self.limits["copy"],
+            "wall_seconds": round(time.time() - started, 3) if started else 0.0,
+            "succeeded": sum(1 for j in job_dicts if j["status"] == "success"),
+            "failed": sum(1 for j in job_dicts if j["status"] == "failed"),
+            "cancelled": sum(1 for j in job_dicts if j["status"] == "cancelled"),
+            "jobs": job_dicts,
+        }
+
+    def run(self, jobs) -> dict:
+        """提交所有任务并阻塞直到全部完成，返回值同 join()"""
+        for job in jobs:
+            self.submit(job)
+        return self.join()
@@ -0,0 +1,291 @@
+import os
+import glob
+import time
+import logging
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# 显卡渲染节点，QSV / VAAPI 编码都需要访问
+RENDER_NODE_PATTERN = "/dev/dri/renderD*"
+
+# 微基准测试使用的合成画面
+BENCHMARK_SIZE = "1920x1080"
+BENCHMARK_RATE = 30
+BENCHMARK_FRAMES = 60
+
+
+def escape_filter_arg(value: str) -> str:
+    """
+    转义滤镜参数中的文件路径。
+
+    路径需要经过两层转义：滤镜参数层 (\\ ' :) 和滤镜图层 (\\ ' [ ] , ;)，
+    否则包含冒号、逗号或方括号的录播标题会导致滤镜解析失败。
+    """
+    for ch in "\\':":
+        value = value.replace(ch, "\\" + ch)
+    for ch in "\\'[],;":
+        value = value.replace(ch, "\\" + ch)
+    return value
+
+
+def list_ffmpeg_encoders() -> set:
+    """返回当前 ffmpeg 支持的编码器名称集合，ffmpeg 不可用时返回空集合"""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            timeout=30,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return set()
+    encoders = set()
+    for line in result.stdout.splitlines():
+        parts = line.split()
+        # 编码器行形如 " V....D libx264   libx264 H.264 ..."
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] in "VAS":
+            encoders.add(parts[1])
+    return encoders
+
+
+class EncoderBackend:
+    """
+    压制后端基类：负责生成 ffmpeg 参数、检测是否可用以及运行微基准测试。
+    """
+    name = "base"
+    codec = None
+    hardware = False
+
+    def __init__(self):
+        # 微基准测试结果 (帧/秒)，未测试时为 None
+        self.benchmark_fps = None
+
+    def input_args(self) -> list:
+        """输入文件之前的参数 (硬件设备初始化等)"""
+        return []
+
+    def filter_chain(self, ass: str = None) -> str:
+        """视频滤镜链，ass 为 None 时只包含上传到硬件所需的滤镜"""
+        raise NotImplementedError
+
+    def codec_args(self) -> list:
+        """视频编码器及质量参数"""
+        raise NotImplementedError
+
+    def build_command(self, video: str, ass: str, mp4: str, start: float = None, end: float = None,
+                      audio: bool = True) -> list:
+        """
+        生成压制命令：烧录弹幕并复制音频流。
+
+        指定 start / end 时只压制该时间段 (分段压制)，audio 为 False 时不输出音频。
+        """
+        seek = []
+        if start:
+            seek += ["-ss", f"{start:.3f}"]
+        if end is not None:
+            seek += ["-t", f"{end - (start or 0):.3f}"]
+        return [
+            "ffmpeg", "-hide_banner",
+            *self.input_args(),
+            *seek,
+            "-i", video,
+            "-vf", self.filter_chain(ass),
+            *self.codec_args(),
+            *(["-c:a", "copy"] if audio else ["-an"]),
+            "-y", mp4,
+        ]
+
+    def benchmark_command(self, frames: int) -> list:
+        return [
+            "ffmpeg", "-hide_banner", "-v", "error",
+            *self.benchmark_input_args(),
+            "-f", "lavfi", "-i", f"testsrc2=size={BENCHMARK_SIZE}:rate={BENCHMARK_RATE}",
+            "-frames:v", str(frames),
+            "-vf", self.filter_chain(None),
+            *self.codec_args(),
+            "-f", "null", "-",
+        ]
+
+    def benchmark_input_args(self) -> list:
+        return self.input_args()
+
+    def device_available(self) -> bool:
+        return True
+
+    def probe(self, encoders: set) -> bool:
+        """检测 ffmpeg 是否包含该编码器以及所需设备是否存在"""
+        return self.codec in encoders and self.device_available()
+
+    def benchmark(self, frames: int = BENCHMARK_FRAMES, timeout: float = 120) -> float:
+        """
+        编码一段合成画面，返回编码速度 (帧/秒)。
+
+        同时作为硬件初始化检测：设备无法初始化时 ffmpeg 会报错，抛出 RuntimeError。
+        """
+        started = time.perf_counter()
+        try:
+            result = subprocess.run(
+                self.benchmark_command(frames),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(f"{self.name} 基准测试超过 {timeout}s 未完成")
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            error_lines = result.stderr.strip().splitlines()
+            raise RuntimeError(f"{self.name} 初始化失败: {error_lines[-1] if error_lines else result.returncode}")
+        self.benchmark_fps = round(frames / elapsed, 1) if elapsed > 0 else None
+        return self.benchmark_fps
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name} fps={self.benchmark_fps}>"
+
+
+class QsvBackend(EncoderBackend):
+    """Intel Quick Sync 硬件解码 + h264_qsv 编码"""
+    name = "qsv"
+    codec = "h264_qsv"
+    hardware = True
+
+    def __init__(self, quality: int = 25):
+        super().__init__()
+        self.quality = quality
+
+    def device_available(self) -> bool:
+        # 只有 /dev/dri 目录 (如仅有 card 节点或容器中映射了空目录) 时无法编码，需要存在渲染节点
+        return bool(glob.glob(RENDER_NODE_PATTERN))
+
+    def input_args(self) -> list:
+        return ["-init_hw_device", "qsv=hw", "-hwaccel", "qsv", "-hwaccel_output_format", "qsv"]
+
+    def benchmark_input_args(self) -> list:
+        # 合成画面在内存中，只初始化设备并上传，不使用硬件解码
+        return ["-init_hw_device", "qsv=hw", "-filter_hw_device", "hw"]
+
+    def filter_chain(self, ass: str = None) -> str:
+        upload = "hwupload=extra_hw_frames=64"
+        if ass is None:
+            return f"format=nv12,{upload}"
+        return f"ass={escape_filter_arg(ass)},{upload}"
+
+    def codec_args(self) -> list:
+        return ["-c:v", "h264_qsv", "-preset", "veryfast", "-global_quality", str(self.quality)]
+
+
+class VaapiBackend(EncoderBackend):
+    """VAAPI 编码 (Intel / AMD)，软件解码并烧录弹幕后上传到显卡编码"""
+    name = "vaapi"
+    codec = "h264_vaapi"
+    hardware = True
+
+    def __init__(self, device: str = "/dev/dri/renderD128", quality: int = 25):
+        super().__init__()
+        self.device = device
+        self.quality = quality
+
+    def device_available(self) -> bool:
+        return os.path.exists(self.device)
+
+    def input_args(self) -> list:
+        return ["-vaapi_device", self.device]
+
+    def filter_chain(self, ass: str = None) -> str:
+        upload = "format=nv12,hwupload"
+        if ass is None:
+            return upload
+        return f"ass={escape_filter_arg(ass)},{upload}"
+
+    def codec_args(self) -> list:
+        return ["-c:v", "h264_vaapi", "-qp", str(self.quality)]
+
+
+class SoftwareBackend(EncoderBackend):
+    """libx264 / libx265 软件编码，不依赖任何显卡"""
+    hardware = False
+
+    def __init__(self, codec: str = "libx264", preset: str = "veryfast", crf: int = None):
+        super().__init__()
+        self.codec = codec
+        self.name = "x265" if codec == "libx265" else "x264"
+        self.preset = preset
+        # x265 相同画质下 CRF 约比 x264 高 5
+        self.crf = crf if crf is not None else (28 if codec == "libx265" else 23)
+
+    def filter_chain(self, ass: str = None) -> str:
+        if ass is None:
+            return "format=yuv420p"
+        return f"ass={escape_filter_arg(ass)},format=yuv420p"
+
+    def codec_args(self) -> list:
+        args = ["-c:v", self.codec, "-preset", self.preset, "-crf", str(self.crf)]
+        if self.codec == "libx265":
+            # 兼容 Apple 设备播放
+            args += ["-tag:v", "hvc1"]
+        return args
+
+
+def create_backends(names: str = "auto", vaapi_device: str = "/dev/dri/renderD128",
+                    hw_quality: int = 25, sw_preset: str = "veryfast", sw_crf: int = None) -> list:
+    """
+    按名称创建压制后端。
+
+    Args:
+        names: 逗号分隔的后端名称 (qsv, vaapi, x264, x265)，auto 表示 qsv,vaapi,x264。
+    """
+    factories = {
+        "qsv": lambda: QsvBackend(quality=hw_quality),
+        "vaapi": lambda: VaapiBackend(device=vaapi_device, quality=hw_quality),
+        "x264": lambda: SoftwareBackend("libx264", preset=sw_preset, crf=sw_crf),
+        "x265": lambda: SoftwareBackend("libx265", preset=sw_preset, crf=sw_crf),
+    }
+    if names.strip().lower() == "auto":
+        names = "qsv,vaapi,x264"
+    backends = []
+    for name in (n.strip().lower() for n in names.split(",")):
+        if not name:
+            continue
+        if name not in factories:
+            raise ValueError(f"不支持的压制后端: {name}，可选: {', '.join(factories)}")
+        backends.append(factories[name]())
+    return backends
+
+
+def select_backends(backends: list, benchmark: bool = True, frames: int = BENCHMARK_FRAMES) -> list:
+    """
+    检测可用的压制后端，并按微基准测试的速度从快到慢排序。
+
+    硬件初始化失败的后端会被排除；benchmark 为 False 时只做单帧初始化检测，保持配置中的顺序。
+    始终返回至少一个后端：全部检测失败时保留最后一个配置的后端，由压制时报告真实错误。
+
+    Returns:
+        可用后端列表，第一个为首选后端，其余为压制失败时的回退顺序。
+    """
+    encoders = list_ffmpeg_encoders()
+    available = []
+    for backend in backends:
+        if not backend.probe(encoders):
+            logger.info(f"压制后端 {backend.name} 不可用: ffmpeg 不支持 {backend.codec} 或设备不存在")
+            continue
+        try:
+            fps = backend.benchmark(frames if benchmark else 1)
+        except RuntimeError as e:
+            logger.warning(f"压制后端 {backend.name} 检测失败: {e}")
+            continue
+        if benchmark:
+            logger.info(f"压制后端 {backend.name} 基准测试: {fps} fps")
+        else:
+            backend.benchmark_fps = None
+        available.append(backend)
+
+    if benchmark:
+        available.sort(key=lambda b: b.benchmark_fps or 0, reverse=True)
+    if not available and backends:
+        logger.error(f"没有检测到可用的压制后端，仍使用 {backends[-1].name}")
+        available = [backends[-1]]
+    logger.info(f"压制后端顺序: {', '.join(b.name for b in available)}")
+    return available
@@ -0,0 +1,147 @@
+import time
+import logging
+import threading
+import subprocess
+from collections import deque
+from contextlib import nullcontext
+
+from apis import metrics
+
+logger = logging.getLogger(__name__)
+
+# 出错时保留的 ffmpeg 日志行数
+LOG_TAIL_LINES = 200
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_progress_block(fields: dict, duration: float = None) -> dict:
+    """
+    将 ffmpeg -progress 输出的一组 key=value 转换为进度字典。
+
+    Args:
+        fields: 一个进度块中的字段，以 progress=continue/end 结束。
+        duration: 输入视频时长 (秒)，用于计算百分比和剩余时间。
+    """
+    out_time_us = _parse_float(fields.get("out_time_us") or fields.get("out_time_ms"))
+    out_time = round(out_time_us / 1_000_000, 3) if out_time_us is not None and out_time_us >= 0 else None
+    speed = _parse_float((fields.get("speed") or "").strip().rstrip("x"))
+    frame = _parse_float(fields.get("frame"))
+    total_size = _parse_float(fields.get("total_size"))
+    percent = None
+    eta_seconds = None
+    if duration and out_time is not None:
+        percent = round(min(100.0, out_time / duration * 100), 1)
+        if speed:
+            eta_seconds = round(max(0.0, duration - out_time) / speed, 1)
+    return {
+        "frame": int(frame) if frame is not None else None,
+        "fps": _parse_float(fields.get("fps")),
+        "speed": speed,
+        "out_time": out_time,
+        "total_size": int(total_size) if total_size is not None else None,
+        "duration": duration,
+        "percent": percent,
+        "eta_seconds": eta_seconds,
+        "state": fields.get("progress"),
+        "updated_at": time.time(),
+    }
+
+
+def run_ffmpeg(cmd: list, duration: float = None, on_progress=None, log_lines: int = LOG_TAIL_LINES,
+               control=None, priority=None):
+    """
+    执行 ffmpeg 并以流的方式读取机器可读的进度输出。
+
+    标准输出只包含 -progress 的 key=value 信息，标准错误在线程中读取，只保留最后 log_lines 行，
+    长时间压制的内存占用不会随日志增长。
+
+    Args:
+        cmd: 以 "ffmpeg" 开头的参数列表。
+        duration: 输入视频时长 (秒)，用于计算进度百分比和剩余时间。
+        on_progress: 进度回调，每个进度块 (约每秒一次) 调用一次，参数为进度字典。
+        log_lines: 保留的日志行数。
+        control: 可选的 JobControl (见 apis.job_manager)，ffmpeg 进程会登记到该任务，任务取消时被结束。
+        priority: 可选的 ProcessPriority (见 apis.process_priority)，设置 ffmpeg 的 CPU / IO 优先级和 CPU 亲和性。
+
+    Raises:
+        subprocess.CalledProcessError: ffmpeg 退出码非 0，stderr 为最后的日志内容。
+        JobCancelled: 任务被取消。
+    """
+    if control is not None:
+        control.check()
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    if priority is not None:
+        cmd = priority.wrap(cmd)
+    log_tail = deque(maxlen=log_lines)
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          text=True, encoding="utf-8", errors="replace") as proc, \
+            (control.track(proc) if control is not None else nullcontext()):
+        log_thread = threading.Thread(
+            target=lambda: log_tail.extend(line.rstrip("\n") for line in proc.stderr),
+            daemon=True,
+        )
+        log_thread.start()
+        fields = {}
+        for line in proc.stdout:
+            key, sep, value = line.strip().partition("=")
+            if not sep:
+                continue
+            fields[key] = value
+            if key == "progress":
+                if on_progress is not None:
+                    try:
+                        on_progress(parse_progress_block(fields, duration))
+                    except Exception as e:
+                        logger.warning(f"进度回调出错: {e}")
+                fields = {}
+        log_thread.join()
+    if proc.returncode != 0:
+        if control is not None:
+            control.check()
+        metrics.SUBPROCESS_FAILURES.inc(tool="ffmpeg")
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr="\n".join(log_tail))
+    return "\n".join(log_tail)
+
+
+class ProgressRegistry:
+    """
+    正在进行的压制任务的实时进度，供 /status 和 SSE 接口读取。
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._entries = {}
+        # 每次更新递增，SSE 客户端据此判断是否有新进度
+        self.version = 0
+
+    def update(self, key: str, progress: dict):
+        with self._cond:
+            self._entries[key] = {"video": key, **progress}
+            self.version += 1
+            self._cond.notify_all()
+
+    def remove(self, key: str):
+        with self._cond:
+            if self._entries.pop(key, None) is not None:
+                self.version += 1
+                self._cond.notify_all()
+
+    def snapshot(self) -> list:
+        with self._cond:
+            return [dict(entry) for entry in self._entries.values()]
+
+    def wait(self, version: int, timeout: float = None):
+        """
+        等待进度发生变化。
+
+        Returns:
+            (当前版本号, 进度列表)；超时未变化时版本号与传入值相同。
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version, [dict(entry) for entry in self._entries.values()]
@@ -0,0 +1,200 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+logger = logging.getLogger(__name__)
+
+# inotify 事件掩码 (见 <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+# 不支持 inotify 或远端修改无法触发事件的文件系统
+UNSUPPORTED_FS_TYPES = ("nfs", "nfs4", "cifs", "smb", "smb3", "smbfs", "9p", "sshfs", "fuse.sshfs", "fuse.rclone")
+
+# 需要关注的已完成录播文件后缀
+WATCHED_SUFFIXES = (".flv", ".xml")
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def _filesystem_type(path: str):
+    """根据 /proc/mounts 返回路径所在挂载点的文件系统类型，无法判断时返回 None"""
+    path = os.path.realpath(path)
+    best_mount, best_type = "", None
+    try:
+        with open("/proc/mounts", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount_point = parts[1].replace("\\040", " ")
+                if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) \
+                        and len(mount_point) > len(best_mount):
+                    best_mount, best_type = mount_point, parts[2]
+    except OSError:
+        return None
+    return best_type
+
+
+def inotify_supported(path: str) -> bool:
+    """判断目录是否可以使用 inotify 监听 (Linux 本地文件系统)"""
+    if _load_libc() is None or not os.path.isdir(path):
+        return False
+    fs_type = _filesystem_type(path)
+    if fs_type is not None and fs_type.lower() in UNSUPPORTED_FS_TYPES:
+        logger.warning(f"目录 {path} 位于 {fs_type} 文件系统，inotify 无法可靠感知变化")
+        return False
+    return True
+
+
+class FolderWatcher:
+    """
+    基于 inotify 的目录监听器。
+
+    当 .flv.part 被重命名为 .flv、或 XML 弹幕文件写入关闭时记录该文件，
+    文件在 settle_seconds 内大小和修改时间都不再变化后才回调，避免处理写了一半的文件。
+    """
+    def __init__(self, folders, callback, settle_seconds: float = 5.0):
+        """
+        初始化 FolderWatcher。
+
+        Args:
+            folders: 需要监听的目录列表 (包含子目录)。
+            callback: 文件就绪后的回调函数，参数为就绪文件路径列表；队列溢出时参数为空列表
+                (表示需要完整扫描，同一轮中已就绪的文件也包含在内)。
+            settle_seconds: 文件保持不变多久后视为写入完成。
+        """
+        self.folders = [os.path.abspath(f) for f in folders]
+        self.callback = callback
+        self.settle_seconds = settle_seconds
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "当前系统不支持 inotify")
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 失败: {os.strerror(err)}")
+        self._watches = {}
+        # 路径 -> (大小, 修改时间, 最后一次变化的时间)
+        self._pending = {}
+        self._stopped = False
+        for folder in self.folders:
+            self._add_tree(folder)
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"无法监听目录 {path}: {os.strerror(err)}")
+        self._watches[wd] = path
+
+    def _add_tree(self, folder):
+        self._add_watch(folder)
+        for root, dirs, _ in os.walk(folder):
+            for d in dirs:
+                try:
+                    self._add_watch(os.path.join(root, d))
+                except OSError as e:
+                    logger.warning(f"{e}")
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def _handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify 事件队列溢出，触发一次完整扫描")
+            return True
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return False
+        folder = self._watches.get(wd)
+        if folder is None or not name:
+            return False
+        path = os.path.join(folder, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._add_tree(path)
+                except OSError as e:
+                    logger.warning(f"{e}")
+            return False
+        if not name.lower().endswith(WATCHED_SUFFIXES):
+            return False
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            logger.info(f"检测到文件就绪事件: {path}")
+            self._pending.setdefault(path, (None, None, time.monotonic()))
+        return False
+
+    def _collect_settled(self):
+        """返回已经稳定的文件，并更新仍在变化的文件状态"""
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime, changed_at) in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # 文件已被删除或重命名
+                del self._pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self._pending[path] = (stat.st_size, stat.st_mtime, now)
+            elif now - changed_at >= self.settle_seconds:
+                del self._pending[path]
+                ready.append(path)
+        return ready
+
+    def run(self):
+        """阻塞运行监听循环，直到调用 stop()"""
+        logger.info(f"开始监听目录: {', '.join(self.folders)} (稳定等待 {self.settle_seconds}s)")
+        poller = select.poll()
+        poller.register(self._fd, select.POLLIN)
+        while not self._stopped:
+            overflow = False
+            if poller.poll(1000):
+                for wd, mask, name in self._read_events():
+                    overflow = self._handle_event(wd, mask, name) or overflow
+            ready = self._collect_settled()
+            if ready or overflow:
+                try:
+                    # 队列溢出时可能丢失了其它目录的事件，即使有就绪文件也触发完整扫描
+                    self.callback([] if overflow else ready)
+                except Exception as e:
+                    logger.error(f"处理监听事件时出错: {e}", exc_info=True)
+        os.close(self._fd)
+
+    def stop(self):
+        self._stopped = True
@@ -0,0 +1,88 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 流水线中记录完成状态的阶段
+STAGES = ("clean", "convert", "encode", "upload")
+
+
+class JobLedger:
+    """
+    持久化的任务台账，记录每个录播文件已完成的处理阶段。
+
+    文件以 (路径, 大小, 修改时间) 作为标识，文件被改写后会被视为新文件重新处理。
+    """
+    def __init__(self, db_path: str):
+        """
+        初始化 JobLedger。
+
+        Args:
+            db_path: SQLite 数据库文件路径，不存在时自动创建。
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stages ("
+                " path TEXT NOT NULL,"
+                " stage TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " mtime REAL NOT NULL,"
+                " finished_at REAL NOT NULL,"
+                " PRIMARY KEY (path, stage))"
+            )
+
+    @staticmethod
+    def _check_stage(stage):
+        if stage not in STAGES:
+            raise ValueError(f"未知的处理阶段: {stage}，可选: {', '.join(STAGES)}")
+
+    def is_done(self, path: str, stage: str, size: int = None, mtime: float = None) -> bool:
+        """
+        判断文件的某个阶段是否已经完成。
+
+        未提供 size/mtime 时会读取文件当前状态；文件不存在时返回 False。
+        """
+        self._check_stage(stage)
+        if size is None or mtime is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            size, mtime = stat.st_size, stat.st_mtime
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime FROM stages WHERE path = ? AND stage = ?",
+                (os.path.abspath(path), stage),
+            ).fetchone()
+        return row is not None and row[0] == size and row[1] == mtime
+
+    def mark_done(self, path: str, stage: str, size: int = None, mtime: float = None):
+        """记录文件的某个阶段已完成"""
+        self._check_stage(stage)
+        if size is None or mtime is None:
+            stat = os.stat(path)
+            size, mtime = stat.st_size, stat.st_mtime
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stages (path, stage, size, mtime, finished_at) VALUES (?, ?, ?, ?, ?)",
+                (os.path.abspath(path), stage, size, mtime, time.time()),
+            )
+
+    def completed_stages(self, path: str) -> list:
+        """返回文件已记录完成的阶段列表 (不校验大小和修改时间)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage FROM stages WHERE path = ?", (os.path.abspath(path),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,323 @@
+import time
+import uuid
+import logging
+import threading
+import subprocess
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+from apis import metrics
+
+logger = logging.getLogger(__name__)
+
+# 任务的最终状态
+FINISHED_STATUSES = ("success", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """任务已被取消"""
+
+
+class JobControl:
+    """
+    任务的取消控制：登记任务启动的外部进程 (ffmpeg / biliup)，取消时先发送 SIGTERM，
+    等待 grace_seconds 秒后仍未退出则强制结束。
+
+    长时间运行的函数通过 control 参数接收该对象，在开始每个步骤前调用 check()，
+    启动子进程时使用 track(proc) 登记。
+    """
+    def __init__(self, grace_seconds: float = 10.0, parent=None):
+        """
+        初始化 JobControl。
+
+        Args:
+            grace_seconds: 发送 SIGTERM 后等待进程退出的秒数，超时后发送 SIGKILL。
+            parent: 可选的上级 JobControl。登记的进程同时登记到上级，上级取消时一并结束；
+                取消本对象只结束本对象登记的进程，用于提前结束任务中的一组子进程。
+        """
+        self.grace_seconds = grace_seconds
+        self.parent = parent
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._processes = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def check(self):
+        """任务已取消时抛出 JobCancelled"""
+        if self.cancelled:
+            raise JobCancelled("任务已取消")
+
+    @contextmanager
+    def track(self, proc):
+        """在 with 块内登记子进程，任务取消时该进程会被结束"""
+        with self.parent.track(proc) if self.parent is not None else nullcontext():
+            with self._lock:
+                self._processes.add(proc)
+            try:
+                if self._cancelled.is_set():
+                    self._terminate(proc)
+                yield proc
+            finally:
+                with self._lock:
+                    self._processes.discard(proc)
+
+    def _terminate(self, proc):
+        if proc.poll() is not None:
+            return
+
+        def stop():
+            try:
+                proc.terminate()
+                proc.wait(timeout=self.grace_seconds)
+            except OSError:
+                pass
+            except subprocess.TimeoutExpired:
+                logger.warning(f"进程 {proc.pid} 在 {self.grace_seconds}s 内未退出，强制结束")
+                proc.kill()
+
+        threading.Thread(target=stop, daemon=True).start()
+
+    def cancel(self):
+        """标记任务已取消并结束所有登记的子进程"""
+        self._cancelled.set()
+        with self._lock:
+            processes = list(self._processes)
+        for proc in processes:
+            logger.info(f"结束进程 {proc.pid}: {' '.join(map(str, proc.args[:3]))} ...")
+            self._terminate(proc)
+
+
+class Job:
+    """一个后台任务及其执行状态"""
+    def __init__(self, kind: str, func, source: str = "api", grace_seconds: float = 10.0, key: str = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.key = key
+        self.func = func
+        self.source = source
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.control = JobControl(grace_seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "type": self.kind,
+            "key": self.key,
+            "source": self.source,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wait_seconds": round(self.started_at - self.created_at, 3) if self.started_at else None,
+            "run_seconds": round(self.finished_at - self.started_at, 3)
+            if self.started_at and self.finished_at else None,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    按类型分队列的后台任务管理器：每种类型 (如 process、upload) 有独立的先进先出队列和并发上限，
+    不同类型的任务互不阻塞。每个任务有唯一 ID，可以查询状态或取消。
+
+    任务可以带有 key (如房间名称)：key 相同的任务不会同时运行，排队时跳过 key 正在运行的任务，
+    先启动其它 key 的任务。
+    """
+    def __init__(self, limits: dict, history: int = 100, grace_seconds: float = 10.0):
+        """
+        初始化 JobManager。
+
+        Args:
+            limits: 任务类型 -> 该类型同时运行的任务数上限。
+            history: 保留的已结束任务数量。
+            grace_seconds: 取消任务时等待子进程退出的秒数，超时后强制结束。
+        """
+        self.limits = {kind: max(1, limit) for kind, limit in limits.items()}
+        self.grace_seconds = grace_seconds
+        self._cond = threading.Condition()
+        self._queues = {kind: deque() for kind in self.limits}
+        self._running = {kind: 0 for kind in self.limits}
+        self._running_keys = set()
+        self._jobs = {}
+        self._finished = deque()
+        self._history = max(1, history)
+
+    def submit(self, kind: str, func, source: str = "api", coalesce: bool = False, key: str = None) -> Job:
+        """
+        提交一个任务，func(control) 在后台线程中执行，返回值保存为任务结果。
+
+        Args:
+            kind: 任务类型，必须是 limits 中的一种。
+            func: 任务函数，参数为 JobControl。
+            source: 任务来源 (api / schedule / watch 等)，仅用于展示。
+            coalesce: 为 True 时，如果已有同类型、同 key 的排队中的任务则直接返回该任务，不重复排队。
+            key: 可选的任务键，key 相同的任务依次运行。
+        """
+        if kind not in self.limits:
+            raise ValueError(f"未知的任务类型: {kind}，可选: {', '.join(self.limits)}")
+        with self._cond:
+            if coalesce:
+                for queued in self._queues[kind]:
+                    if queued.key == key:
+                        return queued
+            job = Job(kind, func, source, self.grace_seconds, key)
+            self._jobs[job.id] = job
+            self._queues[kind].append(job)
+            metrics.QUEUE_DEPTH.inc(queue=f"job_{kind}")
+            self._dispatch(kind)
+        logger.info(f"已提交 {kind} 任务 {job.id} (来源: {source}{f'，{key}' if key else ''})")
+        return job
+
+    @contextmanager
+    def track(self, kind: str, source: str = "api", key: str = None):
+        """
+        登记一个由调用方自己的线程执行的任务 (如上传队列中的单个文件)，不占用该类型的并发名额。
+
+        with 块内任务处于运行状态，可以通过 /jobs 查询，也可以用 cancel() 取消 (结束登记到 control 的子进程)；
+        块正常结束为 success，抛出 JobCancelled 或取消后结束为 cancelled，其它异常为 failed，异常会继续抛出。
+
+        Yields:
+            任务的 JobControl。
+        """
+        if kind not in self.limits:
+            raise ValueError(f"未知的任务类型: {kind}，可选: {', '.join(self.limits)}")
+        job = Job(kind, None, source, self.grace_seconds, key)
+        job.status = "running"
+        job.started_at = job.created_at
+        with self._cond:
+            self._jobs[job.id] = job
+            metrics.QUEUE_DEPTH.inc(queue=f"job_{kind}")
+        status = "success"
+        try:
+            yield job.control
+        except JobCancelled:
+            status = "cancelled"
+            raise
+        except BaseException as e:
+            job.error = str(e)
+            status = "cancelled" if job.control.cancelled else "failed"
+            raise
+        finally:
+            if status == "success" and job.control.cancelled:
+                status = "cancelled"
+            with self._cond:
+                self._finish(job, status)
+
+    def _dispatch(self, kind):
+        """在持有锁的情况下启动有空闲名额的排队任务"""
+        queue = self._queues[kind]
+        for job in list(queue):
+            if self._running[kind] >= self.limits[kind]:
+                break
+            if job.key is not None and (kind, job.key) in self._running_keys:
+                continue
+            queue.remove(job)
+            if job.key is not None:
+                self._running_keys.add((kind, job.key))
+            self._running[kind] += 1
+            job.status = "running"
+            job.started_at = time.time()
+            threading.Thread(target=self._run, args=(job,), name=f"job-{kind}-{job.id}", daemon=True).start()
+
+    def _run(self, job):
+        logger.info(f"开始执行 {job.kind} 任务 {job.id}，排队 {job.started_at - job.created_at:.1f}s")
+        try:
+            job.result = job.func(job.control)
+            status = "cancelled" if job.control.cancelled else "success"
+        except JobCancelled:
+            status = "cancelled"
+        except Exception as e:
+            logger.error(f"{job.kind} 任务 {job.id} 执行失败: {e}", exc_info=True)
+            job.error = str(e)
+            status = "cancelled" if job.control.cancelled else "failed"
+        with self._cond:
+            self._running[job.kind] -= 1
+            self._running_keys.discard((job.kind, job.key))
+            self._finish(job, status)
+            self._dispatch(job.kind)
+        logger.info(f"{job.kind} 任务 {job.id} 结束: {status}，耗时 {job.finished_at - job.started_at:.1f}s")
+
+    def _finish(self, job, status):
+        """在持有锁的情况下记录任务结束，超出保留数量的旧任务会被移除"""
+        job.status = status
+        job.finished_at = time.time()
+        metrics.QUEUE_DEPTH.dec(queue=f"job_{job.kind}")
+        metrics.STAGE_RESULTS.inc(stage=f"job_{job.kind}", status=status)
+        self._finished.append(job.id)
+        while len(self._finished) > self._history:
+            self._jobs.pop(self._finished.popleft(), None)
+        self._cond.notify_all()
+
+    def get(self, job_id: str):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def list(self, kind: str = None, status: str = None) -> list:
+        """返回任务列表，最新提交的在前"""
+        with self._cond:
+            jobs = [job for job in self._jobs.values()
+                    if (kind is None or job.kind == kind) and (status is None or job.status == status)]
+            return [job.to_dict() for job in sorted(jobs, key=lambda job: job.created_at, reverse=True)]
+
+    def active(self, kind: str = None) -> list:
+        """排队中和运行中的任务"""
+        with self._cond:
+            return [job.to_dict() for job in self._jobs.values()
+                    if job.status not in FINISHED_STATUSES and (kind is None or job.kind == kind)]
+
+    def last_finished(self, kind: str = None):
+        """最近结束的任务，没有时返回 None"""
+        with self._cond:
+            for job_id in reversed(self._finished):
+                job = self._jobs[job_id]
+                if kind is None or job.kind == kind:
+                    return job.to_dict()
+        return None
+
+    def cancel(self, job_id: str):
+        """
+        取消任务：排队中的任务直接移除，运行中的任务结束其子进程并在当前步骤结束后停止。
+
+        Returns:
+            被取消的任务；任务不存在时返回 None。
+
+        Raises:
+            ValueError: 任务已经结束。
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status in FINISHED_STATUSES:
+                raise ValueError(f"任务 {job_id} 已结束 ({job.status})")
+            if job.status == "queued":
+                self._queues[job.kind].remove(job)
+                job.control.cancel()
+                self._finish(job, "cancelled")
+                logger.info(f"已取消排队中的 {job.kind} 任务 {job.id}")
+                return job
+        logger.info(f"正在取消运行中的 {job.kind} 任务 {job.id}")
+        job.control.cancel()
+        return job
+
+    def wait(self, job_id: str, timeout: float = None) -> bool:
+        """等待任务结束，返回是否在超时前结束"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job.status in FINISHED_STATUSES:
+                    return True
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(timeout=remaining)
@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from apis import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_rate(rate):
+    """将 ffprobe 的 "30000/1001" 形式帧率转换为浮点数"""
+    try:
+        num, _, den = (rate or "").partition("/")
+        num, den = float(num), float(den or 1)
+        return round(num / den, 3) if den else None
+    except ValueError:
+        return None
+
+
+def _parse_compact_line(line):
+    """解析 ffprobe compact 输出的一行，返回 (段名, 字段字典)"""
+    section, _, rest = line.rstrip("\n").partition("|")
+    fields = {}
+    for item in rest.split("|"):
+        key, sep, value = item.partition("=")
+        if sep:
+            fields[key] = value
+    return section, fields
+
+
+def _run_ffprobe_lines(cmd):
+    """
+    执行 ffprobe 并逐行返回标准输出。
+
+    损坏的文件可能产生大量错误输出，错误输出在线程中读取并只保留最后几行，防止管道写满阻塞。
+    """
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as proc:
+        stderr_tail = deque(maxlen=20)
+        stderr_thread = threading.Thread(target=stderr_tail.extend, args=(proc.stderr,), daemon=True)
+        stderr_thread.start()
+        yield from proc.stdout
+        stderr_thread.join()
+    if proc.returncode != 0:
+        metrics.SUBPROCESS_FAILURES.inc(tool="ffprobe")
+        raise RuntimeError(f"ffprobe 执行失败 ({proc.returncode}): {''.join(stderr_tail).strip()}")
+
+
+def probe_keyframes(path: str, priority=None) -> list:
+    """读取视频流所有关键帧的时间 (秒)，只解析包信息，不解码"""
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path,
+    ]
+    if priority is not None:
+        cmd = priority.wrap(cmd)
+    keyframe_times = []
+    # 逐行读取输出，只保留关键帧，避免一次性缓存数十万行包信息
+    for line in _run_ffprobe_lines(cmd):
+        pts_time, _, flags = line.strip().partition(",")
+        if flags.startswith("K"):
+            try:
+                keyframe_times.append(round(float(pts_time), 3))
+            except ValueError:
+                pass
+    return keyframe_times
+
+
+def probe(path: str, keyframes: bool = True, priority=None) -> dict:
+    """
+    获取录播文件的全部元数据。
+
+    Args:
+        path: 视频文件路径。
+        keyframes: 是否读取关键帧时间 (需要读取整个文件的包信息)。
+        priority: 可选的 ProcessPriority (见 apis.process_priority)，设置 ffprobe 的 CPU / IO 优先级。
+
+    Returns:
+        包含 width、height、duration、start_time、fps、video_codec、audio_codec、
+        keyframe_count 和 keyframes 的字典。关键帧时间已减去文件的 start_time，与 ffmpeg 输入端 -ss
+        的时间基准一致，可以直接作为切分点。
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration,start_time:stream=codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate",
+        "-of", "compact=p=1:nk=0", path,
+    ]
+    if priority is not None:
+        cmd = priority.wrap(cmd)
+    info = {
+        "width": None, "height": None, "duration": None, "start_time": None, "fps": None,
+        "video_codec": None, "audio_codec": None,
+        "keyframe_count": None, "keyframes": None,
+    }
+    for line in _run_ffprobe_lines(cmd):
+        section, fields = _parse_compact_line(line)
+        if section == "stream":
+            if fields.get("codec_type") == "video" and info["video_codec"] is None:
+                info["video_codec"] = fields.get("codec_name")
+                info["width"] = int(fields["width"]) if fields.get("width", "").isdigit() else None
+                info["height"] = int(fields["height"]) if fields.get("height", "").isdigit() else None
+                info["fps"] = _parse_rate(fields.get("avg_frame_rate")) or _parse_rate(fields.get("r_frame_rate"))
+            elif fields.get("codec_type") == "audio" and info["audio_codec"] is None:
+                info["audio_codec"] = fields.get("codec_name")
+        elif section == "format":
+            try:
+                info["duration"] = float(fields.get("duration"))
+            except (TypeError, ValueError):
+                pass
+            try:
+                info["start_time"] = float(fields.get("start_time"))
+            except (TypeError, ValueError):
+                pass
+    if keyframes:
+        # 关键帧的 pts_time 是绝对时间，start_time 不为 0 的 FLV 需要换算为相对文件开头的时间
+        offset = info["start_time"] or 0.0
+        info["keyframes"] = [round(t - offset, 3) for t in probe_keyframes(path, priority)] if info["video_codec"] else []
+        info["keyframe_count"] = len(info["keyframes"])
+    return info
+
+
+class ProbeCache:
+    """
+    录播文件元数据的磁盘缓存，以 (路径, 大小, 修改时间) 为键。
+
+    转换、压制和进度估算共享同一份缓存，每个文件只需要执行一次 ffprobe。
+    """
+    def __init__(self, db_path: str, priority=None):
+        """
+        初始化 ProbeCache。
+
+        Args:
+            db_path: SQLite 数据库文件路径，可以与 JobLedger 共用同一个文件。
+            priority: 可选的 ProcessPriority，应用到缓存未命中时启动的 ffprobe 进程。
+        """
+        self.priority = priority
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.hits = 0
+        self.misses = 0
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime REAL NOT NULL,"
+                " info TEXT NOT NULL,"
+                " probed_at REAL NOT NULL)"
+            )
+
+    def get(self, path: str, keyframes: bool = True) -> dict:
+        """
+        返回文件的元数据，缓存未命中或文件已变化时重新探测。
+
+        Args:
+            path: 视频文件路径。
+            keyframes: 是否需要关键帧信息；缓存中没有关键帧信息时会重新探测。
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime, info FROM probes WHERE path = ?", (path,)
+            ).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            info = json.loads(row[2])
+            # 没有 start_time 的旧缓存中关键帧为绝对时间，需要重新探测
+            if "start_time" in info and (not keyframes or info.get("keyframes") is not None):
+                with self._lock:
+                    self.hits += 1
+                metrics.PROBE_CACHE.inc(result="hit")
+                return info
+        with self._lock:
+            self.misses += 1
+        metrics.PROBE_CACHE.inc(result="miss")
+        started = time.time()
+        info = probe(path, keyframes=keyframes, priority=self.priority)
+        logger.info(f"探测 {path} 完成，耗时 {time.time() - started:.1f}s: "
+                    f"{info['width']}x{info['height']} {info['duration']}s {info['fps']}fps "
+                    f"{info['video_codec']}/{info['audio_codec']} 关键帧 {info['keyframe_count']}")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO probes (path, size, mtime, info, probed_at) VALUES (?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime, json.dumps(info), time.time()),
+            )
+        return info
+
+    def get_many(self, paths, workers: int = 4, keyframes: bool = False) -> dict:
+        """
+        并发探测多个文件，已缓存的文件直接返回。
+
+        批量探测通常只需要分辨率和时长，默认不读取关键帧 (需要读取整个文件)，分段压制和截取片段时再单独获取。
+
+        Returns:
+            路径 -> 元数据字典；探测失败的文件对应的值为 None。
+        """
+        def safe_get(path):
+            try:
+                return self.get(path, keyframes=keyframes)
+            except Exception as e:
+                logger.warning(f"探测 {path} 失败: {e}")
+                return None
+
+        paths = list(paths)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return dict(zip(paths, executor.map(safe_get, paths)))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def probe_folder(cache: ProbeCache, folder: str, workers: int = 4, keyframes: bool = False) -> dict:
+    """一次性探测目录下所有已完成录制的 FLV 文件"""
+    flv_files = [
+        entry.path for entry in os.scandir(folder)
+        if entry.is_file() and entry.name.lower().endswith(".flv")
+    ]
+    return cache.get_many(flv_files, workers=workers, keyframes=keyframes)
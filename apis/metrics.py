@@ -0,0 +1,173 @@
+import math
+import threading
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 各阶段耗时 (秒) 的直方图区间，覆盖从几秒的清理到数小时的压制
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+
+# 压制速度倍率 (视频时长 / 压制耗时) 的区间，小于 1 表示压制跟不上录制
+SPEED_BUCKETS = (0.25, 0.5, 0.75, 1, 1.5, 2, 4, 8, 16)
+
+# 每个文件写入的弹幕事件数量的区间
+EVENT_BUCKETS = (100, 1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000)
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    """带标签的指标的基类，每组标签值对应一个独立的序列"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.label_names}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for suffix, key, extra, value in self._samples():
+                lines.append(f"{self.name}{suffix}{_format_labels(self.label_names, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数器，名称按惯例以 _total 结尾"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _samples(self):
+        for key, value in sorted(self._series.items()):
+            yield "", key, (), value
+
+
+class Gauge(_Metric):
+    """可增可减的当前值，如队列长度"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        for key, value in sorted(self._series.items()):
+            yield "", key, (), value
+
+
+class Histogram(_Metric):
+    """按区间统计观测值的分布，同时记录总和与次数"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+
+    def _samples(self):
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                yield "_bucket", key, (("le", _format_value(bound)),), cumulative
+            yield "_sum", key, (), series["sum"]
+            yield "_count", key, (), cumulative
+
+
+class Registry:
+    """进程内的指标集合，render() 输出 Prometheus 文本格式"""
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "danmaku_stage_duration_seconds", "各阶段的耗时，convert/encode/upload 为单个文件，clean 为一次完整的清理", ("stage",)))
+STAGE_RESULTS = REGISTRY.register(Counter(
+    "danmaku_stage_results_total", "各阶段处理的文件数，按结果区分", ("stage", "status")))
+STAGE_BYTES_IN = REGISTRY.register(Counter(
+    "danmaku_stage_bytes_in_total", "各阶段读取的输入文件字节数", ("stage",)))
+STAGE_BYTES_OUT = REGISTRY.register(Counter(
+    "danmaku_stage_bytes_out_total", "各阶段写出的输出文件字节数", ("stage",)))
+ENCODE_SPEED = REGISTRY.register(Histogram(
+    "danmaku_encode_speed_ratio", "压制速度倍率 (视频时长 / 压制耗时)，小于 1 表示压制慢于录制", ("backend",),
+    buckets=SPEED_BUCKETS))
+DANMAKU_EVENTS = REGISTRY.register(Histogram(
+    "danmaku_events_per_file", "每个弹幕文件的弹幕数量 (kind=danmaku) 与写入 ASS 的事件数量 (kind=events)",
+    ("kind",), buckets=EVENT_BUCKETS))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "danmaku_queue_depth", "排队与正在执行的任务数", ("queue",)))
+ENCODE_BACKLOG_SECONDS = REGISTRY.register(Gauge(
+    "danmaku_encode_backlog_seconds", "排队与正在压制的录播的视频总时长 (秒)"))
+PROBE_CACHE = REGISTRY.register(Counter(
+    "danmaku_probe_cache_requests_total", "元数据缓存的查询次数，按命中与未命中区分", ("result",)))
+SUBPROCESS_FAILURES = REGISTRY.register(Counter(
+    "danmaku_subprocess_failures_total", "外部进程 (ffmpeg/ffprobe/biliup/转换子进程) 失败的次数", ("tool",)))
+
+
+def render() -> str:
+    """返回所有指标的 Prometheus 文本格式"""
+    return REGISTRY.render()
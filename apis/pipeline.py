@@ -0,0 +1,505 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from apis.danmaku_converter import convert_to_ass, convert_task
+from apis.danmaku_stream import count_danmaku
+from apis.dir_index import DirectoryIndex
+from apis import metrics
+from apis.encode_scheduler import EncodeJob, EncodeScheduler
+from apis.job_manager import JobCancelled
+from apis.media_probe import probe
+from apis.process_pool import WorkerPool
+from apis.segment_encoder import plan_segments
+from apis.session_merger import MERGED_SUFFIX, Segment, group_sessions, merge_session, merged_base, parse_start
+from apis.video_encoder import OUTPUT_MODES, encode, mux, output_path
+
+logger = logging.getLogger(__name__)
+
+
+def verify_output(mp4: str, expected_duration: float = None, tolerance: float = 2.0, priority=None):
+    """
+    校验压制输出：文件非空且时长与源视频一致 (允许 tolerance 秒或 1% 的误差)。
+
+    priority 为可选的 ProcessPriority，应用到 ffprobe 进程。
+
+    Returns:
+        校验失败的原因，通过时返回 None。
+    """
+    try:
+        if os.path.getsize(mp4) == 0:
+            return "输出文件为空"
+        if expected_duration:
+            duration = probe(mp4, keyframes=False, priority=priority)["duration"]
+            if duration is None or abs(duration - expected_duration) > max(tolerance, expected_duration * 0.01):
+                return f"输出时长 {duration}s 与源视频 {expected_duration}s 不一致"
+    except Exception as e:
+        return str(e)
+    return None
+
+
+class Recording:
+    """
+    一个录播文件 (同名的 FLV / XML / ASS) 及其各阶段的处理结果。
+    """
+    def __init__(self, base: str):
+        self.base = base
+        self.name = os.path.basename(base)
+        self.xml = base + ".xml"
+        self.flv = base + ".flv"
+        self.ass = base + ".ass"
+        self.mp4 = base + ".mp4"
+        self.needs_convert = False
+        self.needs_encode = False
+        self.xml_stat = None
+        self.flv_stat = None
+        # 弹幕数量，转换时统计，用于选择输出模式
+        self.danmaku = None
+        self.mode = None
+        self.duration = None
+        self.resolution = None
+        self.status = "pending"
+        self.stages = {}
+
+    def record_stage(self, stage, status, started_at, error=None):
+        self.stages[stage] = {
+            "status": status,
+            "seconds": round(time.time() - started_at, 3),
+            "error": error,
+        }
+        if status == "cancelled":
+            self.status = "cancelled"
+        elif status != "success":
+            self.status = "failed"
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "status": self.status, "mode": self.mode, "stages": self.stages}
+
+
+class RecordingPipeline:
+    """
+    按录播文件流水线处理：每个录播文件独立经过 探测 -> 弹幕转换 -> 压制。
+
+    转换在线程池中进行，转换完成后立即提交给压制调度器，因此下一个文件的转换与
+    当前文件的压制重叠执行；某个文件失败只影响它自己。
+    """
+    def __init__(self, folder, ledger=None, probe_cache=None, streaming=False, convert_workers=1,
+                 convert_timeout=None, max_workers=2, hw_slots=1, sw_slots=1, order="smallest",
+                 test_mode=False, backends=None, progress=None, segment_workers=0,
+                 segment_min_duration=3600, layout=None, upload_queue=None, index=None, control=None,
+                 scheduler=None, room=None, priority=1, output_mode="burn", remux_max_danmaku=0, copy_slots=2,
+                 priorities=None, scratch_dir=None, danmaku_index=False, merge_sessions=False, merge_max_gap=300.0,
+                 settle_seconds=5.0):
+        """
+        初始化 RecordingPipeline。
+
+        Args:
+            folder: 处理文件夹，XML 会递归转换，FLV 只压制该目录下的文件。
+            ledger: 可选的 JobLedger，用于跳过已完成的阶段。
+            probe_cache: 可选的 ProbeCache，用于获取分辨率与时长。
+            streaming: 是否使用流式弹幕转换。
+            convert_workers: 同时转换的文件数，转换在每次运行共用的常驻子进程池中执行；为 0 时在线程中逐个转换。
+            convert_timeout: 单个文件的转换超时时间 (秒)，超时的子进程会被结束，仅在子进程模式下生效。
+            max_workers / hw_slots / sw_slots / order: 压制调度参数，见 EncodeScheduler。
+            test_mode: 为 True 时压制后不删除源文件。
+            backends: 按优先级排序的压制后端列表，为 None 时使用 QSV。
+            progress: 可选的 ProgressRegistry，用于对外提供正在压制的任务的实时进度。
+            segment_workers: 分段并行压制的进程数，大于 1 且首选后端为软件编码时，
+                时长不少于 segment_min_duration 秒的录播会在关键帧处切分后并行压制。
+            layout: 弹幕排版参数 (max_on_screen、merge_window)，见 convert_to_ass。
+            upload_queue: 可选的 UploadQueue，压制完成并校验通过的 MP4 会立即加入上传队列。
+            index: 可选的 DirectoryIndex，与清理阶段共享同一次目录扫描，未提供时新建。
+            control: 可选的 JobControl (见 apis.job_manager)，任务取消后不再开始新的转换和压制，
+                正在运行的 ffmpeg 会被结束。
+            scheduler: 可选的共享 EncodeScheduler，多个房间的流水线共用时按优先级公平分配压制槽位；
+                提供时忽略 max_workers、hw_slots、sw_slots、order。
+            room: 房间名称，记录在压制任务中。
+            priority: 房间的压制优先级，见 EncodeScheduler。
+            output_mode: 输出模式，burn (烧录弹幕重新压制)、remux (复制流为 MP4) 或 softsub
+                (ASS 作为字幕轨封装为 MKV)，见 apis.video_encoder.OUTPUT_MODES。
+            remux_max_danmaku: 大于 0 时，弹幕数量少于该值的录播不再烧录，直接 remux 为 MP4。
+            copy_slots: 同时运行的 remux / softsub 任务数，见 EncodeScheduler。
+            priorities: 阶段 (probe / convert / encode) -> ProcessPriority，设置各阶段子进程的
+                CPU / IO 优先级和 CPU 亲和性，见 apis.process_priority。
+            scratch_dir: 暂存目录，压制输出先写入该目录，完成后原子地移动到处理文件夹，见 apis.staging。
+            danmaku_index: 转换时是否同时生成列式弹幕索引，见 apis.danmaku_index。
+            merge_sessions: 是否在处理前将同一场直播因断流拆分出的多个分段无损合并为一个录播，
+                见 apis.session_merger。
+            merge_max_gap: 前一个分段结束到后一个分段开始不超过该秒数时视为同一场直播；开启合并后，
+                录制结束不到该秒数的录播会等到之后的处理周期，以免直播重连后无法合并。
+            settle_seconds: 最近该秒数内修改过的 XML 可能仍在写入，对应的录播留到之后的处理周期再转换和压制。
+        """
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"不支持的输出模式: {output_mode}，可选: {', '.join(OUTPUT_MODES)}")
+        self.folder = os.path.abspath(folder)
+        self.ledger = ledger
+        self.probe_cache = probe_cache
+        self.streaming = streaming
+        self.convert_workers = convert_workers
+        self.convert_timeout = convert_timeout
+        self.test_mode = test_mode
+        self.backends = backends
+        self.progress = progress
+        self.segment_workers = segment_workers
+        self.segment_min_duration = segment_min_duration
+        self.layout = layout
+        self.upload_queue = upload_queue
+        self.index = index if index is not None else DirectoryIndex()
+        self.control = control
+        self.room = room
+        self.priority = priority
+        self.output_mode = output_mode
+        self.remux_max_danmaku = remux_max_danmaku
+        self.priorities = priorities or {}
+        self.scratch_dir = scratch_dir
+        self.danmaku_index = danmaku_index
+        self.merge_sessions = merge_sessions
+        self.merge_max_gap = merge_max_gap
+        self.settle_seconds = settle_seconds
+        self.scheduler = scheduler if scheduler is not None else EncodeScheduler(
+            self._encode_job,
+            max_workers=max_workers,
+            hw_slots=hw_slots,
+            sw_slots=sw_slots,
+            order=order,
+            copy_slots=copy_slots,
+        )
+        # 本流水线提交的压制任务
+        self._jobs = []
+        self._lock = threading.Lock()
+        # 等待合并或已被合并的分段 (录播主文件路径)，本次不单独处理
+        self._held = set()
+        # 本次运行的转换子进程池，run() 期间存在
+        self._convert_pool = None
+
+    def discover(self) -> list:
+        """
+        扫描处理文件夹，返回需要转换或压制的录播文件。
+
+        每个文件都与台账中的 (大小, 修改时间) 比对，复用目录快照中缓存的 stat 结果，
+        原地改写或追加的文件也会重新处理。
+        """
+        recordings = []
+        now = time.time()
+        for snapshot in self.index.walk(self.folder):
+            root = snapshot.path
+            is_top = root == self.folder
+
+            for stem in sorted(snapshot.stems):
+                files = snapshot.stems[stem]
+                if ".xml" not in files and ".flv" not in files:
+                    continue
+                recording = Recording(os.path.join(root, stem))
+                if recording.base in self._held:
+                    continue
+                if ".flv.part" in files:
+                    # 仍在录制中，之后的处理周期再处理
+                    continue
+                try:
+                    if ".xml" in files:
+                        stat = files[".xml"].stat()
+                        if now - stat.st_mtime < self.settle_seconds:
+                            # 录制结束后弹幕可能还在写入，转换不完整的 XML 会让压制烧录截断的弹幕
+                            logger.info(f"{recording.xml} 最近 {self.settle_seconds:.0f}s 内仍有修改，留到之后的处理周期")
+                            continue
+                        if self.ledger is None or not self.ledger.is_done(recording.xml, "convert", stat.st_size, stat.st_mtime):
+                            recording.needs_convert = True
+                            recording.xml_stat = stat
+                    # remux 模式不需要弹幕，没有 XML / ASS 的录播也会处理
+                    has_danmaku = recording.needs_convert or ".ass" in files or self.output_mode == "remux"
+                    if is_top and ".flv" in files and has_danmaku:
+                        # 复用目录快照中缓存的 stat 结果，不再逐个 stat FLV
+                        stat = files[".flv"].stat()
+                        if self.ledger is None or not self.ledger.is_done(recording.flv, "encode", stat.st_size, stat.st_mtime):
+                            recording.needs_encode = True
+                            recording.flv_stat = stat
+                except OSError as e:
+                    # 扫描后文件被删除或重命名
+                    logger.warning(f"读取 {recording.base} 的文件信息失败: {e}")
+                    continue
+                if recording.needs_convert or recording.needs_encode:
+                    recordings.append(recording)
+        return recordings
+
+    def _probe_info(self, flv: str) -> dict:
+        if self.probe_cache is not None:
+            return self.probe_cache.get(flv, keyframes=False)
+        return probe(flv, keyframes=False, priority=self.priorities.get("probe"))
+
+    def _hold(self, segments):
+        self._held.update(segment.base for segment in segments)
+
+    def _merge_sessions(self) -> list:
+        """
+        将处理文件夹中同一场直播的多个分段合并为一个录播 (见 apis.session_merger)。
+
+        直播可能仍在继续 (最后一个分段仍在录制，或结束不到 merge_max_gap 秒) 时整场暂不处理，
+        之后的处理周期重新分组；合并失败时各分段按普通录播单独处理。
+
+        Returns:
+            每次合并的结果，包含 name (合并后的录播名)、segments、duration、status 和 error。
+        """
+        snapshot = self.index.folder(self.folder)
+        if snapshot is None:
+            return []
+        segments = []
+        for stem, files in snapshot.stems.items():
+            parsed = parse_start(stem)
+            if parsed is None or stem.endswith(MERGED_SUFFIX):
+                continue
+            base = os.path.join(self.folder, stem)
+            if ".flv.part" in files:
+                segments.append(Segment(base, *parsed, live=True))
+            elif ".flv" in files:
+                try:
+                    mtime = files[".flv"].stat().st_mtime
+                    info = self._probe_info(base + ".flv")
+                except Exception as e:
+                    logger.warning(f"探测 {base}.flv 失败，不参与合并: {e}")
+                    continue
+                if not info.get("duration"):
+                    logger.warning(f"无法获取 {base}.flv 的时长，不参与合并")
+                    continue
+                segments.append(Segment(base, *parsed, info=info, mtime=mtime))
+
+        now = time.time()
+        results = []
+        for group in group_sessions(segments, self.merge_max_gap):
+            finished = [segment for segment in group if not segment.live]
+            last = group[-1]
+            if last.live or now - last.mtime < self.merge_max_gap:
+                if finished:
+                    logger.info(f"{last.name} 所在的直播可能仍在继续，{len(finished)} 个分段暂不处理")
+                    self._hold(finished)
+                continue
+            if len(group) < 2:
+                continue
+            base = merged_base(group)
+            if any(self.index.exists(base + ext) for ext in (".flv", ".mp4", ".mkv")):
+                # 测试模式下分段会保留，已经合并过的直播不再重复合并
+                self._held.update(segment.base for segment in group)
+                continue
+            if self.control is not None and self.control.cancelled:
+                self._hold(group)
+                continue
+            started = time.time()
+            result = {
+                "name": os.path.basename(base),
+                "segments": [segment.name for segment in group],
+                "duration": round(sum(segment.duration for segment in group), 3),
+                "status": "success",
+                "error": None,
+            }
+            try:
+                merge_session(group, control=self.control, priority=self.priorities.get("encode"),
+                              test_mode=self.test_mode,
+                              verify=lambda flv, duration: verify_output(flv, duration,
+                                                                         priority=self.priorities.get("probe")))
+                self._held.update(segment.base for segment in group)
+                logger.info(f"已将 {len(group)} 个分段合并为 {base}.flv，耗时 {time.time() - started:.1f}s")
+            except JobCancelled:
+                result["status"] = "cancelled"
+                self._hold(group)
+            except Exception as e:
+                logger.error(f"合并 {result['name']} 的分段失败，各分段单独处理: {e}")
+                result["status"] = "failed"
+                result["error"] = str(e)
+            result["seconds"] = round(time.time() - started, 3)
+            results.append(result)
+        if any(result["status"] == "success" for result in results):
+            # 新增了合并后的录播并删除了分段，重新列举目录
+            self.index.rescan(self.folder)
+        return results
+
+    def _probe(self, recording):
+        if self.probe_cache is None or not os.path.exists(recording.flv):
+            return
+        try:
+            info = self.probe_cache.get(recording.flv, keyframes=False)
+        except Exception as e:
+            logger.warning(f"探测 {recording.flv} 失败: {e}")
+            return
+        recording.duration = info["duration"]
+        if info["width"] and info["height"]:
+            recording.resolution = (info["width"], info["height"])
+
+    def _convert(self, recording):
+        started = time.time()
+        args = (recording.xml, recording.ass, self.streaming, recording.resolution, self.layout, self.danmaku_index)
+        try:
+            if self._convert_pool is not None:
+                result = self._convert_pool.run(recording.xml, convert_task, args, timeout=self.convert_timeout)
+                if result["status"] != "success":
+                    metrics.SUBPROCESS_FAILURES.inc(tool="convert")
+                    error_lines = (result["error"] or result["status"]).strip().splitlines()
+                    raise RuntimeError(error_lines[0] if error_lines else result["status"])
+                stats = result["result"]
+            else:
+                stats = convert_to_ass(*args)
+        except Exception as e:
+            logger.error(f"转换 {recording.xml} 失败: {e}")
+            recording.record_stage("convert", "failed", started, str(e))
+            metrics.STAGE_RESULTS.inc(stage="convert", status="failed")
+            return False
+        recording.record_stage("convert", "success", started)
+        recording.stages["convert"]["stats"] = stats
+        if stats:
+            # dmconvert 转换没有统计，使用弹幕索引中的数量
+            recording.danmaku = stats.get("danmaku", stats.get("indexed"))
+        self._record_convert_metrics(recording, stats)
+        if self.ledger is not None:
+            self.ledger.mark_done(recording.xml, "convert", recording.xml_stat.st_size, recording.xml_stat.st_mtime)
+        return True
+
+    @staticmethod
+    def _record_convert_metrics(recording, stats):
+        metrics.STAGE_RESULTS.inc(stage="convert", status="success")
+        metrics.STAGE_SECONDS.observe(recording.stages["convert"]["seconds"], stage="convert")
+        metrics.STAGE_BYTES_IN.inc(recording.xml_stat.st_size, stage="convert")
+        try:
+            metrics.STAGE_BYTES_OUT.inc(os.path.getsize(recording.ass), stage="convert")
+        except OSError:
+            pass
+        for kind in ("danmaku", "events"):
+            if stats and stats.get(kind) is not None:
+                metrics.DANMAKU_EVENTS.observe(stats[kind], kind=kind)
+
+    def _choose_mode(self, recording) -> str:
+        """按规则选择录播的输出模式：弹幕少于 remux_max_danmaku 条时直接 remux，否则使用 output_mode"""
+        if self.remux_max_danmaku <= 0 or self.output_mode == "remux":
+            return self.output_mode
+        count = recording.danmaku
+        if count is None and os.path.exists(recording.xml):
+            try:
+                count = count_danmaku(recording.xml)
+            except Exception as e:
+                logger.warning(f"统计 {recording.xml} 的弹幕数量失败: {e}")
+        if count is not None and count < self.remux_max_danmaku:
+            logger.info(f"{recording.name} 只有 {count} 条弹幕 (少于 {self.remux_max_danmaku})，直接 remux 不重新压制")
+            return "remux"
+        return self.output_mode
+
+    def _plan_segments(self, job):
+        """为长录播规划分段，硬件编码会话有限，只对软件编码分段"""
+        if self.segment_workers <= 1 or self.probe_cache is None or not self.backends:
+            return None
+        if self.backends[0].hardware or not job.duration or job.duration < self.segment_min_duration:
+            return None
+        try:
+            info = self.probe_cache.get(job.video, keyframes=True)
+        except Exception as e:
+            logger.warning(f"读取 {job.video} 关键帧失败，不分段压制: {e}")
+            return None
+        # 分段数为并行数的两倍，各分段复杂度不同时可以更均匀地分配到各个进程
+        return plan_segments(info["keyframes"], info["duration"], self.segment_workers * 2)
+
+    def _encode_job(self, job):
+        def report(progress):
+            job.set_progress(progress)
+            if self.progress is not None:
+                self.progress.update(job.video, progress)
+
+        if self.control is not None:
+            self.control.check()
+        try:
+            if job.mode != "burn":
+                job.backend = mux(job.video, job.ass, job.mp4, job.mode, self.test_mode,
+                                  duration=job.duration, on_progress=report, control=self.control,
+                                  priority=self.priorities.get("encode"), scratch_dir=self.scratch_dir)
+            else:
+                job.backend = encode(job.video, job.ass, job.mp4, self.test_mode, self.backends,
+                                     duration=job.duration, on_progress=report,
+                                     segments=self._plan_segments(job), segment_workers=self.segment_workers,
+                                     control=self.control, priority=self.priorities.get("encode"),
+                                     scratch_dir=self.scratch_dir)
+        finally:
+            if self.progress is not None:
+                self.progress.remove(job.video)
+        if self.ledger is not None:
+            self.ledger.mark_done(job.video, "encode", job.size, job.mtime)
+
+    def _on_encoded(self, recording, job):
+        recording.stages["encode"] = {
+            "status": job.status,
+            "seconds": job.to_dict()["encode_seconds"],
+            "error": job.error,
+        }
+        if job.status != "success":
+            recording.status = "cancelled" if job.status == "cancelled" else "failed"
+            return
+        if recording.status != "failed":
+            recording.status = "success"
+        if self.upload_queue is not None:
+            error = verify_output(job.mp4, job.duration, priority=self.priorities.get("probe"))
+            if error:
+                logger.error(f"{job.mp4} 校验失败，不上传: {error}")
+                recording.stages["upload"] = {"status": "skipped", "seconds": 0.0, "error": error}
+            elif self.upload_queue.submit(job.mp4):
+                recording.stages["upload"] = {"status": "queued", "seconds": 0.0, "error": None}
+
+    def _process(self, recording):
+        """单个录播文件的流水线：探测、转换，然后提交压制"""
+        if self.control is not None and self.control.cancelled:
+            recording.record_stage("convert" if recording.needs_convert else "encode", "cancelled", time.time())
+            return
+        self._probe(recording)
+        if recording.needs_convert and not self._convert(recording):
+            return
+        if not recording.needs_encode:
+            recording.status = "success"
+            return
+        recording.mode = self._choose_mode(recording)
+        recording.mp4 = output_path(recording.base, recording.mode)
+        if recording.mode != "remux" and not os.path.exists(recording.ass):
+            recording.record_stage("encode", "skipped", time.time(), "未找到匹配的ASS文件")
+            return
+        hardware = self.backends[0].hardware if self.backends else True
+        job = EncodeJob(recording.flv, recording.ass, recording.mp4, hardware=hardware, duration=recording.duration,
+                        stat=recording.flv_stat, room=self.room, priority=self.priority, mode=recording.mode)
+        job.encode_func = self._encode_job
+        job.on_done = lambda finished_job: self._on_encoded(recording, finished_job)
+        with self._lock:
+            self._jobs.append(job)
+        self.scheduler.submit(job)
+
+    def run(self) -> dict:
+        """
+        执行流水线并阻塞直到所有录播文件处理完成。
+
+        Returns:
+            包含分段合并结果、每个录播文件各阶段结果、转换汇总和压制调度汇总的字典。
+        """
+        started = time.time()
+        merged = self._merge_sessions() if self.merge_sessions else []
+        recordings = self.discover()
+        logger.info(f"流水线: 找到 {len(recordings)} 个需要处理的录播文件 "
+                    f"(转换 {sum(r.needs_convert for r in recordings)} 个，压制 {sum(r.needs_encode for r in recordings)} 个)")
+        # 按压制调度的排序策略决定转换顺序，让最先压制的文件最先完成转换，只需要转换的文件排在最后
+        recordings.sort(key=lambda r: (0, self.scheduler.order_key(r.flv_stat.st_size, r.flv_stat.st_mtime))
+                        if r.flv_stat is not None else (1, 0))
+
+        if self.convert_workers > 0 and any(r.needs_convert for r in recordings):
+            self._convert_pool = WorkerPool(self.convert_workers, priority=self.priorities.get("convert"))
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, self.convert_workers)) as executor:
+                for future in [executor.submit(self._process, r) for r in recordings]:
+                    future.result()
+        finally:
+            if self._convert_pool is not None:
+                self._convert_pool.close()
+                self._convert_pool = None
+        encode_summary = self.scheduler.wait(self._jobs)
+
+        converted = [r.xml for r in recordings if r.stages.get("convert", {}).get("status") == "success"]
+        convert_errors = [f"{r.xml}: {r.stages['convert']['error']}" for r in recordings
+                          if r.stages.get("convert", {}).get("status") == "failed"]
+        return {
+            "room": self.room,
+            "wall_seconds": round(time.time() - started, 3),
+            "merged": merged,
+            "recordings": [r.to_dict() for r in recordings],
+            "convert": {"converted": converted, "errors": convert_errors},
+            "encode": encode_summary,
+        }
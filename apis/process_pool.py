@@ -0,0 +1,279 @@
+import time
+import logging
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+
+logger = logging.getLogger(__name__)
+
+# 子进程强制结束前等待正常退出的时间 (秒)
+TERMINATE_GRACE = 5.0
+
+
+def _get_context():
+    # 调用方进程中有调度/监听线程，forkserver 比 fork 更安全
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _task_entry(conn, func, args, priority=None):
+    """子进程入口：设置进程优先级后执行任务，并通过管道返回结果"""
+    try:
+        if priority is not None:
+            priority.apply()
+        result = func(*args)
+        conn.send(("success", result))
+    except BaseException as e:
+        conn.send(("failed", f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+    finally:
+        conn.close()
+
+
+class _Running:
+    def __init__(self, key, process, conn, started_at):
+        self.key = key
+        self.process = process
+        self.conn = conn
+        self.started_at = started_at
+        self.payload = None
+
+
+def run_in_processes(func, tasks, workers: int = 2, timeout: float = None, priority=None) -> list:
+    """
+    使用独立子进程并行执行 CPU 密集型任务。
+
+    每个任务使用一个新的子进程，超时的任务会被强制结束，崩溃或超时都不会影响其它任务。
+
+    Args:
+        func: 模块级函数，必须可被子进程导入。
+        tasks: (key, args) 列表，key 用于标识结果，args 为传给 func 的参数元组。
+        workers: 同时运行的子进程数。
+        timeout: 单个任务的超时时间 (秒)，None 表示不限制。
+        priority: 可选的 ProcessPriority (见 apis.process_priority)，子进程启动后应用到自身。
+
+    Returns:
+        与 tasks 顺序一致的结果字典列表，包含 key、status (success/failed/timeout)、
+        result、error 和 seconds。
+    """
+    ctx = _get_context()
+    workers = max(1, workers)
+    pending = list(tasks)
+    results = {}
+    running = []
+
+    def finish(item, status, result=None, error=None):
+        results[item.key] = {
+            "key": item.key,
+            "status": status,
+            "result": result,
+            "error": error,
+            "seconds": round(time.time() - item.started_at, 3),
+        }
+        item.conn.close()
+
+    while pending or running:
+        while pending and len(running) < workers:
+            key, args = pending.pop(0)
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_task_entry, args=(child_conn, func, args, priority), daemon=True)
+            process.start()
+            child_conn.close()
+            running.append(_Running(key, process, parent_conn, time.time()))
+
+        wait_timeout = None
+        if timeout is not None:
+            nearest = min(item.started_at + timeout for item in running)
+            wait_timeout = max(0.0, nearest - time.time())
+        # 同时等待管道，避免较大的结果填满管道缓冲区导致子进程无法退出
+        waitables = [item.process.sentinel for item in running]
+        waitables += [item.conn for item in running if item.payload is None]
+        wait(waitables, timeout=wait_timeout)
+
+        now = time.time()
+        for item in list(running):
+            alive = item.process.is_alive()
+            # 先判断存活再读取管道，子进程在两次检查之间退出时也能读到结果
+            if item.payload is None and item.conn.poll():
+                try:
+                    item.payload = item.conn.recv()
+                except EOFError:
+                    item.payload = ("failed", None)
+            if not alive:
+                item.process.join()
+                if item.payload is not None and item.payload[0] == "success":
+                    finish(item, "success", result=item.payload[1])
+                elif item.payload is not None and item.payload[1]:
+                    finish(item, "failed", error=item.payload[1])
+                else:
+                    finish(item, "failed", error=f"子进程异常退出，退出码 {item.process.exitcode}")
+                running.remove(item)
+            elif timeout is not None and now - item.started_at >= timeout:
+                logger.error(f"任务 {item.key} 超过 {timeout}s 未完成，强制结束子进程")
+                item.process.terminate()
+                item.process.join(TERMINATE_GRACE)
+                if item.process.is_alive():
+                    item.process.kill()
+                    item.process.join()
+                finish(item, "timeout", error=f"超过 {timeout}s 未完成")
+                running.remove(item)
+
+    return [results[key] for key, _ in tasks]
+
+
+def _worker_loop(conn, priority=None):
+    """常驻子进程入口：设置进程优先级后循环执行收到的任务，收到 None 时退出"""
+    if priority is not None:
+        priority.apply()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        func, args = task
+        try:
+            conn.send(("success", func(*args)))
+        except BaseException as e:
+            conn.send(("failed", f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+    def stop(self, force=False):
+        if not force:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                force = True
+        if force:
+            self.process.terminate()
+        self.process.join(TERMINATE_GRACE)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """
+    常驻子进程池：最多 workers 个子进程，每个子进程依次执行多个任务，避免每个任务都启动一个新进程。
+
+    run() 可以在多个线程中同时调用，每次调用独占一个空闲的子进程；超时或崩溃的子进程会被结束并丢弃，
+    下一个任务启动新的子进程，不影响其它任务。
+    """
+    def __init__(self, workers: int = 2, priority=None):
+        """
+        初始化 WorkerPool。子进程在第一次需要时才启动。
+
+        Args:
+            workers: 子进程数上限。
+            priority: 可选的 ProcessPriority (见 apis.process_priority)，子进程启动后应用到自身。
+        """
+        self.workers = max(1, workers)
+        self.priority = priority
+        self._ctx = _get_context()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._count = 0
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _acquire(self):
+        with self._cond:
+            while not self._idle and self._count >= self.workers and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("进程池已关闭")
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+        try:
+            parent_conn, child_conn = self._ctx.Pipe()
+            process = self._ctx.Process(target=_worker_loop, args=(child_conn, self.priority), daemon=True)
+            process.start()
+            child_conn.close()
+        except BaseException:
+            self._discard(None)
+            raise
+        return _Worker(process, parent_conn)
+
+    def _release(self, worker):
+        with self._cond:
+            if self._closed:
+                worker.stop()
+                self._count -= 1
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def _discard(self, worker, force=True):
+        if worker is not None:
+            worker.stop(force=force)
+        with self._cond:
+            self._count -= 1
+            self._cond.notify()
+
+    def run(self, key, func, args, timeout: float = None) -> dict:
+        """
+        在空闲的子进程中执行 func(*args) 并阻塞等待结果，没有空闲子进程时等待。
+
+        Args:
+            key: 任务标识，记录在结果中。
+            func: 模块级函数，必须可被子进程导入。
+            args: 传给 func 的参数元组。
+            timeout: 超时时间 (秒)，超时后强制结束该子进程；None 表示不限制。
+
+        Returns:
+            结果字典，格式与 run_in_processes 的单个结果相同。
+        """
+        worker = self._acquire()
+        started_at = time.time()
+
+        def finish(status, result=None, error=None):
+            return {
+                "key": key,
+                "status": status,
+                "result": result,
+                "error": error,
+                "seconds": round(time.time() - started_at, 3),
+            }
+
+        try:
+            worker.conn.send((func, args))
+            ready = worker.conn.poll(timeout)
+            payload = worker.conn.recv() if ready else None
+        except (EOFError, OSError):
+            self._discard(worker)
+            return finish("failed", error=f"子进程异常退出，退出码 {worker.process.exitcode}")
+        except BaseException:
+            self._discard(worker)
+            raise
+        if payload is None:
+            logger.error(f"任务 {key} 超过 {timeout}s 未完成，强制结束子进程")
+            self._discard(worker)
+            return finish("timeout", error=f"超过 {timeout}s 未完成")
+        self._release(worker)
+        if payload[0] == "success":
+            return finish("success", result=payload[1])
+        return finish("failed", error=payload[1])
+
+    def close(self):
+        """结束所有空闲的子进程，正在执行任务的子进程在任务完成后结束"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+            self._cond.notify_all()
+        for worker in idle:
+            worker.stop()
@@ -0,0 +1,142 @@
+import os
+import shutil
+import logging
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# ionice 调度类别名称 -> ionice -c 参数
+IONICE_CLASSES = {"realtime": "1", "rt": "1", "best-effort": "2", "be": "2", "idle": "3"}
+
+
+def parse_cpus(value: str) -> set:
+    """解析 CPU 列表，如 "0-3,6" -> {0, 1, 2, 3, 6}"""
+    cpus = set()
+    for part in value.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        cpus.update(range(int(first), int(last) + 1) if sep else [int(first)])
+    if not cpus:
+        raise ValueError(f"CPU 列表为空: {value}")
+    return cpus
+
+
+class ProcessPriority:
+    """
+    外部进程 (ffmpeg / ffprobe / biliup) 与转换子进程的 CPU 优先级、IO 优先级和 CPU 亲和性。
+
+    外部命令通过 nice / ionice / taskset 包装后启动，这三个工具都会 exec 目标程序，
+    进程 ID 不变，取消任务时仍能直接结束目标进程；Python 子进程在启动后调用 apply() 设置自身。
+    """
+    def __init__(self, nice: int = None, ionice: str = None, cpus=None):
+        """
+        初始化 ProcessPriority。
+
+        Args:
+            nice: nice 值 (-20 ~ 19)，越大优先级越低，None 表示不调整。
+            ionice: IO 调度类别，idle、best-effort (be) 或 realtime (rt)，可用 "be:7" 指定级别 (0 ~ 7)。
+            cpus: 允许运行的 CPU 编号集合或列表字符串 (如 "2-7")，None 表示不限制。
+        """
+        self.nice = nice
+        self.ionice = ionice or None
+        self.ionice_class = None
+        self.ionice_level = None
+        if ionice:
+            name, _, level = ionice.partition(":")
+            if name.strip().lower() not in IONICE_CLASSES:
+                raise ValueError(f"不支持的 IO 调度类别: {name}，可选: idle, best-effort, realtime")
+            self.ionice_class = IONICE_CLASSES[name.strip().lower()]
+            if level.strip():
+                self.ionice_level = int(level)
+        self.cpus = parse_cpus(cpus) if isinstance(cpus, str) else (set(cpus) if cpus else None)
+        self._missing = [tool for tool, needed in (("nice", self.nice is not None),
+                                                   ("ionice", self.ionice_class is not None),
+                                                   ("taskset", self.cpus is not None))
+                         if needed and shutil.which(tool) is None]
+        if self._missing:
+            logger.warning(f"未找到 {', '.join(self._missing)}，外部进程的对应优先级设置不会生效")
+
+    @classmethod
+    def parse(cls, spec: str):
+        """
+        解析配置字符串，如 "nice=10,ionice=idle,cpus=2-7"，空字符串返回 None。
+
+        cpus 中的多个区间用分号分隔，如 "cpus=0-1;4-5"。
+        """
+        if not spec or not spec.strip():
+            return None
+        options = {}
+        for item in spec.split(","):
+            key, sep, value = item.partition("=")
+            key = key.strip().lower()
+            if not sep or key not in ("nice", "ionice", "cpus"):
+                raise ValueError(f"无效的优先级设置: {item}，格式如 nice=10,ionice=idle,cpus=2-7")
+            options[key] = value.strip()
+        if "nice" in options:
+            options["nice"] = int(options["nice"])
+        return cls(**options)
+
+    def __bool__(self):
+        return self.nice is not None or self.ionice_class is not None or self.cpus is not None
+
+    def describe(self) -> str:
+        parts = []
+        if self.nice is not None:
+            parts.append(f"nice={self.nice}")
+        if self.ionice_class is not None:
+            parts.append(f"ionice={self.ionice}")
+        if self.cpus is not None:
+            parts.append(f"cpus={','.join(map(str, sorted(self.cpus)))}")
+        return " ".join(parts) or "默认"
+
+    def _ionice_args(self) -> list:
+        if self.ionice_class is None or "ionice" in self._missing:
+            return []
+        args = ["ionice", "-c", self.ionice_class]
+        # idle 类别没有级别
+        if self.ionice_level is not None and self.ionice_class != "3":
+            args += ["-n", str(self.ionice_level)]
+        return args
+
+    def wrap(self, cmd: list) -> list:
+        """返回加上 nice / ionice / taskset 前缀的命令"""
+        prefix = []
+        if self.nice is not None and "nice" not in self._missing:
+            prefix += ["nice", "-n", str(self.nice)]
+        prefix += self._ionice_args()
+        if self.cpus is not None and "taskset" not in self._missing:
+            prefix += ["taskset", "-c", ",".join(map(str, sorted(self.cpus)))]
+        return prefix + list(cmd)
+
+    def apply(self):
+        """将优先级应用到当前进程，用于转换等 Python 子进程"""
+        if self.nice is not None:
+            try:
+                os.nice(self.nice - os.nice(0))
+            except OSError as e:
+                logger.warning(f"设置 nice 值失败: {e}")
+        if self.cpus is not None:
+            try:
+                os.sched_setaffinity(0, self.cpus)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"设置 CPU 亲和性失败: {e}")
+        ionice_args = self._ionice_args()
+        if ionice_args:
+            try:
+                subprocess.run(ionice_args + ["-p", str(os.getpid())], check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.warning(f"设置 IO 优先级失败: {e}")
+
+
+def parse_priorities(specs: dict) -> dict:
+    """将 阶段 -> 配置字符串 解析为 阶段 -> ProcessPriority，未配置的阶段不包含在结果中"""
+    priorities = {}
+    for stage, spec in specs.items():
+        priority = ProcessPriority.parse(spec)
+        if priority:
+            logger.info(f"{stage} 阶段进程优先级: {priority.describe()}")
+            priorities[stage] = priority
+    return priorities
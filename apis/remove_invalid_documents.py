@@ -1,7 +1,13 @@
 import os
+import time
+import fnmatch
 import logging
 from pathlib import Path
 
+from apis import metrics
+from apis.dir_index import DirectoryIndex
+from apis.rooms import DEFAULT_NAME_PATTERN
+
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -10,25 +16,30 @@ class BackupCleaner:
     """
     用于清理 backup 文件夹中无效备份文件的类。
     """
-    def __init__(self, backup_dir: str = "backup"):
+    def __init__(self, backup_dir: str = "backup", ledger=None, name_pattern: str = DEFAULT_NAME_PATTERN):
         """
         初始化 BackupCleaner。
 
         Args:
             backup_dir: 备份文件夹相对于项目根目录的路径。默认为 "backup"。
+            ledger: 可选的 JobLedger，提供时目录未变化则跳过扫描，并记录已检查过的文件。
+            name_pattern: 只清理主文件名 (不含 .flv) 匹配该 fnmatch 通配符的录播文件。
         """
         self.backup_path = Path(backup_dir)
+        self.ledger = ledger
+        self.name_pattern = name_pattern
         if not self.backup_path.is_dir():
             logger.warning(f"备份文件夹 {self.backup_path} 不存在或不是一个目录。")
             # 可以选择在这里抛出异常或创建目录
             # self.backup_path.mkdir(parents=True, exist_ok=True)
 
-    def remove_small_backups(self, min_size_mb: float = 1.0):
+    def remove_small_backups(self, min_size_mb: float = 1.0, index: DirectoryIndex = None):
         """
         遍历 backup 文件夹，删除小于指定大小 (MB) 的 .flv 文件及其对应的 .xml 文件。
 
         Args:
             min_size_mb: 文件大小的阈值 (MB)。小于此大小的 .flv 文件将被删除。默认为 1.0 MB。
+            index: 可选的 DirectoryIndex，与后续的转换、压制阶段共享同一次目录扫描。
         """
         if not self.backup_path.is_dir():
             logger.error(f"无法访问备份文件夹: {self.backup_path}")
@@ -36,43 +47,61 @@ class BackupCleaner:
 
         min_size_bytes = min_size_mb * 1024 * 1024
         count_deleted = 0
+        started = time.time()
 
         logger.info(f"开始扫描备份文件夹: {self.backup_path}")
-        for item in self.backup_path.iterdir():
-            # 检查是否是文件以及后缀是否为 .flv
-            if item.is_file() and item.suffix == '.flv':
-                # 简单的名称检查（可以根据需要使用更复杂的正则表达式）
-                if item.name.startswith("银剑君录播") and "T" in item.name:
-                    try:
-                        file_size = item.stat().st_size
-                        if file_size < min_size_bytes:
-                            logger.info(f"找到小于 {min_size_mb}MB 的文件: {item.name} ({file_size / 1024 / 1024:.2f}MB)")
+        if index is None:
+            index = DirectoryIndex()
+        snapshot = index.folder(str(self.backup_path))
+        if snapshot is None:
+            return
+        for item in snapshot.files(".flv"):
+            # 按房间配置的文件名规则检查
+            if not (item.name.endswith(".flv") and fnmatch.fnmatchcase(item.name[:-4], self.name_pattern)):
+                continue
+            try:
+                if not item.is_file():
+                    continue
+                # DirEntry 会缓存 stat 结果，后续阶段不会重复 stat
+                stat = item.stat()
+                ledger_key = str(self.backup_path / item.name)
+                file_size = stat.st_size
+                if self.ledger is not None and self.ledger.is_done(ledger_key, "clean", file_size, stat.st_mtime):
+                    continue
+                if file_size >= min_size_bytes and self.ledger is not None:
+                    self.ledger.mark_done(ledger_key, "clean", file_size, stat.st_mtime)
+                if file_size < min_size_bytes:
+                    logger.info(f"找到小于 {min_size_mb}MB 的文件: {item.name} ({file_size / 1024 / 1024:.2f}MB)")
 
-                            # 构建对应的 xml 文件路径
-                            xml_file = item.with_suffix('.xml')
+                    # 对应的 xml 文件
+                    xml_file = snapshot.get(os.path.splitext(item.name)[0], ".xml")
 
-                            # 删除 flv 文件
-                            try:
-                                item.unlink()
-                                logger.info(f"已删除文件: {item.name}")
-                                count_deleted += 1
-                            except OSError as e:
-                                logger.error(f"删除文件 {item.name} 时出错: {e}")
+                    # 删除 flv 文件
+                    try:
+                        os.unlink(item.path)
+                        index.discard(item.path)
+                        logger.info(f"已删除文件: {item.name}")
+                        count_deleted += 1
+                        metrics.STAGE_RESULTS.inc(stage="clean", status="deleted")
+                    except OSError as e:
+                        logger.error(f"删除文件 {item.name} 时出错: {e}")
 
-                            # 删除对应的 xml 文件（如果存在）
-                            if xml_file.exists() and xml_file.is_file():
-                                try:
-                                    xml_file.unlink()
-                                    logger.info(f"已删除对应的 XML 文件: {xml_file.name}")
-                                except OSError as e:
-                                    logger.error(f"删除文件 {xml_file.name} 时出错: {e}")
-                            else:
-                                logger.warning(f"未找到对应的 XML 文件或该路径不是文件: {xml_file.name}")
+                    # 删除对应的 xml 文件（如果存在）
+                    if xml_file is not None and xml_file.is_file():
+                        try:
+                            os.unlink(xml_file.path)
+                            index.discard(xml_file.path)
+                            logger.info(f"已删除对应的 XML 文件: {xml_file.name}")
+                        except OSError as e:
+                            logger.error(f"删除文件 {xml_file.name} 时出错: {e}")
+                    else:
+                        logger.warning(f"未找到对应的 XML 文件或该路径不是文件: {os.path.splitext(item.name)[0]}.xml")
 
-                    except FileNotFoundError:
-                         # 文件在检查大小和删除之间可能已被移除
-                         logger.warning(f"文件 {item.name} 在处理过程中消失。")
-                    except Exception as e:
-                        logger.error(f"处理文件 {item.name} 时发生未知错误: {e}")
+            except FileNotFoundError:
+                 # 文件在检查大小和删除之间可能已被移除
+                 logger.warning(f"文件 {item.name} 在处理过程中消失。")
+            except Exception as e:
+                logger.error(f"处理文件 {item.name} 时发生未知错误: {e}")
 
+        metrics.STAGE_SECONDS.observe(time.time() - started, stage="clean")
         logger.info(f"扫描完成。总共删除了 {count_deleted} 个小于 {min_size_mb}MB 的 FLV 文件 (及其 XML 文件)。")
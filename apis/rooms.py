@@ -0,0 +1,96 @@
+import os
+import json
+import logging
+
+from apis.video_encoder import OUTPUT_MODES
+
+logger = logging.getLogger(__name__)
+
+# 默认的录播文件名规则 (fnmatch 通配符)，与原来只清理 "银剑君录播" 开头且包含 T 的文件一致
+DEFAULT_NAME_PATTERN = "银剑君录播*T*"
+
+
+class Room:
+    """
+    一个直播间的处理配置：备份与处理目录、录播文件名规则、清理阈值和压制优先级。
+    """
+    def __init__(self, name: str, backup_folder: str, processing_folder: str = None,
+                 name_pattern: str = DEFAULT_NAME_PATTERN, min_size_mb: float = 1.0, priority: int = 1,
+                 output_mode: str = "burn", remux_max_danmaku: int = 0):
+        """
+        初始化 Room。
+
+        Args:
+            name: 房间名称，用于日志、任务和处理结果。
+            backup_folder: 录播备份目录，清理阶段在此删除过小的录播。
+            processing_folder: 转换和压制的目录，默认与 backup_folder 相同。
+            name_pattern: 清理阶段只处理主文件名 (不含 .flv) 匹配该 fnmatch 通配符的录播文件。
+            min_size_mb: 小于该大小 (MB) 的录播视为无效并删除。
+            priority: 压制优先级 (正整数)，多个房间争用压制槽位时按优先级加权分配。
+            output_mode: 输出模式 burn / remux / softsub，见 apis.video_encoder.OUTPUT_MODES。
+            remux_max_danmaku: 大于 0 时，弹幕少于该数量的录播直接 remux，不重新压制。
+        """
+        if priority < 1:
+            raise ValueError(f"房间 {name} 的优先级必须为正整数: {priority}")
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"房间 {name} 的输出模式无效: {output_mode}，可选: {', '.join(OUTPUT_MODES)}")
+        self.name = name
+        self.backup_folder = os.path.abspath(backup_folder)
+        self.processing_folder = os.path.abspath(processing_folder or backup_folder)
+        self.name_pattern = name_pattern
+        self.min_size_mb = min_size_mb
+        self.priority = priority
+        self.output_mode = output_mode
+        self.remux_max_danmaku = remux_max_danmaku
+
+    @property
+    def folders(self) -> list:
+        return list(dict.fromkeys([self.processing_folder, self.backup_folder]))
+
+    def owns(self, path: str) -> bool:
+        """文件是否位于该房间的备份或处理目录下"""
+        path = os.path.abspath(path)
+        return any(path == folder or path.startswith(folder + os.sep) for folder in self.folders)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "backup_folder": self.backup_folder,
+            "processing_folder": self.processing_folder,
+            "name_pattern": self.name_pattern,
+            "min_size_mb": self.min_size_mb,
+            "priority": self.priority,
+            "output_mode": self.output_mode,
+            "remux_max_danmaku": self.remux_max_danmaku,
+        }
+
+
+def load_rooms(path: str, defaults: dict = None) -> list:
+    """
+    从 JSON 文件读取房间列表，格式为对象数组，字段与 Room 的参数相同，未填写的字段使用 defaults，例如:
+
+        [{"name": "room-a", "backup_folder": "/data/a", "name_pattern": "A录播*", "priority": 2},
+         {"name": "room-b", "backup_folder": "/data/b/backup", "processing_folder": "/data/b/work"}]
+
+    Raises:
+        ValueError: 配置格式错误、缺少必填字段或房间名称重复。
+    """
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"房间配置 {path} 必须是非空的数组")
+    rooms = []
+    for entry in entries:
+        try:
+            rooms.append(Room(**{**(defaults or {}), **entry}))
+        except TypeError as e:
+            raise ValueError(f"房间配置 {entry} 无效: {e}") from None
+    names = [room.name for room in rooms]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"房间名称重复: {', '.join(sorted(duplicates))}")
+    for room in rooms:
+        logger.info(f"房间 {room.name}: 备份目录 {room.backup_folder}，处理目录 {room.processing_folder}，"
+                    f"文件名规则 {room.name_pattern}，清理阈值 {room.min_size_mb}MB，优先级 {room.priority}，"
+                    f"输出模式 {room.output_mode}")
+    return rooms
@@ -0,0 +1,208 @@
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+from apis.ffmpeg_progress import run_ffmpeg
+from apis.job_manager import JobControl
+
+logger = logging.getLogger(__name__)
+
+# 每个分段的最短时长 (秒)，过短的分段会让并行的收益被启动开销抵消
+MIN_SEGMENT_SECONDS = 300.0
+
+ASS_TIME_RE = re.compile(r"(\d+):(\d{2}):(\d{2})\.(\d{2})")
+MOVE_RE = re.compile(r"\\move\(\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*\)")
+
+
+def parse_ass_time(value: str) -> float:
+    match = ASS_TIME_RE.fullmatch(value.strip())
+    if not match:
+        raise ValueError(f"无法解析的 ASS 时间: {value}")
+    hours, minutes, seconds, centis = (int(g) for g in match.groups())
+    return hours * 3600 + minutes * 60 + seconds + centis / 100
+
+
+def format_ass_time(seconds: float) -> str:
+    centis = max(0, int(round(seconds * 100)))
+    hours, centis = divmod(centis, 360000)
+    minutes, centis = divmod(centis, 6000)
+    secs, centis = divmod(centis, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centis:02d}"
+
+
+def plan_segments(keyframes, duration: float, count: int, min_seconds: float = MIN_SEGMENT_SECONDS) -> list:
+    """
+    在关键帧处把视频切分为时长大致相等的分段。
+
+    Args:
+        keyframes: 关键帧时间列表 (秒，相对于文件开头，见 apis.media_probe.probe)。
+        duration: 视频总时长 (秒)。
+        count: 期望的分段数。
+        min_seconds: 每个分段的最短时长。
+
+    Returns:
+        [(开始时间, 结束时间)] 列表，最后一段的结束时间为 None (到文件结尾)；
+        无法切分时只返回一个分段。
+    """
+    if not duration or not keyframes:
+        return [(0.0, None)]
+    count = max(1, min(count, int(duration // min_seconds)))
+    cuts = []
+    for i in range(1, count):
+        target = duration * i / count
+        # 取离目标时间最近的关键帧
+        nearest = min(keyframes, key=lambda t: abs(t - target))
+        previous = cuts[-1] if cuts else 0.0
+        if nearest - previous >= min_seconds and duration - nearest >= min_seconds:
+            cuts.append(nearest)
+    bounds = [0.0, *cuts]
+    return [(start, bounds[i + 1] if i + 1 < len(bounds) else None) for i, start in enumerate(bounds)]
+
+
+def _shift_move(text: str, fraction: float) -> str:
+    """事件被截去开头时，把 \\move 的起点改为截断时刻的位置，保持弹幕的运动轨迹不变"""
+    def replace(match):
+        x1, y1, x2, y2 = (float(v) for v in match.groups())
+        x = x1 + (x2 - x1) * fraction
+        y = y1 + (y2 - y1) * fraction
+        return f"\\move({x:g},{y:g},{x2:g},{y2:g})"
+    return MOVE_RE.sub(replace, text)
+
+
+def slice_ass(ass: str, out_ass: str, start: float, end: float = None) -> int:
+    """
+    截取 [start, end) 时间段内显示的 ASS 事件，并把时间平移到从 0 开始。
+
+    跨越开始时间的事件会被截短，滚动弹幕的 \\move 起点按截断时刻重新计算。
+
+    Returns:
+        写入的事件数量。
+    """
+    written = 0
+    with open(ass, "r", encoding="utf-8-sig") as src, open(out_ass, "w", encoding="utf-8") as dst:
+        for line in src:
+            if not line.startswith("Dialogue:"):
+                dst.write(line)
+                continue
+            prefix, _, rest = line.partition(":")
+            fields = rest.split(",", 9)
+            if len(fields) < 10:
+                continue
+            try:
+                event_start = parse_ass_time(fields[1])
+                event_end = parse_ass_time(fields[2])
+            except ValueError:
+                continue
+            if event_end <= start or (end is not None and event_start >= end):
+                continue
+            if event_start < start and event_end > event_start:
+                fields[9] = _shift_move(fields[9], (start - event_start) / (event_end - event_start))
+            fields[1] = format_ass_time(max(0.0, event_start - start))
+            fields[2] = format_ass_time(event_end - start)
+            dst.write(f"{prefix}:{','.join(fields)}")
+            written += 1
+    return written
+
+
+def _concat_list_entry(path: str) -> str:
+    return "file '" + path.replace("'", "'\\''") + "'\n"
+
+
+def encode_segments(video, ass, mp4, backend, segments, duration=None, workers=2, on_progress=None, control=None,
+                    priority=None):
+    """
+    分段并行压制：每个分段烧录对应时间段的弹幕后独立压制 (仅视频)，
+    最后无损拼接所有分段并复制源文件的音频流。
+
+    分段在关键帧处切分，分段边界前后没有重叠或缺失的帧，输出时长与单次压制一致；
+    音频直接取自源文件，不经过切分，音画同步不受影响。
+
+    Args:
+        video / ass / mp4: 源视频、完整的 ASS 文件和输出文件。
+        backend: 压制后端 (见 apis.encoder_backends)。
+        segments: plan_segments 返回的分段列表。
+        duration: 视频总时长，用于计算整体进度。
+        workers: 同时压制的分段数。
+        on_progress: 整体进度回调，参数格式同 run_ffmpeg。
+        control: 可选的 JobControl，任务取消时结束所有分段的 ffmpeg 进程。
+            任一分段失败时也会立即结束其它分段的 ffmpeg，不再等待它们压制完成。
+        priority: 可选的 ProcessPriority，应用到所有分段和拼接的 ffmpeg 进程。
+    """
+    workdir = os.path.splitext(mp4)[0] + ".segments"
+    os.makedirs(workdir, exist_ok=True)
+    lock = threading.Lock()
+    segment_progress = {}
+    started = time.time()
+    # 分段 ffmpeg 同时登记到任务的 control，一个分段失败时只结束本次的其它分段
+    segment_control = JobControl(grace_seconds=control.grace_seconds if control is not None else 10.0,
+                                 parent=control)
+
+    def report(index, progress):
+        if on_progress is None:
+            return
+        with lock:
+            segment_progress[index] = progress
+            out_time = sum(p["out_time"] or 0 for p in segment_progress.values())
+            frame = sum(p["frame"] or 0 for p in segment_progress.values())
+            total_size = sum(p["total_size"] or 0 for p in segment_progress.values())
+            fps = sum(p["fps"] or 0 for p in segment_progress.values())
+        elapsed = time.time() - started
+        speed = round(out_time / elapsed, 3) if elapsed > 0 else None
+        on_progress({
+            "frame": frame,
+            "fps": round(fps, 1),
+            "speed": speed,
+            "out_time": round(out_time, 3),
+            "total_size": total_size,
+            "duration": duration,
+            "percent": round(min(100.0, out_time / duration * 100), 1) if duration else None,
+            "eta_seconds": round(max(0.0, duration - out_time) / speed, 1) if duration and speed else None,
+            "state": "continue",
+            "segments": len(segments),
+            "updated_at": time.time(),
+        })
+
+    def encode_one(index):
+        start, end = segments[index]
+        segment_ass = os.path.join(workdir, f"{index:04d}.ass")
+        segment_mp4 = os.path.join(workdir, f"{index:04d}.mp4")
+        events = slice_ass(ass, segment_ass, start, end)
+        logger.info(f"分段 {index + 1}/{len(segments)}: {start:.3f}s - {end if end is not None else '结尾'}，弹幕事件 {events} 条")
+        cmd = backend.build_command(video, segment_ass, segment_mp4, start=start, end=end, audio=False)
+        segment_end = end if end is not None else duration
+        run_ffmpeg(cmd, duration=segment_end - start if segment_end else None,
+                   on_progress=lambda progress: report(index, progress), control=segment_control,
+                   priority=priority)
+        return segment_mp4
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(encode_one, index) for index in range(len(segments))]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = [future for future in futures if future in done and future.exception() is not None]
+            if failed:
+                segment_control.cancel()
+                executor.shutdown(cancel_futures=True)
+                raise failed[0].exception()
+            segment_files = [future.result() for future in futures]
+
+        concat_list = os.path.join(workdir, "concat.txt")
+        with open(concat_list, "w", encoding="utf-8") as f:
+            f.writelines(_concat_list_entry(path) for path in segment_files)
+        cmd = [
+            "ffmpeg", "-hide_banner",
+            "-f", "concat", "-safe", "0", "-i", concat_list,
+            "-i", video,
+            "-map", "0:v:0", "-map", "1:a?",
+            "-c", "copy",
+            "-y", mp4,
+        ]
+        logger.info(f"拼接 {len(segment_files)} 个分段: {mp4}")
+        run_ffmpeg(cmd, control=control, priority=priority)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    logger.info(f"分段压制完成: {mp4}，{len(segments)} 段，耗时 {time.time() - started:.1f}s")
@@ -0,0 +1,258 @@
+import os
+import re
+import shlex
+import logging
+import datetime
+import xml.etree.ElementTree as ET
+
+from apis.danmaku_index import index_path
+from apis.danmaku_stream import SIDE_TAGS
+from apis.ffmpeg_progress import run_ffmpeg
+from apis.segment_encoder import _concat_list_entry
+
+logger = logging.getLogger(__name__)
+
+# 录播文件名中的开始时间，如 银剑君录播2025-01-01T20_00_00 / 20-00-00 / 20:00:00
+TIMESTAMP_PATTERN = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})[T_ -]?(\d{2})[-_:]?(\d{2})[-_:]?(\d{2})")
+
+# 合并后的录播主文件名后缀，与第一个分段同名加上该后缀
+MERGED_SUFFIX = "_merged"
+
+# 合并过程中的临时文件后缀，如 xxx_merged.flv.merging，不会被当作录播文件处理
+MERGING_SUFFIX = ".merging"
+
+
+def parse_start(stem: str):
+    """
+    从录播主文件名中解析开始时间。
+
+    文件名中可能有其它数字 (如房间号)，依次尝试每个匹配位置，使用第一个有效的日期时间。
+
+    Returns:
+        (时间戳之前的文件名前缀, 开始时间的 Unix 时间戳)，文件名中没有有效的时间时返回 None。
+    """
+    for start in range(len(stem)):
+        match = TIMESTAMP_PATTERN.match(stem, start)
+        if match is None:
+            continue
+        try:
+            return stem[:match.start()], datetime.datetime(*map(int, match.groups())).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+class Segment:
+    """
+    同一场直播被断流拆分出的一个录播分段 (FLV 及同名的 XML)。
+    """
+    def __init__(self, base: str, prefix: str, start: float, info: dict = None, live: bool = False,
+                 mtime: float = None):
+        """
+        初始化 Segment。
+
+        Args:
+            base: 录播主文件路径 (不含扩展名)。
+            prefix: 文件名中时间戳之前的部分，只有前缀相同的分段才会合并。
+            start: 文件名中的开始时间 (Unix 时间戳)。
+            info: 探测结果 (见 apis.media_probe.probe)，用于获取时长并检查编码参数是否一致。
+            live: 是否仍在录制 (.flv.part)。
+            mtime: FLV 的修改时间，即录制结束的时间。
+        """
+        self.base = base
+        self.name = os.path.basename(base)
+        self.prefix = prefix
+        self.start = start
+        self.info = info or {}
+        self.live = live
+        self.mtime = mtime
+        self.flv = base + ".flv"
+        self.xml = base + ".xml"
+
+    @property
+    def duration(self):
+        return self.info.get("duration")
+
+    @property
+    def end(self):
+        return self.start + self.duration if self.duration else None
+
+    def compatible(self, other) -> bool:
+        """两个分段的编码和分辨率相同，才能直接复制流拼接"""
+        keys = ("video_codec", "audio_codec", "width", "height")
+        return all(self.info.get(key) == other.info.get(key) for key in keys)
+
+
+def group_sessions(segments, max_gap: float = 300.0) -> list:
+    """
+    将分段按直播场次分组：文件名前缀相同、按开始时间排序后相邻，且后一个分段的开始时间
+    与前一个分段的结束时间 (开始时间 + 时长) 相差不超过 max_gap 秒的分段属于同一场直播。
+
+    仍在录制的分段可以作为一场直播的最后一个分段；编码参数不同的分段不能无损拼接，会另起一组。
+
+    Returns:
+        分组列表，每组按开始时间排序。
+    """
+    by_prefix = {}
+    for segment in segments:
+        by_prefix.setdefault(segment.prefix, []).append(segment)
+    groups = []
+    for prefix in sorted(by_prefix):
+        current = []
+        for segment in sorted(by_prefix[prefix], key=lambda s: s.start):
+            previous = current[-1] if current else None
+            if (previous is not None and not previous.live and previous.end is not None
+                    and segment.start - previous.end <= max_gap
+                    and (segment.live or previous.compatible(segment))):
+                current.append(segment)
+            else:
+                if current:
+                    groups.append(current)
+                current = [segment]
+        if current:
+            groups.append(current)
+    return groups
+
+
+def merged_base(segments) -> str:
+    return segments[0].base + MERGED_SUFFIX
+
+
+def concat_command(list_file: str, output: str) -> list:
+    """使用 concat 分离器直接复制音视频流拼接分段的命令，输出为 FLV"""
+    return [
+        "ffmpeg", "-hide_banner",
+        "-f", "concat", "-safe", "0", "-i", list_file,
+        "-map", "0:v:0", "-map", "0:a?",
+        "-c", "copy", "-f", "flv",
+        "-y", output,
+    ]
+
+
+def merge_danmaku_xml(xml_files, offsets, output: str) -> int:
+    """
+    流式合并弹幕 XML：每个文件中弹幕 (d 元素的 p 属性第一项) 和醒目留言、礼物、上舰 (ts 属性)
+    的时间加上该分段在合并后视频中的起始时间，其它元素 (录制信息等) 只保留第一个文件中的。
+
+    不存在的 XML 视为没有弹幕；内存占用与文件大小无关。
+
+    Returns:
+        合并后的弹幕数量。
+    """
+    count = 0
+    with open(output, "w", encoding="utf-8") as out:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n<i>\n')
+        for i, (xml_file, offset) in enumerate(zip(xml_files, offsets)):
+            if not os.path.exists(xml_file):
+                logger.warning(f"{xml_file} 不存在，该分段没有弹幕")
+                continue
+            root = None
+            depth = 0
+            for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+                if event == "start":
+                    if root is None:
+                        root = elem
+                    depth += 1
+                    continue
+                depth -= 1
+                # 只处理根元素的直接子元素，嵌套元素随父元素一起输出
+                if depth != 1:
+                    continue
+                if elem.tag == "d":
+                    p_attrs = (elem.get("p") or "").split(",")
+                    try:
+                        p_attrs[0] = f"{float(p_attrs[0]) + offset:.3f}"
+                    except ValueError:
+                        logger.warning(f"跳过格式错误的弹幕: p={elem.get('p')}")
+                        root.clear()
+                        continue
+                    elem.set("p", ",".join(p_attrs))
+                    count += 1
+                elif elem.tag in SIDE_TAGS:
+                    if elem.get("ts") is not None:
+                        try:
+                            elem.set("ts", f"{float(elem.get('ts')) + offset:.3f}")
+                        except ValueError:
+                            pass
+                elif i > 0:
+                    root.clear()
+                    continue
+                elem.tail = "\n"
+                out.write(ET.tostring(elem, encoding="unicode"))
+                root.clear()
+        out.write("</i>\n")
+    return count
+
+
+def merge_session(segments, control=None, priority=None, test_mode=False, verify=None) -> str:
+    """
+    将同一场直播的分段无损合并为一个录播：concat 分离器复制流拼接 FLV，弹幕 XML 按各分段在
+    合并后视频中的起始时间 (之前各分段时长之和) 平移后合并。
+
+    合并结果先写入 .merging 临时文件，全部完成后重命名为 "第一个分段名_merged.flv / .xml"，
+    之后由流水线像普通录播一样转换和压制。合并成功且不是测试模式时删除各分段的 FLV、XML、ASS 和弹幕索引。
+
+    Args:
+        segments: group_sessions 返回的一组分段 (均已录制完成并探测过时长)。
+        control: 可选的 JobControl，任务取消时结束 ffmpeg。
+        priority: 可选的 ProcessPriority，设置 ffmpeg 的 CPU / IO 优先级。
+        test_mode: 为 True 时保留各分段文件。
+        verify: 可选的校验函数 verify(合并后的 FLV, 各分段时长之和)，返回失败原因或 None，
+            校验失败时放弃合并并保留各分段。
+
+    Returns:
+        合并后的录播主文件路径 (不含扩展名)。
+    """
+    unknown = [segment.name for segment in segments if not segment.duration]
+    if unknown:
+        raise ValueError(f"无法获取分段时长，不能计算弹幕偏移: {', '.join(unknown)}")
+    base = merged_base(segments)
+    flv, xml = base + ".flv", base + ".xml"
+    tmp_flv, tmp_xml = flv + MERGING_SUFFIX, xml + MERGING_SUFFIX
+    list_file = base + ".concat.txt"
+    offsets = []
+    total = 0.0
+    for segment in segments:
+        offsets.append(total)
+        total += segment.duration
+
+    try:
+        with open(list_file, "w", encoding="utf-8") as f:
+            for segment in segments:
+                f.write(_concat_list_entry(segment.flv))
+        cmd = concat_command(list_file, tmp_flv)
+        logger.info(f"合并 {len(segments)} 个分段 ({total:.0f}s): {shlex.join(cmd)}")
+        run_ffmpeg(cmd, duration=total, control=control, priority=priority)
+        has_xml = any(os.path.exists(segment.xml) for segment in segments)
+        if has_xml:
+            count = merge_danmaku_xml([segment.xml for segment in segments], offsets, tmp_xml)
+            logger.info(f"已合并弹幕: {count} 条")
+        if verify is not None:
+            error = verify(tmp_flv, total)
+            if error:
+                raise RuntimeError(f"合并结果校验失败: {error}")
+        if control is not None:
+            control.check()
+        # 先放置 XML，流水线看到 FLV 时弹幕已经就绪
+        if has_xml:
+            os.replace(tmp_xml, xml)
+        os.replace(tmp_flv, flv)
+    except BaseException:
+        for path in (tmp_flv, tmp_xml):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        if os.path.exists(list_file):
+            os.remove(list_file)
+
+    if not test_mode:
+        for segment in segments:
+            for path in (segment.flv, segment.xml, segment.base + ".ass", index_path(segment.xml)):
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except OSError as e:
+                    logger.error(f"删除分段文件 {path} 失败: {e}")
+        logger.info(f"已删除 {len(segments)} 个分段的源文件")
+    return base
@@ -0,0 +1,73 @@
+import os
+import uuid
+import errno
+import shutil
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 跨文件系统移动时，目标目录中临时文件的后缀
+STAGING_SUFFIX = ".staging"
+
+
+def move_into_place(src: str, dst: str):
+    """
+    将暂存文件原子地移动到目标路径。
+
+    同一文件系统内直接 rename；跨文件系统时先复制到目标目录中的隐藏临时文件，再 rename 为目标文件名，
+    目标路径上不会出现写了一半的文件。
+    """
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}{STAGING_SUFFIX}")
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.remove(src)
+
+
+@contextmanager
+def staged_output(path: str, scratch_dir: str = None, reserve_bytes: int = 0):
+    """
+    在暂存目录中生成输出文件，with 块正常结束后移动到 path，出错时删除暂存文件。
+
+    适用于输出目录在录制用的机械硬盘或 NAS 上的情况：压制期间的写入都落在本地高速磁盘，
+    目标目录只有最后一次顺序写入。未设置 scratch_dir，或暂存目录剩余空间小于 reserve_bytes 时，
+    直接在 path 上生成。
+
+    Yields:
+        实际写入的文件路径，扩展名与 path 相同，ffmpeg 可以据此选择封装格式。
+    """
+    if not scratch_dir:
+        yield path
+        return
+    try:
+        os.makedirs(scratch_dir, exist_ok=True)
+        free = shutil.disk_usage(scratch_dir).free
+    except OSError as e:
+        logger.warning(f"暂存目录 {scratch_dir} 不可用，直接写入目标目录: {e}")
+        yield path
+        return
+    if free < reserve_bytes:
+        logger.warning(f"暂存目录 {scratch_dir} 剩余空间 {free / 1024 ** 3:.1f}GB 不足，直接写入目标目录")
+        yield path
+        return
+
+    stem, ext = os.path.splitext(os.path.basename(path))
+    staged = os.path.join(scratch_dir, f"{stem}.{uuid.uuid4().hex[:8]}{ext}")
+    try:
+        yield staged
+        logger.info(f"将 {staged} 移动到 {path}")
+        move_into_place(staged, path)
+    finally:
+        if os.path.exists(staged):
+            os.remove(staged)
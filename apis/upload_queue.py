@@ -0,0 +1,291 @@
+import os
+import time
+import heapq
+import shlex
+import random
+import logging
+import threading
+import subprocess
+from collections import deque
+from contextlib import nullcontext
+
+from apis import metrics
+from apis.job_manager import JobCancelled
+
+logger = logging.getLogger(__name__)
+
+# 默认的单文件上传命令，{file} 会被替换为 MP4 文件路径
+# 不使用 -c：biliup-rs 指定配置文件时按配置中列出的视频投稿，会忽略命令行中的文件
+DEFAULT_UPLOAD_COMMAND = "./biliup upload {file}"
+
+# biliup-rs 指定配置文件的参数
+CONFIG_FLAGS = ("-c", "--config")
+
+# 保留的上传命令输出行数，用于错误报告
+OUTPUT_TAIL_LINES = 50
+
+# 扫描目录时加入上传队列的输出文件扩展名 (softsub 模式输出 MKV)
+UPLOAD_EXTENSIONS = (".mp4", ".mkv")
+
+
+class UploadItem:
+    """单个 MP4 文件的上传状态"""
+    def __init__(self, path: str):
+        self.path = path
+        self.status = "queued"
+        self.attempts = 0
+        self.error = None
+        self.queued_at = time.time()
+        self.next_attempt_at = self.queued_at
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "path": self.path,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "next_attempt_at": self.next_attempt_at if self.status == "retrying" else None,
+            "upload_seconds": round(self.finished_at - self.started_at, 3)
+            if self.started_at and self.finished_at else None,
+        }
+
+
+class UploadQueue:
+    """
+    逐个文件上传的队列：多个上传线程并行工作，失败后按指数退避重试，
+    上传成功的文件记录在任务台账中，不会重复上传。
+
+    上传在独立线程中进行，与压制同时运行。
+    """
+    def __init__(self, biliup_path: str, ledger=None, workers: int = 1, max_retries: int = 3,
+                 backoff_base: float = 60.0, backoff_max: float = 1800.0, command: str = DEFAULT_UPLOAD_COMMAND,
+                 timeout: float = None, priority=None, tracker=None):
+        """
+        初始化 UploadQueue。
+
+        Args:
+            biliup_path: biliup-rs 所在目录，上传命令在该目录下执行。
+            ledger: 可选的 JobLedger，用于记录和跳过已上传的文件。
+            workers: 同时上传的文件数。
+            max_retries: 失败后的最大重试次数。
+            backoff_base: 第一次重试前等待的秒数，之后每次翻倍。
+            backoff_max: 重试等待时间的上限 (秒)。
+            command: 上传命令模板，{file} 会被替换为 MP4 文件的绝对路径。投稿信息 (分区、标签等)
+                通过 biliup 的命令行参数传入；如需 -c 指定配置文件，该配置文件不能列出任何视频。
+            timeout: 单次上传的超时时间 (秒)，None 表示不限制。
+            priority: 可选的 ProcessPriority (见 apis.process_priority)，设置上传进程的 CPU / IO 优先级。
+            tracker: 可选的 tracker(文件路径)，返回产生 JobControl 的上下文管理器 (如 JobManager.track)，
+                每次上传登记为一个任务，任务被取消时结束 biliup 进程，该文件不再重试。
+        """
+        self.biliup_path = biliup_path
+        self.ledger = ledger
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.command = shlex.split(command)
+        if "{file}" not in self.command:
+            self.command.append("{file}")
+        if any(arg in CONFIG_FLAGS or arg.startswith("--config=") for arg in self.command):
+            logger.warning("上传命令指定了 biliup 配置文件，biliup 会上传配置中列出的视频并忽略 {file}，"
+                           "请确认该配置文件没有列出任何视频，否则每次上传都可能重复投稿")
+        self.timeout = timeout
+        self.priority = priority
+        self.tracker = tracker
+        self._cond = threading.Condition()
+        # (下次尝试时间, 序号, 文件路径)
+        self._heap = []
+        self._seq = 0
+        self._items = {}
+        self._active = 0
+        self._threads = []
+        self._stopped = False
+
+    def start(self):
+        """启动上传线程"""
+        with self._cond:
+            if self._threads:
+                return
+            self._stopped = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"upload-{i}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+        logger.info(f"上传队列已启动，并行上传数 {self.workers}")
+
+    def stop(self):
+        """停止上传线程，正在进行的上传会执行完毕"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+            self._threads = []
+        for thread in threads:
+            thread.join()
+
+    def submit(self, path: str) -> bool:
+        """
+        提交一个 MP4 文件。
+
+        Returns:
+            是否加入了队列；已上传、正在上传或已在队列中的文件返回 False。
+        """
+        path = os.path.abspath(path)
+        if self.ledger is not None and self.ledger.is_done(path, "upload"):
+            logger.debug(f"{path} 已上传过，跳过")
+            return False
+        with self._cond:
+            item = self._items.get(path)
+            if item is not None and item.status in ("queued", "uploading", "retrying", "success"):
+                return False
+            self._items[path] = UploadItem(path)
+            metrics.QUEUE_DEPTH.inc(queue="upload")
+            heapq.heappush(self._heap, (time.time(), self._seq, path))
+            self._seq += 1
+            self._cond.notify()
+        logger.info(f"已加入上传队列: {path}")
+        return True
+
+    def scan_folder(self, folder: str, settle_seconds: float = 60.0, exclude=()) -> int:
+        """
+        将目录下所有未上传的 MP4 / MKV 文件加入队列，用于启动时恢复和手动触发上传。
+
+        最近 settle_seconds 秒内修改过的文件 (可能仍在写入) 和 exclude 中的文件会被跳过。
+
+        Returns:
+            新加入队列的文件数。
+        """
+        excluded = {os.path.abspath(p) for p in exclude}
+        now = time.time()
+        submitted = 0
+        with os.scandir(folder) as it:
+            for entry in it:
+                if not entry.is_file() or not entry.name.lower().endswith(UPLOAD_EXTENSIONS):
+                    continue
+                if entry.path in excluded or now - entry.stat().st_mtime < settle_seconds:
+                    continue
+                if self.submit(entry.path):
+                    submitted += 1
+        return submitted
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        # 加入少量随机抖动，避免多个失败的文件同时重试
+        return delay + random.uniform(0, delay * 0.1)
+
+    def _run_upload(self, path: str, control=None):
+        if control is not None:
+            control.check()
+        cmd = [arg.replace("{file}", path) for arg in self.command]
+        if self.priority is not None:
+            cmd = self.priority.wrap(cmd)
+        output_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        logger.info(f"开始上传: {shlex.join(cmd)}")
+        with subprocess.Popen(cmd, cwd=self.biliup_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              text=True, encoding="utf-8", errors="replace") as proc, \
+                (control.track(proc) if control is not None else nullcontext()):
+            reader = threading.Thread(
+                target=lambda: output_tail.extend(line.rstrip("\n") for line in proc.stdout),
+                daemon=True,
+            )
+            reader.start()
+            try:
+                proc.wait(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+                reader.join()
+                metrics.SUBPROCESS_FAILURES.inc(tool="biliup")
+                raise RuntimeError(f"上传超过 {self.timeout}s 未完成")
+            reader.join()
+        if proc.returncode != 0:
+            if control is not None:
+                control.check()
+            metrics.SUBPROCESS_FAILURES.inc(tool="biliup")
+            raise RuntimeError(f"biliup 退出码 {proc.returncode}: " + "\n".join(list(output_tail)[-5:]))
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.time()):
+                    self._cond.wait(timeout=self._heap[0][0] - time.time() if self._heap else None)
+                if self._stopped:
+                    return
+                _, _, path = heapq.heappop(self._heap)
+                item = self._items[path]
+                item.status = "uploading"
+                item.attempts += 1
+                item.started_at = time.time()
+                self._active += 1
+
+            try:
+                stat = os.stat(path)
+                with self.tracker(path) if self.tracker is not None else nullcontext() as control:
+                    self._run_upload(path, control)
+            except JobCancelled:
+                with self._cond:
+                    self._active -= 1
+                    item.status = "cancelled"
+                    item.error = "任务已取消"
+                    item.finished_at = time.time()
+                    metrics.QUEUE_DEPTH.dec(queue="upload")
+                    self._cond.notify_all()
+                metrics.STAGE_RESULTS.inc(stage="upload", status="cancelled")
+                logger.info(f"已取消上传: {path}")
+                continue
+            except Exception as e:
+                with self._cond:
+                    self._active -= 1
+                    item.error = str(e)
+                    item.finished_at = time.time()
+                    if item.attempts <= self.max_retries and os.path.exists(path):
+                        delay = self._backoff(item.attempts)
+                        item.status = "retrying"
+                        item.next_attempt_at = time.time() + delay
+                        heapq.heappush(self._heap, (item.next_attempt_at, self._seq, path))
+                        self._seq += 1
+                        logger.warning(f"上传 {path} 失败 (第 {item.attempts} 次): {e}，{delay:.0f}s 后重试")
+                    else:
+                        item.status = "failed"
+                        metrics.QUEUE_DEPTH.dec(queue="upload")
+                        logger.error(f"上传 {path} 失败，已尝试 {item.attempts} 次: {e}")
+                    self._cond.notify_all()
+                metrics.STAGE_RESULTS.inc(stage="upload", status=item.status)
+                continue
+
+            if self.ledger is not None:
+                self.ledger.mark_done(path, "upload", stat.st_size, stat.st_mtime)
+            with self._cond:
+                self._active -= 1
+                item.status = "success"
+                item.error = None
+                item.finished_at = time.time()
+                self._cond.notify_all()
+            metrics.QUEUE_DEPTH.dec(queue="upload")
+            metrics.STAGE_RESULTS.inc(stage="upload", status="success")
+            metrics.STAGE_SECONDS.observe(item.finished_at - item.started_at, stage="upload")
+            metrics.STAGE_BYTES_IN.inc(stat.st_size, stage="upload")
+            logger.info(f"上传完成: {path}，耗时 {item.finished_at - item.started_at:.1f}s")
+
+    def pending(self) -> int:
+        """排队、重试等待中和正在上传的文件数"""
+        with self._cond:
+            return len(self._heap) + self._active
+
+    def join(self, timeout: float = None) -> bool:
+        """等待队列清空，返回是否在超时前完成"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._heap or self._active:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(timeout=remaining)
+        return True
+
+    def snapshot(self) -> list:
+        """所有提交过的文件的上传状态"""
+        with self._cond:
+            return [item.to_dict() for item in self._items.values()]
@@ -1,85 +1,213 @@
 import os
-import fnmatch
 import subprocess
 import datetime
 import shlex
 import logging
 
+from apis.dir_index import DirectoryIndex
+from apis.encode_scheduler import EncodeJob, EncodeScheduler
+from apis.encoder_backends import QsvBackend
+from apis.ffmpeg_progress import run_ffmpeg
+from apis.job_manager import JobCancelled
+from apis.segment_encoder import encode_segments
+from apis.staging import staged_output
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def encode(video, ass, mp4, test_mode=False):
-    """压制视频并合并弹幕"""
-    # 调整 FFmpeg 命令以使用 QSV 硬件加速
-    cmd = (
-        f'ffmpeg -v verbose '
-        f'-init_hw_device qsv=hw '
-        f'-hwaccel qsv '
-        f'-hwaccel_output_format qsv '
-        f'-i {shlex.quote(video)} '
-        f'-vf "ass={shlex.quote(ass)},hwupload=extra_hw_frames=64" '
-        f'-c:v h264_qsv '
-        f'-preset veryfast '
-        f'-global_quality 25 '
-        f'-c:a copy '
-        f'-y {shlex.quote(mp4)}'
-    )
+# 输出模式：burn 烧录弹幕重新压制；remux 直接复制音视频流封装为 MP4 (不含弹幕)；
+# softsub 复制音视频流并将 ASS 作为字幕轨封装为 MKV。后两种不重新编码，几乎不占用 CPU
+OUTPUT_MODES = ("burn", "remux", "softsub")
 
-    logger.info(f"开始压制时间：{datetime.datetime.now()}")
-    logger.info(f"执行命令: {cmd}") # 添加日志记录执行的命令
+def output_path(base, mode="burn"):
+    """录播主文件路径 (不含扩展名) 在指定输出模式下的输出文件路径"""
+    return base + (".mkv" if mode == "softsub" else ".mp4")
+
+def remove_sources(video, ass=None):
+    """删除压制完成的源视频和 ASS 文件"""
     try:
-        result = subprocess.run(
-            cmd,
-            shell=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        if result.stderr:
-            logger.info(result.stderr.decode('utf-8'))
-
-        # 非测试模式下删除源文件
-        if not test_mode:
+        removed = [video] + ([ass] if ass and os.path.exists(ass) else [])
+        for path in removed:
+            os.remove(path)
+        logger.info(f"已删除源文件: {' 和 '.join(removed)}")
+    except Exception as e:
+        logger.error(f"删除源文件失败: {e}")
+
+def mux_command(video, ass, output, mode):
+    """生成不重新编码的封装命令：remux 复制音视频流，softsub 额外将 ASS 封装为字幕轨"""
+    if mode == "remux":
+        return [
+            "ffmpeg", "-hide_banner",
+            "-i", video,
+            "-map", "0:v:0", "-map", "0:a?",
+            "-c", "copy", "-movflags", "+faststart",
+            "-y", output,
+        ]
+    if mode == "softsub":
+        return [
+            "ffmpeg", "-hide_banner",
+            "-i", video, "-i", ass,
+            "-map", "0:v:0", "-map", "0:a?", "-map", "1:0",
+            "-c", "copy",
+            "-metadata:s:s:0", "title=弹幕", "-disposition:s:0", "default",
+            "-y", output,
+        ]
+    raise ValueError(f"不支持的封装模式: {mode}，可选: remux, softsub")
+
+def mux(video, ass, output, mode, test_mode=False, duration=None, on_progress=None, control=None,
+        priority=None, scratch_dir=None):
+    """
+    不重新编码视频，直接复制音视频流封装为 MP4 (remux) 或带 ASS 字幕轨的 MKV (softsub)。
+
+    速度只受磁盘读写限制，几个小时的录播通常几十秒内完成。参数含义同 encode。
+    """
+    report = (lambda progress: on_progress({**progress, "backend": mode})) if on_progress else None
+    with staged_output(output, scratch_dir, reserve_bytes=_source_size(video)) as target:
+        cmd = mux_command(video, ass, target, mode)
+        logger.info(f"使用 {mode} 模式封装 (不重新编码)，执行命令: {shlex.join(cmd)}")
+        try:
+            log_tail = run_ffmpeg(cmd, duration=duration, on_progress=report, control=control, priority=priority)
+        except JobCancelled:
+            logger.warning(f"封装 {video} 已取消")
+            if os.path.exists(target):
+                os.remove(target)
+            raise
+        except subprocess.CalledProcessError as e:
+            logger.error(f"FFmpeg 封装失败 ({mode}): {e.stderr}")
+            raise
+    if log_tail:
+        logger.debug(log_tail)
+    if not test_mode:
+        remove_sources(video, ass)
+    return mode
+
+def _source_size(video):
+    try:
+        return os.path.getsize(video)
+    except OSError:
+        return 0
+
+def encode(video, ass, mp4, test_mode=False, backends=None, duration=None, on_progress=None,
+           segments=None, segment_workers=2, control=None, priority=None, scratch_dir=None):
+    """
+    压制视频并合并弹幕
+
+    backends 为按优先级排序的压制后端列表 (见 apis.encoder_backends.select_backends)，
+    硬件后端压制失败 (例如设备初始化失败) 时自动使用下一个后端重试。未提供时使用 QSV。
+    on_progress 为进度回调 (见 apis.ffmpeg_progress.run_ffmpeg)，duration 用于计算百分比和剩余时间。
+    segments 为关键帧切分的分段列表 (见 apis.segment_encoder.plan_segments)，多于一段时
+    使用 segment_workers 个 ffmpeg 进程分段并行压制后无损拼接。
+    control 为可选的 JobControl (见 apis.job_manager)，任务取消时结束 ffmpeg 并删除未完成的输出文件。
+    priority 为可选的 ProcessPriority (见 apis.process_priority)，设置 ffmpeg 的 CPU / IO 优先级和 CPU 亲和性。
+    scratch_dir 为暂存目录，提供时输出先写入该目录，压制完成后再原子地移动到 mp4 (见 apis.staging)，
+    删除源文件在移动完成之后进行。
+
+    Returns:
+        实际完成压制的后端名称。
+    """
+    if not backends:
+        backends = [QsvBackend()]
+
+    logger.info(f"开始压制时间：{datetime.datetime.now()}")
+    with staged_output(mp4, scratch_dir, reserve_bytes=_source_size(video)) as target:
+        for index, backend in enumerate(backends):
+            report = (lambda progress, name=backend.name: on_progress({**progress, "backend": name})) if on_progress else None
             try:
-                os.remove(video)
-                os.remove(ass)
-                logger.info(f"已删除源文件: {video} 和 {ass}")
-            except Exception as e:
-                logger.error(f"删除源文件失败: {e}")
+                if segments and len(segments) > 1:
+                    logger.info(f"使用 {backend.name} 后端分段压制，{len(segments)} 段，并行数 {segment_workers}")
+                    encode_segments(video, ass, target, backend, segments, duration=duration,
+                                    workers=segment_workers, on_progress=report, control=control, priority=priority)
+                else:
+                    cmd = backend.build_command(video, ass, target)
+                    logger.info(f"使用 {backend.name} 后端压制，执行命令: {shlex.join(cmd)}") # 添加日志记录执行的命令
+                    log_tail = run_ffmpeg(cmd, duration=duration, on_progress=report, control=control, priority=priority)
+                    if log_tail:
+                        logger.debug(log_tail)
+                break
+            except JobCancelled:
+                logger.warning(f"压制 {video} 已取消")
+                if os.path.exists(target):
+                    os.remove(target)
+                raise
+            except subprocess.CalledProcessError as e:
+                logger.error(f"FFmpeg 压制失败 ({backend.name}): {e.stderr}")
+                if not backend.hardware or index == len(backends) - 1:
+                    raise
+                logger.warning(f"{backend.name} 硬件压制失败，回退到 {backends[index + 1].name} 后端重试")
 
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FFmpeg 压制失败: {e.stderr.decode('utf-8')}")
-        raise
+    # 非测试模式下删除源文件
+    if not test_mode:
+        remove_sources(video, ass)
 
     logger.info(f"结束压制时间：{datetime.datetime.now()}")
+    return backend.name
 
-def process_folder(folder=".", test_mode=False):
-    """处理文件夹中的所有FLV和ASS文件"""
-    folder = os.path.abspath(folder)
-    all_files = os.listdir(folder)
-    logger.info(f"当前目录下的文件：{all_files}")
+def process_folder(folder=".", test_mode=False, max_workers=2, hw_slots=1, sw_slots=1, order="smallest",
+                   ledger=None, probe_cache=None, backends=None, index=None):
+    """
+    处理文件夹中的所有FLV和ASS文件，返回调度与每个任务的耗时信息
 
-    # 过滤掉 .flv.part 文件（录制中的文件）
-    flv_files = [os.path.join(folder, f) for f in all_files 
-                if fnmatch.fnmatch(f.lower(), "*.flv") and not f.lower().endswith(".flv.part")]
-    ass_files = [os.path.join(folder, f) for f in all_files if fnmatch.fnmatch(f.lower(), "*.ass")]
+    提供 ledger (JobLedger) 时，已压制过且未被改写的FLV不会重复压制。
+    提供 probe_cache (ProbeCache) 时，每个任务会附带视频时长，结果中包含压制速度。
+    backends 为压制后端列表，首选后端决定任务占用硬件还是软件并发槽位。
+    index (DirectoryIndex) 为与其它阶段共享的目录索引，FLV 与 ASS 按主文件名直接配对。
+    """
+    folder = os.path.abspath(folder)
+    if index is None:
+        index = DirectoryIndex()
+    snapshot = index.folder(folder)
+    if snapshot is None:
+        return {"jobs": [], "succeeded": 0, "failed": 0}
 
-    logger.info(f"找到的FLV文件：{flv_files}")
-    logger.info(f"找到的ASS文件：{ass_files}")
+    # .flv.part (录制中的文件) 的扩展名不同，不会被选中
+    flv_files = snapshot.files(".flv")
+    ass_count = len(snapshot.files(".ass"))
+    logger.info(f"找到 {len(flv_files)} 个FLV文件，{ass_count} 个ASS文件")
 
-    if not flv_files or not ass_files:
+    if not flv_files or not ass_count:
         logger.warning("未找到FLV或ASS文件！")
-        return
+        return {"jobs": [], "succeeded": 0, "failed": 0}
+
+    jobs = []
+    for flv_entry in flv_files:
+        flv_name = os.path.splitext(flv_entry.name)[0]
+        ass_entry = snapshot.get(flv_name, ".ass")
 
-    for flv_file in flv_files:
-        flv_name = os.path.splitext(os.path.basename(flv_file))[0]
-        ass_file = next((ass for ass in ass_files if os.path.splitext(os.path.basename(ass))[0] == flv_name), None)
+        if ass_entry is None:
+            logger.warning(f"未找到与 {flv_entry.path} 匹配的ASS文件，跳过处理。")
+            continue
 
-        if not ass_file:
-            logger.warning(f"未找到与 {flv_file} 匹配的ASS文件，跳过处理。")
+        mp4_file = os.path.splitext(flv_entry.path)[0] + ".mp4"
+        try:
+            stat = flv_entry.stat()
+        except OSError:
+            continue
+        job = EncodeJob(flv_entry.path, ass_entry.path, mp4_file,
+                        hardware=backends[0].hardware if backends else True, stat=stat)
+        if ledger is not None and ledger.is_done(flv_entry.path, "encode", job.size, job.mtime):
+            logger.info(f"{flv_entry.path} 已压制过，跳过")
             continue
+        jobs.append(job)
+
+    if probe_cache is not None and jobs:
+        infos = probe_cache.get_many([job.video for job in jobs])
+        for job in jobs:
+            info = infos.get(job.video)
+            if info:
+                job.duration = info["duration"]
 
-        logger.info(f"正在处理文件：{flv_file} 和 {ass_file}")
-        mp4_file = os.path.splitext(flv_file)[0] + ".mp4"
-        encode(flv_file, ass_file, mp4_file, test_mode)
+    def run_job(job):
+        job.backend = encode(job.video, job.ass, job.mp4, test_mode, backends,
+                             duration=job.duration, on_progress=job.set_progress)
+        if ledger is not None:
+            ledger.mark_done(job.video, "encode", job.size, job.mtime)
+
+    scheduler = EncodeScheduler(
+        run_job,
+        max_workers=max_workers,
+        hw_slots=hw_slots,
+        sw_slots=sw_slots,
+        order=order,
+    )
+    logger.info(f"共 {len(jobs)} 个压制任务，并发上限 {scheduler.max_workers}，排序策略 {order}")
+    return scheduler.run(jobs)
@@ -0,0 +1,73 @@
+# 对比普通转换与按密度排版生成的 ASS 的事件数量，以及烧录弹幕时的压制速度 (fps)
+#
+# 用法 (在项目根目录执行，需要 ffmpeg 且带有 libass 与 libx264):
+#   python -m benchmarks.ass_render --per-minute 2000 5000 --seconds 60
+import os
+import json
+import argparse
+import tempfile
+
+from benchmarks.synthetic import write_danmaku_xml
+from apis.danmaku_stream import convert_xml_to_ass_streaming
+from apis.danmaku_layout import layout_danmaku, MAX_ON_SCREEN, MERGE_WINDOW
+from apis.encoder_backends import escape_filter_arg
+from apis.ffmpeg_progress import run_ffmpeg
+
+
+def count_events(ass_file):
+    with open(ass_file, encoding="utf-8") as f:
+        return sum(1 for line in f if line.startswith("Dialogue:"))
+
+
+def render_fps(ass_file, seconds, size="1920x1080"):
+    """在合成画面上烧录弹幕并用 libx264 压制，返回平均 fps"""
+    cmd = [
+        "ffmpeg", "-hide_banner", "-v", "error",
+        "-f", "lavfi", "-i", f"color=c=gray:size={size}:rate=30:duration={seconds}",
+        "-vf", f"ass={escape_filter_arg(ass_file)}",
+        "-c:v", "libx264", "-preset", "ultrafast",
+        "-f", "null", "-",
+    ]
+    last = {}
+    run_ffmpeg(cmd, duration=seconds, on_progress=last.update)
+    return last.get("fps")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="弹幕排版对烧录速度的影响")
+    parser.add_argument("--per-minute", type=int, nargs="+", default=[1000, 3000, 6000],
+                        help="每分钟弹幕数量")
+    parser.add_argument("--seconds", type=float, default=60, help="合成录播时长 (秒)")
+    parser.add_argument("--max-on-screen", type=int, default=MAX_ON_SCREEN)
+    parser.add_argument("--merge-window", type=float, default=MERGE_WINDOW)
+    parser.add_argument("--json", help="将结果写入指定的 JSON 文件")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"{'弹幕/分钟':>10} {'模式':>10} {'事件数':>8} {'fps':>8}")
+        for per_minute in args.per_minute:
+            xml_file = os.path.join(workdir, f"bench_{per_minute}.xml")
+            count = int(per_minute * args.seconds / 60)
+            write_danmaku_xml(xml_file, count, duration=args.seconds)
+            modes = {
+                "streaming": lambda ass: convert_xml_to_ass_streaming(38, 30, 1920, 1080, xml_file, ass),
+                "layout": lambda ass: layout_danmaku(38, 30, 1920, 1080, xml_file, ass,
+                                                     max_on_screen=args.max_on_screen,
+                                                     merge_window=args.merge_window),
+            }
+            for mode, convert in modes.items():
+                ass_file = os.path.join(workdir, f"bench_{per_minute}_{mode}.ass")
+                convert(ass_file)
+                events = count_events(ass_file)
+                fps = render_fps(ass_file, args.seconds)
+                results.append({"per_minute": per_minute, "mode": mode, "events": events, "fps": fps})
+                print(f"{per_minute:>10} {mode:>10} {events:>8} {fps if fps is not None else '-':>8}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# 对比 dmconvert 整体解析、流式转换与分批密度排版在不同弹幕数量下的峰值内存 (RSS)
+#
+# 用法 (在项目根目录执行):
+#   python -m benchmarks.danmaku_memory --counts 10000 100000 500000
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import subprocess
+
+from benchmarks.synthetic import write_danmaku_xml
+
+MODES = ("baseline", "dmconvert", "streaming", "layout")
+
+
+def peak_rss_kb():
+    """
+    读取当前进程的峰值 RSS (KB)。
+
+    使用 /proc/self/status 的 VmHWM 而不是 ru_maxrss，后者会包含 fork 时继承自父进程的内存。
+    """
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def run_worker(mode, xml_file, ass_file):
+    """在当前进程中执行一次转换，供子进程调用"""
+    from dmconvert import convert_xml_to_ass
+    from apis.danmaku_stream import convert_xml_to_ass_streaming
+    from apis.danmaku_layout import layout_danmaku
+    if mode == "dmconvert":
+        convert_xml_to_ass(38, 30, 1920, 1080, xml_file, ass_file)
+    elif mode == "streaming":
+        convert_xml_to_ass_streaming(38, 30, 1920, 1080, xml_file, ass_file)
+    elif mode == "layout":
+        layout_danmaku(38, 30, 1920, 1080, xml_file, ass_file)
+    # baseline 只导入模块，用于扣除解释器本身的内存
+    print(f"VmHWM_KB={peak_rss_kb()}", flush=True)
+
+
+def measure(mode, xml_file, ass_file):
+    """在独立子进程中运行转换，返回 (峰值 RSS MB, 耗时秒)"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.danmaku_memory", "--worker", mode, xml_file, ass_file],
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode} 转换失败，退出码 {result.returncode}: {result.stderr}")
+    peak_kb = int(result.stdout.strip().splitlines()[-1].split("=", 1)[1])
+    return peak_kb / 1024, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="弹幕转换峰值内存基准测试")
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 50000, 200000, 500000],
+                        help="需要测试的弹幕数量")
+    parser.add_argument("--duration", type=float, default=10 * 3600, help="合成录播时长 (秒)")
+    parser.add_argument("--json", help="将结果写入指定的 JSON 文件")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("files", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, *args.files)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"{'弹幕数':>10} {'模式':>10} {'峰值RSS(MB)':>12} {'增量(MB)':>10} {'耗时(s)':>8}")
+        for count in args.counts:
+            xml_file = os.path.join(workdir, f"bench_{count}.xml")
+            ass_file = os.path.join(workdir, f"bench_{count}.ass")
+            write_danmaku_xml(xml_file, count, duration=args.duration, sc_count=20, gift_count=200)
+            baseline_rss, _ = measure("baseline", xml_file, ass_file)
+            for mode in MODES[1:]:
+                rss, elapsed = measure(mode, xml_file, ass_file)
+                results.append({
+                    "count": count,
+                    "mode": mode,
+                    "peak_rss_mb": round(rss, 1),
+                    "delta_rss_mb": round(rss - baseline_rss, 1),
+                    "seconds": round(elapsed, 2),
+                })
+                print(f"{count:>10} {mode:>10} {rss:>12.1f} {rss - baseline_rss:>10.1f} {elapsed:>8.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
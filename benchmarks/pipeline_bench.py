@@ -0,0 +1,233 @@
+# 处理流程基准测试：使用合成录播和弹幕分别测量清理、转换、压制阶段的耗时、峰值内存和压制速度
+#
+# 只需要本机的 ffmpeg (带 libx264 与 libass)，不需要显卡和网络。用法 (在项目根目录执行):
+#   python -m benchmarks.pipeline_bench run --profile quick --out bench.json
+#   python -m benchmarks.pipeline_bench compare baseline.json bench.json --threshold 0.1
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from benchmarks.synthetic import write_danmaku_xml, write_synthetic_flv
+from benchmarks.danmaku_memory import peak_rss_kb
+
+# 合成录播: (名称, 时长秒, 分辨率, 每分钟弹幕数)
+PROFILES = {
+    "quick": {
+        "clean_files": 200,
+        "danmaku_counts": [10000, 50000],
+        "recordings": [("360p_10s", 10, "640x360", 1000), ("720p_20s", 20, "1280x720", 3000)],
+    },
+    "full": {
+        "clean_files": 2000,
+        "danmaku_counts": [50000, 200000, 500000],
+        "recordings": [("720p_60s", 60, "1280x720", 2000), ("1080p_60s", 60, "1920x1080", 5000),
+                       ("1080p_300s", 300, "1920x1080", 2000)],
+    },
+}
+
+CONVERT_MODES = ("dmconvert", "streaming", "layout")
+
+# 越大越好的指标，其余指标 (耗时、内存) 越小越好
+HIGHER_IS_BETTER = ("speed", "fps")
+
+
+def ffmpeg_version():
+    try:
+        result = subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, text=True, check=True)
+        return result.stdout.splitlines()[0]
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- 子进程中执行的各阶段，每个阶段独立进程以便测量峰值内存 ---
+
+def stage_clean(folder):
+    from apis.remove_invalid_documents import BackupCleaner
+    BackupCleaner(backup_dir=folder).remove_small_backups(min_size_mb=1.0)
+    return {}
+
+
+def stage_convert(mode, xml_file, ass_file):
+    from apis.danmaku_converter import convert_to_ass
+    if mode == "layout":
+        stats = convert_to_ass(xml_file, ass_file, resolution=(1920, 1080), layout={})
+    else:
+        stats = convert_to_ass(xml_file, ass_file, streaming=mode == "streaming", resolution=(1920, 1080))
+    return {"events": (stats or {}).get("events", (stats or {}).get("danmaku"))}
+
+
+def stage_encode(video, ass, mp4, duration, backend):
+    from apis.encoder_backends import create_backends
+    from apis.video_encoder import encode
+    progress = {}
+    encode(video, ass, mp4, test_mode=True, backends=create_backends(backend),
+           duration=duration, on_progress=progress.update)
+    return {"fps": progress.get("fps"), "output_mb": round(os.path.getsize(mp4) / 1024 / 1024, 2)}
+
+
+STAGES = {"clean": stage_clean, "convert": stage_convert, "encode": stage_encode}
+
+
+def run_worker(stage, args):
+    started = time.perf_counter()
+    extra = STAGES[stage](*args)
+    seconds = time.perf_counter() - started
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print("RESULT=" + json.dumps({
+        "seconds": round(seconds, 3),
+        "peak_rss_mb": round(peak_rss_kb() / 1024, 1),
+        # ffmpeg 等子进程中峰值内存最大的一个
+        "child_peak_rss_mb": round(children_kb / 1024, 1),
+        **extra,
+    }), flush=True)
+
+
+def measure(stage, *args):
+    """在独立的子进程中运行一个阶段，返回该阶段的测量结果"""
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.pipeline_bench", "worker", stage, json.dumps(args)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    lines = [line for line in result.stdout.splitlines() if line.startswith("RESULT=")]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"{stage} 阶段执行失败，退出码 {result.returncode}: {result.stderr[-2000:]}")
+    return json.loads(lines[-1].split("=", 1)[1])
+
+
+def prepare_clean_folder(folder, count):
+    """生成清理阶段的测试文件：大部分为小于 1MB 的无效录播，少量为有效的稀疏大文件"""
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        base = os.path.join(folder, f"银剑君录播-20240101T{i:06d}")
+        with open(base + ".flv", "wb") as f:
+            if i % 10 == 0:
+                f.truncate(2 * 1024 * 1024)
+            else:
+                f.write(b"FLV" + b"\0" * 1024)
+        with open(base + ".xml", "w", encoding="utf-8") as f:
+            f.write("<i></i>\n")
+
+
+def run_benchmark(profile_name, backend, modes):
+    profile = PROFILES[profile_name]
+    results = []
+
+    def record(stage, case, metrics):
+        results.append({"stage": stage, "case": case, **metrics})
+        summary = ", ".join(f"{k}={v}" for k, v in metrics.items())
+        print(f"[{stage}] {case}: {summary}", flush=True)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        clean_dir = os.path.join(workdir, "clean")
+        prepare_clean_folder(clean_dir, profile["clean_files"])
+        record("clean", f"{profile['clean_files']}_files", measure("clean", clean_dir))
+
+        for count in profile["danmaku_counts"]:
+            xml_file = os.path.join(workdir, f"danmaku_{count}.xml")
+            write_danmaku_xml(xml_file, count, duration=10 * 3600, sc_count=20, gift_count=200)
+            for mode in modes:
+                ass_file = os.path.join(workdir, f"danmaku_{count}_{mode}.ass")
+                record("convert", f"{mode}_{count}", measure("convert", mode, xml_file, ass_file))
+
+        for name, seconds, size, per_minute in profile["recordings"]:
+            base = os.path.join(workdir, name)
+            write_synthetic_flv(base + ".flv", seconds, size=size)
+            write_danmaku_xml(base + ".xml", int(per_minute * seconds / 60), duration=seconds)
+            measure("convert", "streaming", base + ".xml", base + ".ass")
+            metrics = measure("encode", base + ".flv", base + ".ass", base + ".mp4", seconds, backend)
+            metrics["speed"] = round(seconds / metrics["seconds"], 3) if metrics["seconds"] else None
+            record("encode", f"{backend}_{name}", metrics)
+
+    return {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "profile": profile_name,
+            "backend": backend,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": ffmpeg_version(),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    对比两次基准测试结果，返回退化的指标列表。
+
+    耗时和内存增加超过 threshold (比例)，或速度、fps 下降超过 threshold 视为退化。
+    """
+    base_index = {(r["stage"], r["case"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"{'阶段':<8} {'用例':<24} {'指标':<18} {'基准':>10} {'当前':>10} {'变化':>8}")
+    for result in current["results"]:
+        base = base_index.get((result["stage"], result["case"]))
+        if base is None:
+            continue
+        for metric in ("seconds", "peak_rss_mb", "child_peak_rss_mb", "speed", "fps"):
+            old, new = base.get(metric), result.get(metric)
+            if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or old <= 0:
+                continue
+            change = (new - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ""
+            if worse > threshold:
+                flag = " <-- 退化"
+                regressions.append({"stage": result["stage"], "case": result["case"], "metric": metric,
+                                    "baseline": old, "current": new, "change": round(change, 3)})
+            print(f"{result['stage']:<8} {result['case']:<24} {metric:<18} {old:>10} {new:>10} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="处理流程基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="运行基准测试")
+    run_parser.add_argument("--profile", choices=PROFILES, default="quick")
+    run_parser.add_argument("--backend", default="x264", help="压制后端，默认使用 x264 软件编码")
+    run_parser.add_argument("--modes", nargs="+", choices=CONVERT_MODES, default=list(CONVERT_MODES),
+                            help="需要测试的弹幕转换方式")
+    run_parser.add_argument("--out", help="将结果写入指定的 JSON 文件")
+
+    compare_parser = sub.add_parser("compare", help="对比两次基准测试结果")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="视为退化的变化比例")
+
+    worker_parser = sub.add_parser("worker")
+    worker_parser.add_argument("stage", choices=STAGES)
+    worker_parser.add_argument("args")
+
+    args = parser.parse_args()
+    if args.command == "worker":
+        run_worker(args.stage, json.loads(args.args))
+    elif args.command == "run":
+        report = run_benchmark(args.profile, args.backend, args.modes)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"结果已写入 {args.out}")
+    else:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.current, encoding="utf-8") as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"发现 {len(regressions)} 项性能退化")
+            sys.exit(1)
+        print("未发现性能退化")
+
+
+if __name__ == "__main__":
+    main()
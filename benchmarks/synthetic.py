@@ -0,0 +1,65 @@
+# 生成用于基准测试的合成弹幕数据
+import random
+import subprocess
+from xml.sax.saxutils import escape, quoteattr
+
+# 合成弹幕的文本来源，包含中英文、重复刷屏和表情
+SAMPLE_TEXTS = (
+    "哈哈哈哈哈哈", "来了来了", "666", "主播好强", "这波操作可以", "???", "草",
+    "awsl", "前方高能", "好耶", "下次一定", "2333333", "打卡", "晚上好",
+    "这是一条比较长的弹幕用来测试文本宽度的估算是否正确",
+)
+
+
+def write_danmaku_xml(path, count, duration=3600.0, seed=0, sc_count=0, gift_count=0):
+    """
+    写入包含 count 条普通弹幕的弹幕 XML，格式与录播姬输出一致。
+
+    Args:
+        path: 输出文件路径。
+        count: 普通弹幕数量，均匀随机分布在 [0, duration) 内并按时间排序。
+        duration: 录播时长 (秒)。
+        seed: 随机种子，保证结果可复现。
+        sc_count: 醒目留言数量。
+        gift_count: 礼物数量。
+    """
+    rng = random.Random(seed)
+    times = sorted(rng.uniform(0, duration) for _ in range(count))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<i>\n')
+        for i, t in enumerate(times):
+            # 大部分为滚动弹幕，少量顶部/底部弹幕
+            danmaku_type = rng.choices((1, 4, 5), weights=(90, 5, 5))[0]
+            color = rng.choice((16777215, 16777215, 16777215, 16711680, 65280, 255))
+            text = rng.choice(SAMPLE_TEXTS)
+            p = f"{t:.3f},{danmaku_type},25,{color},{int(t * 1000)},0,{i},0"
+            f.write(f'  <d p={quoteattr(p)} user="user{i % 997}">{escape(text)}</d>\n')
+        for i in range(sc_count):
+            t = rng.uniform(0, duration)
+            f.write(f'  <sc ts="{t:.3f}" user="sc_user{i}" price="30" time="60">醒目留言 {i}</sc>\n')
+        for i in range(gift_count):
+            t = rng.uniform(0, duration)
+            f.write(f'  <gift ts="{t:.3f}" user="gift_user{i}" giftname="小心心" giftcount="1" price="0" />\n')
+        f.write("</i>\n")
+
+
+def write_synthetic_flv(path, seconds, size="1280x720", rate=30, gop_seconds=2):
+    """
+    使用 ffmpeg 的 lavfi 测试源生成带音频的合成录播 FLV (H.264 + AAC)，不需要网络或真实录播。
+
+    Args:
+        path: 输出文件路径。
+        seconds: 视频时长 (秒)。
+        size: 分辨率，如 "1920x1080"。
+        rate: 帧率。
+        gop_seconds: 关键帧间隔 (秒)，与直播推流的常见设置一致。
+    """
+    cmd = [
+        "ffmpeg", "-hide_banner", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={rate}:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", str(int(rate * gop_seconds)),
+        "-c:a", "aac", "-b:a", "128k",
+        "-f", "flv", "-y", path,
+    ]
+    subprocess.run(cmd, check=True)
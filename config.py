@@ -12,5 +12,161 @@ BACKUP_FOLDER = os.getenv("BACKUP_FOLDER", "/vol1/1000/biliup/backup")
 # 从环境变量获取处理文件夹路径，如果未设置则使用默认值
 PROCESSING_FOLDER = os.getenv("PROCESSING_FOLDER", "/vol1/1000/biliup/backup")
 
+# 多房间配置文件 (JSON 数组，每个元素为一个房间的名称、目录、文件名规则、清理阈值和优先级)，
+# 留空时使用上面的 BACKUP_FOLDER / PROCESSING_FOLDER 作为唯一的房间
+ROOMS_FILE = os.getenv("ROOMS_FILE", "")
+
+# 单房间模式下清理阶段只处理主文件名匹配该通配符的录播
+CLEAN_NAME_PATTERN = os.getenv("CLEAN_NAME_PATTERN", "银剑君录播*T*")
+
+# 单房间模式下小于该大小 (MB) 的录播视为无效并删除
+CLEAN_MIN_SIZE_MB = float(os.getenv("CLEAN_MIN_SIZE_MB", "1.0"))
+
 # 从环境变量获取 biliup-rs 工具所在的路径
 BILIUP_RS_PATH = os.getenv("BILIUP_RS_PATH", "/vol1/1000/biliup/biliup-rs")
+
+# 压制调度：同时运行的 ffmpeg 进程总数
+ENCODE_MAX_WORKERS = int(os.getenv("ENCODE_MAX_WORKERS", "2"))
+
+# 压制调度：同时运行的硬件编码会话 (QSV 等) 数量
+ENCODE_HW_SLOTS = int(os.getenv("ENCODE_HW_SLOTS", "1"))
+
+# 压制调度：同时运行的软件编码数量
+ENCODE_SW_SLOTS = int(os.getenv("ENCODE_SW_SLOTS", "1"))
+
+# 压制调度：排队顺序，可选 smallest / largest / oldest
+ENCODE_ORDER = os.getenv("ENCODE_ORDER", "smallest")
+
+# 任务台账 (SQLite) 路径，默认保存在配置文件所在目录
+LEDGER_PATH = os.getenv("LEDGER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ledger.db"))
+
+# 新文件检测方式：auto (优先使用 inotify 目录监听，不支持时回退定时扫描) / inotify / poll (仅定时扫描)
+WATCH_MODE = os.getenv("WATCH_MODE", "auto")
+
+# 定时扫描间隔 (分钟)
+POLL_INTERVAL_MINUTES = int(os.getenv("POLL_INTERVAL_MINUTES", "15"))
+
+# 目录监听模式下的兜底扫描间隔 (分钟)
+WATCH_FALLBACK_POLL_MINUTES = int(os.getenv("WATCH_FALLBACK_POLL_MINUTES", "60"))
+
+# 文件大小和修改时间保持不变多少秒后视为写入完成 (目录监听和流水线扫描弹幕 XML 时使用)
+WATCH_SETTLE_SECONDS = float(os.getenv("WATCH_SETTLE_SECONDS", "5"))
+
+# 是否使用流式弹幕转换 (内存占用不随弹幕数量增长)，设置为 false 时使用 dmconvert 整体解析
+DANMAKU_STREAMING = os.getenv("DANMAKU_STREAMING", "true").lower() in ("1", "true", "yes")
+
+# 并行转换弹幕的子进程数，为 0 时在当前线程中逐个转换 (无法对单个文件设置超时)
+DANMAKU_WORKERS = int(os.getenv("DANMAKU_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+# 单个弹幕文件的转换超时时间 (秒)，超时的转换进程会被强制结束
+DANMAKU_TIMEOUT = float(os.getenv("DANMAKU_TIMEOUT", "1800"))
+
+# 录播文件元数据 (ffprobe 结果) 缓存路径，默认与任务台账共用同一个数据库
+PROBE_CACHE_PATH = os.getenv("PROBE_CACHE_PATH", LEDGER_PATH)
+
+# 压制后端：auto (依次检测 qsv、vaapi、x264 并按基准测试速度排序)，或逗号分隔的列表，如 "vaapi,x265"
+ENCODER_BACKENDS = os.getenv("ENCODER_BACKENDS", "auto")
+
+# 启动时是否对可用的压制后端运行微基准测试，选择最快的后端；关闭时按配置顺序使用
+ENCODER_BENCHMARK = os.getenv("ENCODER_BENCHMARK", "true").lower() in ("1", "true", "yes")
+
+# VAAPI 渲染设备
+VAAPI_DEVICE = os.getenv("VAAPI_DEVICE", "/dev/dri/renderD128")
+
+# 硬件编码质量 (QSV global_quality / VAAPI qp)，数值越小画质越高
+ENCODER_HW_QUALITY = int(os.getenv("ENCODER_HW_QUALITY", "25"))
+
+# 软件编码 (libx264 / libx265) 预设
+ENCODER_SW_PRESET = os.getenv("ENCODER_SW_PRESET", "veryfast")
+
+# 软件编码 CRF，留空时 x264 使用 23、x265 使用 28
+ENCODER_SW_CRF = int(os.getenv("ENCODER_SW_CRF")) if os.getenv("ENCODER_SW_CRF") else None
+
+# 分段并行压制的 ffmpeg 进程数，大于 1 时长录播在关键帧处切分后并行压制再无损拼接 (仅软件编码)，0 为关闭
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", "0"))
+
+# 录播时长不少于该秒数时才分段压制
+SEGMENT_MIN_DURATION = float(os.getenv("SEGMENT_MIN_DURATION", "3600"))
+
+# 是否按弹幕密度排版：合并刷屏弹幕、限制同屏数量并移除碰撞的弹幕，显著减少烧录时的渲染开销
+DANMAKU_LAYOUT = os.getenv("DANMAKU_LAYOUT", "false").lower() in ("1", "true", "yes")
+
+# 弹幕排版：同屏最多显示的弹幕数量，0 为不限制
+DANMAKU_MAX_ON_SCREEN = int(os.getenv("DANMAKU_MAX_ON_SCREEN", "60"))
+
+# 弹幕排版：相同内容的弹幕在该时间窗口 (秒) 内合并为 "内容 x次数"，0 为不合并
+DANMAKU_MERGE_WINDOW = float(os.getenv("DANMAKU_MERGE_WINDOW", "10"))
+
+# 输出模式：burn (烧录弹幕重新压制)、remux (直接复制音视频流为 MP4，不含弹幕)、
+# softsub (复制音视频流并将 ASS 作为字幕轨封装为 MKV)，后两种不重新编码
+OUTPUT_MODE = os.getenv("OUTPUT_MODE", "burn")
+
+# 弹幕数量少于该值的录播直接 remux 为 MP4，不重新压制，0 为关闭
+REMUX_MAX_DANMAKU = int(os.getenv("REMUX_MAX_DANMAKU", "0"))
+
+# 同时运行的 remux / softsub 封装任务数，不占用压制槽位
+ENCODE_COPY_SLOTS = int(os.getenv("ENCODE_COPY_SLOTS", "2"))
+
+# 暂存目录 (如本地 SSD)，设置后压制输出先写入该目录，完成后再原子地移动到处理文件夹，
+# 减少录制所在磁盘上的随机写入；留空时直接写入处理文件夹
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", "")
+
+# 各阶段子进程的 CPU / IO 优先级和 CPU 亲和性，格式如 "nice=10,ionice=idle,cpus=2-7"
+# (多个 CPU 区间用分号分隔，如 cpus=0-1;4-5)，留空时不调整
+PROBE_PRIORITY = os.getenv("PROBE_PRIORITY", "")
+CONVERT_PRIORITY = os.getenv("CONVERT_PRIORITY", "")
+ENCODE_PRIORITY = os.getenv("ENCODE_PRIORITY", "")
+UPLOAD_PRIORITY = os.getenv("UPLOAD_PRIORITY", "")
+
+# 是否在处理前将同一场直播因断流拆分出的多个分段 (按文件名中的开始时间判断) 无损合并为一个录播
+SESSION_MERGE = os.getenv("SESSION_MERGE", "false").lower() in ("1", "true", "yes")
+
+# 前一个分段结束到后一个分段开始不超过该秒数时视为同一场直播；开启合并后，录制结束不到该秒数的录播会等到之后的处理周期
+SESSION_MERGE_MAX_GAP = float(os.getenv("SESSION_MERGE_MAX_GAP", "300"))
+
+# 转换弹幕时是否同时生成列式弹幕索引 (.dmidx)，用于按弹幕密度查找高光时刻和截取片段
+DANMAKU_INDEX = os.getenv("DANMAKU_INDEX", "true").lower() in ("1", "true", "yes")
+
+# 高光片段：弹幕密度统计的区间长度 (秒)、默认返回的峰值数量、两个峰值之间的最小间隔 (秒)
+HIGHLIGHT_BIN_SECONDS = float(os.getenv("HIGHLIGHT_BIN_SECONDS", "10"))
+HIGHLIGHT_TOP = int(os.getenv("HIGHLIGHT_TOP", "5"))
+HIGHLIGHT_MIN_GAP = float(os.getenv("HIGHLIGHT_MIN_GAP", "120"))
+
+# 高光片段：截取峰值前后的秒数
+CLIP_BEFORE_SECONDS = float(os.getenv("CLIP_BEFORE_SECONDS", "30"))
+CLIP_AFTER_SECONDS = float(os.getenv("CLIP_AFTER_SECONDS", "30"))
+
+# 高光片段的输出目录，留空时保存在各房间处理文件夹下的 clips 目录
+CLIP_FOLDER = os.getenv("CLIP_FOLDER", "")
+
+# 是否在压制完成后自动逐个上传 MP4 (需要 BILIUP_RS_PATH)，关闭时只能通过 /trigger_upload 手动上传
+AUTO_UPLOAD = os.getenv("AUTO_UPLOAD", "false").lower() in ("1", "true", "yes")
+
+# 单个文件的上传命令 (在 BILIUP_RS_PATH 目录下执行)，{file} 会被替换为 MP4 文件路径
+# 投稿信息通过命令行参数传入，如 "./biliup upload --tid 171 --tag 直播回放 {file}"；
+# 不要加 -c config.yaml，biliup 指定配置文件时会上传配置中列出的视频而忽略 {file}
+BILIUP_UPLOAD_COMMAND = os.getenv("BILIUP_UPLOAD_COMMAND", "./biliup upload {file}")
+
+# 同时上传的文件数
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "1"))
+
+# 上传失败后的最大重试次数
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "3"))
+
+# 第一次重试前等待的秒数，之后每次翻倍，最长 UPLOAD_BACKOFF_MAX 秒
+UPLOAD_BACKOFF_BASE = float(os.getenv("UPLOAD_BACKOFF_BASE", "60"))
+UPLOAD_BACKOFF_MAX = float(os.getenv("UPLOAD_BACKOFF_MAX", "1800"))
+
+# 后台任务队列：同时运行的处理任务 (清理、转换、压制) 数和手动上传任务数
+# 处理任务按房间提交，同一房间的任务依次运行；为 0 时等于房间数，各房间可以同时处理 (压制槽位仍由调度器统一分配)
+JOB_PROCESS_CONCURRENCY = int(os.getenv("JOB_PROCESS_CONCURRENCY", "0"))
+JOB_UPLOAD_CONCURRENCY = int(os.getenv("JOB_UPLOAD_CONCURRENCY", "1"))
+
+# 同时运行的片段截取任务数
+JOB_CLIP_CONCURRENCY = int(os.getenv("JOB_CLIP_CONCURRENCY", "1"))
+
+# /jobs 中保留的已结束任务数量
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "100"))
+
+# 取消任务时等待 ffmpeg / biliup 退出的秒数，超时后强制结束
+JOB_KILL_GRACE_SECONDS = float(os.getenv("JOB_KILL_GRACE_SECONDS", "10"))
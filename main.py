@@ -1,24 +1,131 @@
+import os
+import json
 import logging
 import sys
 import time
 import threading
 import schedule
 import config
-from fastapi import FastAPI, BackgroundTasks, HTTPException # 引入 FastAPI 相关组件
+from fastapi import FastAPI, HTTPException, Query # 引入 FastAPI 相关组件
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel # 用于定义响应模型 (可选但推荐)
 
 from apis.remove_invalid_documents import BackupCleaner
-from apis.danmaku_converter import process_folder as convert_danmaku
-from apis.video_encoder import process_folder as encode_video
+from apis.pipeline import RecordingPipeline
+from apis.encode_scheduler import EncodeScheduler
+from apis.rooms import Room, load_rooms
+from apis.dir_index import DirectoryIndex
 from apis.biliup_uploader import upload_to_bilibili
+from apis.upload_queue import UploadQueue
+from apis.job_ledger import JobLedger
+from apis.media_probe import ProbeCache
+from apis.folder_watcher import FolderWatcher, inotify_supported
+from apis.encoder_backends import create_backends, select_backends
+from apis.ffmpeg_progress import ProgressRegistry
+from apis.job_manager import JobManager
+from apis.process_priority import parse_priorities
+from apis.danmaku_index import DanmakuIndex
+from apis.clip_extractor import extract_highlights
+from apis.video_encoder import output_path
+from apis import metrics
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 持久化任务台账，记录每个文件已完成的处理阶段，避免每个周期重复处理
+ledger = JobLedger(config.LEDGER_PATH)
+
+# 各阶段子进程 (ffprobe、转换、ffmpeg、biliup) 的 CPU / IO 优先级和 CPU 亲和性
+process_priorities = parse_priorities({
+    "probe": config.PROBE_PRIORITY,
+    "convert": config.CONVERT_PRIORITY,
+    "encode": config.ENCODE_PRIORITY,
+    "upload": config.UPLOAD_PRIORITY,
+})
+
+# 录播文件元数据缓存，转换和压制阶段共享，每个文件只探测一次
+probe_cache = ProbeCache(config.PROBE_CACHE_PATH, priority=process_priorities.get("probe"))
+
+# 需要处理的房间，未配置 ROOMS_FILE 时使用 BACKUP_FOLDER / PROCESSING_FOLDER 作为唯一的房间
+# 房间未单独设置的输出模式使用全局配置
+room_defaults = {"output_mode": config.OUTPUT_MODE, "remux_max_danmaku": config.REMUX_MAX_DANMAKU}
+if config.ROOMS_FILE:
+    rooms = load_rooms(config.ROOMS_FILE, defaults=room_defaults)
+else:
+    rooms = [Room("default", config.BACKUP_FOLDER, config.PROCESSING_FOLDER,
+                  name_pattern=config.CLEAN_NAME_PATTERN, min_size_mb=config.CLEAN_MIN_SIZE_MB, **room_defaults)]
+
+# 所有房间共享的压制调度器，空闲槽位按房间优先级公平分配，单个房间的长录播不会占满所有槽位
+encode_scheduler = EncodeScheduler(
+    None,
+    max_workers=config.ENCODE_MAX_WORKERS,
+    hw_slots=config.ENCODE_HW_SLOTS,
+    sw_slots=config.ENCODE_SW_SLOTS,
+    order=config.ENCODE_ORDER,
+    copy_slots=config.ENCODE_COPY_SLOTS,
+)
+
+# 后台任务管理器：处理任务和上传任务分别排队，定时任务、目录监听和手动触发都通过它提交，
+# 同类任务按并发上限依次执行，不同类型的任务互不阻塞
+job_manager = JobManager(
+    {
+        "process": config.JOB_PROCESS_CONCURRENCY or len(rooms),
+        "upload": config.JOB_UPLOAD_CONCURRENCY,
+        "clip": config.JOB_CLIP_CONCURRENCY,
+    },
+    history=config.JOB_HISTORY,
+    grace_seconds=config.JOB_KILL_GRACE_SECONDS,
+)
+
+# 压制后端只检测一次
+backends_lock = threading.Lock()
+
+# 正在压制的任务的实时进度，供 /status 和 /status/stream 读取
+encode_progress = ProgressRegistry()
+
+# 逐个文件上传的队列，压制完成的 MP4 立即上传，与压制同时进行
+upload_queue = None
+if config.AUTO_UPLOAD and config.BILIUP_RS_PATH:
+    upload_queue = UploadQueue(
+        config.BILIUP_RS_PATH,
+        ledger=ledger,
+        workers=config.UPLOAD_WORKERS,
+        max_retries=config.UPLOAD_MAX_RETRIES,
+        backoff_base=config.UPLOAD_BACKOFF_BASE,
+        backoff_max=config.UPLOAD_BACKOFF_MAX,
+        command=config.BILIUP_UPLOAD_COMMAND,
+        priority=process_priorities.get("upload"),
+        tracker=lambda path: job_manager.track("upload", source="queue", key=path),
+    )
+    upload_queue.start()
+
+# 可用的压制后端 (按速度排序)，首次处理时检测
+encoder_backends = None
+
+def get_encoder_backends():
+    """检测并缓存可用的压制后端"""
+    global encoder_backends
+    with backends_lock:
+        if encoder_backends is not None:
+            return encoder_backends
+        backends = create_backends(
+            config.ENCODER_BACKENDS,
+            vaapi_device=config.VAAPI_DEVICE,
+            hw_quality=config.ENCODER_HW_QUALITY,
+            sw_preset=config.ENCODER_SW_PRESET,
+            sw_crf=config.ENCODER_SW_CRF,
+        )
+        encoder_backends = select_backends(backends, benchmark=config.ENCODER_BENCHMARK)
+    return encoder_backends
+
 # --- 自动处理任务 ---
-def process_files_automatically():
-    """定期执行清理、转换弹幕和压制视频的任务"""
-    results = {"status": "pending", "messages": [], "errors": []}
+def process_files_automatically(room, control=None):
+    """
+    定期执行单个房间的清理、转换弹幕和压制视频的任务
+
+    control 为任务管理器传入的 JobControl，任务取消后不再开始新的文件，正在运行的 ffmpeg 会被结束。
+    """
+    results = {"room": room.name, "status": "pending", "messages": [], "errors": []}
 
     def log_and_record(level, message, is_error=False):
         if level == logging.INFO:
@@ -32,42 +139,93 @@ def process_files_automatically():
             results["errors"].append(message)
             results["status"] = "partial_failure" if results["messages"] else "failure"
 
+    # 本次处理周期共享的目录索引，每个目录只列举一次
+    index = DirectoryIndex()
+
     # 1. 清理无效备份文件
     try:
-        log_and_record(logging.INFO, "定时任务: 开始清理无效备份文件")
-        cleaner = BackupCleaner(backup_dir=config.BACKUP_FOLDER)
-        cleaner.remove_small_backups(min_size_mb=1.0)
-        log_and_record(logging.INFO, "定时任务: 无效备份文件清理完成")
+        log_and_record(logging.INFO, f"定时任务 [{room.name}]: 开始清理无效备份文件")
+        cleaner = BackupCleaner(backup_dir=room.backup_folder, ledger=ledger, name_pattern=room.name_pattern)
+        cleaner.remove_small_backups(min_size_mb=room.min_size_mb, index=index)
+        log_and_record(logging.INFO, f"定时任务 [{room.name}]: 无效备份文件清理完成")
     except Exception as e:
-        log_and_record(logging.ERROR, f"定时任务: 清理备份文件时出错: {e}")
+        log_and_record(logging.ERROR, f"定时任务 [{room.name}]: 清理备份文件时出错: {e}")
         return results
 
-    # 2. 转换弹幕文件 (XML -> ASS)
-    try:
-        log_and_record(logging.INFO, "定时任务: 开始转换弹幕文件 (XML -> ASS)")
-        convert_danmaku(folder=config.PROCESSING_FOLDER)
-        log_and_record(logging.INFO, "定时任务: 弹幕文件转换完成")
-    except Exception as e:
-        log_and_record(logging.ERROR, f"定时任务: 转换弹幕文件时出错: {e}")
+    if control is not None and control.cancelled:
+        log_and_record(logging.WARNING, f"定时任务 [{room.name}]: 任务已取消，跳过转换和压制")
+        results["status"] = "cancelled"
         return results
 
-    # 3. 压制视频 (FLV+ASS -> MP4)
+    # 2. 按录播文件流水线转换弹幕 (XML -> ASS) 并压制视频 (FLV+ASS -> MP4)
+    #    某个文件转换完成后立即开始压制，单个文件失败不影响其它文件
     try:
-        log_and_record(logging.INFO, "定时任务: 开始压制视频 (FLV+ASS -> MP4)")
-        encode_video(folder=config.PROCESSING_FOLDER)
-        log_and_record(logging.INFO, "定时任务: 视频压制完成")
+        log_and_record(logging.INFO, f"定时任务 [{room.name}]: 开始转换弹幕并压制视频")
+        pipeline = RecordingPipeline(
+            folder=room.processing_folder,
+            ledger=ledger,
+            probe_cache=probe_cache,
+            streaming=config.DANMAKU_STREAMING,
+            convert_workers=config.DANMAKU_WORKERS,
+            convert_timeout=config.DANMAKU_TIMEOUT,
+            max_workers=config.ENCODE_MAX_WORKERS,
+            hw_slots=config.ENCODE_HW_SLOTS,
+            sw_slots=config.ENCODE_SW_SLOTS,
+            order=config.ENCODE_ORDER,
+            backends=get_encoder_backends(),
+            progress=encode_progress,
+            segment_workers=config.SEGMENT_WORKERS,
+            segment_min_duration=config.SEGMENT_MIN_DURATION,
+            layout={
+                "max_on_screen": config.DANMAKU_MAX_ON_SCREEN,
+                "merge_window": config.DANMAKU_MERGE_WINDOW,
+            } if config.DANMAKU_LAYOUT else None,
+            upload_queue=upload_queue,
+            index=index,
+            control=control,
+            scheduler=encode_scheduler,
+            room=room.name,
+            priority=room.priority,
+            output_mode=room.output_mode,
+            remux_max_danmaku=room.remux_max_danmaku,
+            priorities=process_priorities,
+            scratch_dir=config.SCRATCH_DIR or None,
+            danmaku_index=config.DANMAKU_INDEX,
+            merge_sessions=config.SESSION_MERGE,
+            merge_max_gap=config.SESSION_MERGE_MAX_GAP,
+            settle_seconds=config.WATCH_SETTLE_SECONDS,
+        )
+        pipeline_summary = pipeline.run()
+        results["merged"] = pipeline_summary["merged"]
+        for merged in pipeline_summary["merged"]:
+            if merged["status"] == "failed":
+                log_and_record(logging.WARNING, f"定时任务 [{room.name}]: 合并 {merged['name']} 的分段失败，各分段单独处理: {merged['error']}")
+        results["recordings"] = pipeline_summary["recordings"]
+        results["convert"] = pipeline_summary["convert"]
+        results["encode"] = pipeline_summary["encode"]
+        for recording in pipeline_summary["recordings"]:
+            for stage, stage_result in recording["stages"].items():
+                if stage_result["status"] == "failed":
+                    log_and_record(logging.ERROR, f"定时任务 [{room.name}]: {recording['name']} {stage} 阶段失败: {stage_result['error']}")
+        encode_summary = pipeline_summary["encode"]
+        log_and_record(logging.INFO, f"定时任务 [{room.name}]: 流水线完成，耗时 {pipeline_summary['wall_seconds']}s，"
+                                     f"新转换 {len(pipeline_summary['convert']['converted'])} 个弹幕文件，"
+                                     f"压制成功 {encode_summary['succeeded']} 个，失败 {encode_summary['failed']} 个，"
+                                     f"取消 {encode_summary['cancelled']} 个")
     except Exception as e:
-        log_and_record(logging.ERROR, f"定时任务: 压制视频时出错: {e}")
+        log_and_record(logging.ERROR, f"定时任务 [{room.name}]: 执行转换压制流水线时出错: {e}")
         return results
 
-    if not results["errors"]:
+    if control is not None and control.cancelled:
+        results["status"] = "cancelled"
+    elif not results["errors"]:
          results["status"] = "success"
-    log_and_record(logging.INFO, "定时任务: 自动处理流程执行完毕")
+    log_and_record(logging.INFO, f"定时任务 [{room.name}]: 自动处理流程执行完毕")
     return results
 
 # --- 上传处理任务 ---
-def upload_files():
-    """执行上传处理任务"""
+def upload_files(control=None):
+    """执行上传处理任务，control 为任务管理器传入的 JobControl，取消时结束 biliup 进程"""
     results = {"status": "pending", "messages": [], "errors": []}
 
     def log_and_record(level, message, is_error=False):
@@ -87,8 +245,15 @@ def upload_files():
         log_and_record(logging.INFO, "API任务: 开始上传视频到 Bilibili")
         if not config.BILIUP_RS_PATH:
             log_and_record(logging.WARNING, "未在配置中找到 BILIUP_RS_PATH，跳过上传步骤。请在 .env 文件中设置。")
+        elif upload_queue is not None:
+            # 正在压制的文件还未写完，不加入队列
+            encoding = [os.path.splitext(entry["video"])[0] + ext for entry in encode_progress.snapshot()
+                        for ext in (".mp4", ".mkv")]
+            submitted = sum(upload_queue.scan_folder(room.processing_folder, exclude=encoding) for room in rooms)
+            log_and_record(logging.INFO, f"API任务: 已将 {submitted} 个未上传的 MP4 文件加入上传队列")
         else:
-            upload_to_bilibili(biliup_path=config.BILIUP_RS_PATH)
+            upload_to_bilibili(biliup_path=config.BILIUP_RS_PATH, control=control,
+                               priority=process_priorities.get("upload"))
             log_and_record(logging.INFO, "API任务: Bilibili 上传任务已启动")
     except Exception as e:
         log_and_record(logging.ERROR, f"API任务: 上传到 Bilibili 时出错: {e}")
@@ -99,12 +264,121 @@ def upload_files():
     log_and_record(logging.INFO, "API任务: 上传流程执行完毕")
     return results
 
+# --- 高光片段 ---
+def find_recording(name: str, room_name: str = None):
+    """
+    在各房间的处理文件夹中查找录播 (name 为不含扩展名的文件名)。
+
+    Returns:
+        (房间, 录播主文件路径)，找不到时返回 (None, None)。
+    """
+    for room in rooms:
+        if room_name is not None and room.name != room_name:
+            continue
+        base = os.path.join(room.processing_folder, os.path.basename(name))
+        if any(os.path.exists(base + ext) for ext in (".flv", ".xml", ".mp4", ".dmidx")) \
+                or os.path.exists(output_path(base, room.output_mode)):
+            return room, base
+    return None, None
+
+def encoded_output(base: str, room):
+    """录播压制后的输出文件：按房间的输出模式查找，弹幕较少时会 remux 为 MP4，两者都不存在时返回 None"""
+    for path in (output_path(base, room.output_mode), base + ".mp4"):
+        if os.path.exists(path):
+            return path
+    return None
+
+def clip_recording(base: str, room, ranges=None, top: int = None, burn: bool = False, control=None):
+    """
+    从录播中截取高光片段：未指定 ranges 时按弹幕密度峰值截取，优先使用源 FLV，
+    FLV 已被压制流程删除时从压制输出 (MP4，softsub 模式为 MKV) 截取，不再烧录弹幕。
+    """
+    results = {"status": "pending", "recording": base, "clips": [], "peaks": None}
+    video = base + ".flv" if os.path.exists(base + ".flv") else encoded_output(base, room)
+    if video is None:
+        raise FileNotFoundError(f"未找到 {base} 的 FLV 或压制输出文件")
+    if not ranges:
+        index = DanmakuIndex.open(base + ".xml")
+        if index is None:
+            raise FileNotFoundError(f"未找到 {base} 的弹幕文件或索引")
+        ranges = results["peaks"] = index.peaks(config.HIGHLIGHT_BIN_SECONDS, top or config.HIGHLIGHT_TOP,
+                                                min_gap=config.HIGHLIGHT_MIN_GAP)
+    info = probe_cache.get(video, keyframes=True)
+    ass = base + ".ass" if burn and video.endswith(".flv") and os.path.exists(base + ".ass") else None
+    if burn and ass is None:
+        logger.warning(f"{base} 没有可用的 ASS 文件或 FLV 已压制，片段不烧录弹幕")
+    results["clips"] = extract_highlights(
+        video, ranges, config.CLIP_FOLDER or os.path.join(room.processing_folder, "clips"),
+        before=config.CLIP_BEFORE_SECONDS, after=config.CLIP_AFTER_SECONDS,
+        keyframes=info["keyframes"], duration=info["duration"],
+        ass=ass, backend=get_encoder_backends()[0] if ass else None,
+        control=control, priority=process_priorities.get("encode"),
+    )
+    results["status"] = "success"
+    logger.info(f"已从 {video} 截取 {len(results['clips'])} 个片段")
+    return results
+
+def submit_process_job(source: str, targets=None):
+    """
+    为每个房间 (默认全部房间) 提交一次处理任务，返回提交的任务列表。
+    某个房间已有排队中的处理任务时直接返回该任务，运行中的任务结束后只会再执行一次，
+    不会因为频繁触发而堆积；同一房间的处理任务不会同时运行。
+    """
+    return [job_manager.submit("process", lambda control, room=room: process_files_automatically(room, control),
+                               source=source, coalesce=True, key=room.name)
+            for room in (targets or rooms)]
+
+# --- 目录监听 ---
+def on_files_ready(paths):
+    """目录监听回调：有录播文件就绪时立即处理文件所在的房间"""
+    if paths:
+        targets = [room for room in rooms if any(room.owns(path) for path in paths)]
+        logger.info(f"目录监听: {len(paths)} 个文件已就绪，开始处理 {', '.join(room.name for room in targets)}: {paths}")
+    else:
+        targets = rooms
+        logger.info("目录监听: 事件队列溢出，开始处理所有房间")
+    if targets:
+        submit_process_job("watch", targets)
+
+def start_watcher():
+    """
+    尝试启动 inotify 目录监听线程。
+
+    Returns:
+        启动成功返回 True；当前系统或文件系统不支持 inotify 时返回 False。
+    """
+    folders = list(dict.fromkeys(folder for room in rooms for folder in room.folders))
+    if not all(inotify_supported(folder) for folder in folders):
+        return False
+    try:
+        watcher = FolderWatcher(folders, on_files_ready, settle_seconds=config.WATCH_SETTLE_SECONDS)
+    except OSError as e:
+        logger.warning(f"启动目录监听失败: {e}")
+        return False
+    threading.Thread(target=watcher.run, daemon=True).start()
+    return True
+
 # --- 定时任务调度器 ---
 def run_scheduler():
     """运行定时任务调度器"""
     logger.info("启动定时任务调度器")
+    if upload_queue is not None:
+        # 恢复上次退出前已压制完成但未上传的文件
+        for room in rooms:
+            try:
+                upload_queue.scan_folder(room.processing_folder)
+            except OSError as e:
+                logger.warning(f"扫描房间 {room.name} 未上传的 MP4 文件失败: {e}")
+    interval = config.POLL_INTERVAL_MINUTES
+    if config.WATCH_MODE in ("auto", "inotify"):
+        if start_watcher():
+            # 监听模式下保留一个低频的兜底扫描
+            interval = config.WATCH_FALLBACK_POLL_MINUTES
+            logger.info(f"目录监听已启动，兜底扫描间隔 {interval} 分钟")
+        else:
+            logger.warning(f"目录监听不可用，回退为每 {interval} 分钟定时扫描")
     # 默认每15分钟检查一次是否有新的文件需要处理
-    schedule.every(15).minutes.do(process_files_automatically)
+    schedule.every(interval).minutes.do(submit_process_job, "schedule")
     
     # 运行调度器
     while True:
@@ -122,100 +396,177 @@ app = FastAPI(
     version="1.0.0",
 )
 
-# 存储后台任务状态 (简单的全局状态)
-background_task_status = {
-    "is_running": False,
-    "last_result": None
-}
-
 # --- 状态模型定义 ---
 class PipelineStatus(BaseModel):
     is_running: bool
     last_result: dict | None
+    jobs: list = []
+    encoding: list = []
+    uploads: list = []
+
+class ClipRequest(BaseModel):
+    room: str | None = None
+    # 指定的时间段 [[开始秒, 结束秒], ...]，为空时按弹幕密度峰值截取
+    ranges: list[tuple[float, float]] | None = None
+    top: int | None = None
+    # 是否只烧录片段时间内的弹幕 (重新压制片段)，默认直接复制流
+    burn: bool = False
 
 class TriggerResponse(BaseModel):
     message: str
-
-# --- 后台上传任务执行函数 ---
-def run_upload_background_task():
-    """在后台执行上传流程并更新状态"""
-    logger.info("后台任务：开始执行上传流程...")
-    global background_task_status
-    background_task_status["is_running"] = True
-    background_task_status["last_result"] = None # 清除上次结果
-    try:
-        result = upload_files()
-        background_task_status["last_result"] = result
-        logger.info(f"后台任务：上传流程完成，结果: {result.get('status', 'unknown')}")
-    except Exception as e:
-        logger.error(f"后台任务：执行上传流程时发生未捕获错误: {e}", exc_info=True)
-        background_task_status["last_result"] = {"status": "critical_failure", "errors": [f"未捕获的异常: {e}"]}
-    finally:
-        background_task_status["is_running"] = False
-    logger.info("后台任务：结束执行")
-
-# --- 手动触发处理任务 ---
-def run_process_background_task():
-    """在后台执行处理流程并更新状态"""
-    logger.info("后台任务：开始执行处理流程...")
-    global background_task_status
-    background_task_status["is_running"] = True
-    background_task_status["last_result"] = None # 清除上次结果
-    try:
-        result = process_files_automatically()
-        background_task_status["last_result"] = result
-        logger.info(f"后台任务：处理流程完成，结果: {result.get('status', 'unknown')}")
-    except Exception as e:
-        logger.error(f"后台任务：执行处理流程时发生未捕获错误: {e}", exc_info=True)
-        background_task_status["last_result"] = {"status": "critical_failure", "errors": [f"未捕获的异常: {e}"]}
-    finally:
-        background_task_status["is_running"] = False
-    logger.info("后台任务：结束执行")
+    job_id: str | None = None
+    job_ids: list = []
 
 # --- API 端点 ---
 @app.post("/trigger_process", response_model=TriggerResponse, status_code=202)
-def trigger_process_endpoint(background_tasks: BackgroundTasks):
+def trigger_process_endpoint(room: str | None = None):
     """
-    手动触发处理流程（清理、转换、压制）在后台运行。
-    
-    如果已有任务在运行，则返回 429 错误。
+    手动触发处理流程（清理、转换、压制），每个房间一个任务进入处理队列在后台运行，可用 room 参数只处理单个房间。
+
+    某个房间已有排队中的处理任务时不会重复排队，直接返回该任务的 ID。
     """
-    if background_task_status["is_running"]:
-        raise HTTPException(
-            status_code=429,
-            detail="处理流程已在运行中，请稍后再试。"
-        )
+    targets = rooms
+    if room is not None:
+        targets = [r for r in rooms if r.name == room]
+        if not targets:
+            raise HTTPException(status_code=404, detail=f"房间 {room} 不存在")
+    jobs = submit_process_job("api", targets)
+    job_ids = [job.id for job in jobs]
+    if all(job.status == "queued" for job in jobs):
+        return {"message": "处理任务已加入队列，将在当前任务结束后运行。", "job_id": job_ids[0], "job_ids": job_ids}
+    return {"message": "处理流程已在后台启动。", "job_id": job_ids[0], "job_ids": job_ids}
 
-    # 添加后台任务
-    background_tasks.add_task(run_process_background_task)
+@app.post("/trigger_upload", response_model=TriggerResponse, status_code=202)
+def trigger_upload_endpoint():
+    """
+    触发视频上传流程，任务进入上传队列在后台运行，不受正在进行的压制影响。
+    """
+    job = job_manager.submit("upload", upload_files, source="api", coalesce=True)
+    return {"message": "上传流程已在后台启动。", "job_id": job.id}
 
-    return {"message": "处理流程已在后台启动。"}
+@app.get("/recordings/{name}/highlights")
+def highlights_endpoint(name: str, room: str | None = None, top: int | None = None,
+                        bin_seconds: float | None = Query(default=None, gt=0)):
+    """
+    返回录播弹幕密度最高的时刻 (按时间排序)，以及每个区间的弹幕数量序列。
 
-@app.post("/trigger_upload", response_model=TriggerResponse, status_code=202)
-def trigger_upload_endpoint(background_tasks: BackgroundTasks):
+    使用转换时生成的列式弹幕索引，索引不存在或弹幕文件已变化时自动重新生成。
     """
-    触发视频上传流程在后台运行。
-    
-    如果已有任务在运行，则返回 429 错误。
+    target_room, base = find_recording(name, room)
+    if base is None:
+        raise HTTPException(status_code=404, detail=f"录播 {name} 不存在")
+    index = DanmakuIndex.open(base + ".xml")
+    if index is None:
+        raise HTTPException(status_code=404, detail=f"录播 {name} 没有弹幕文件或索引")
+    bin_seconds = bin_seconds or config.HIGHLIGHT_BIN_SECONDS
+    return {
+        "room": target_room.name,
+        "recording": name,
+        "danmaku": index.count,
+        "bin_seconds": bin_seconds,
+        "peaks": index.peaks(bin_seconds, top or config.HIGHLIGHT_TOP, min_gap=config.HIGHLIGHT_MIN_GAP),
+        "density": index.density(bin_seconds).tolist(),
+    }
+
+@app.post("/recordings/{name}/clips", response_model=TriggerResponse, status_code=202)
+def clips_endpoint(name: str, request: ClipRequest):
     """
-    if background_task_status["is_running"]:
-        raise HTTPException(
-            status_code=429,
-            detail="处理流程已在运行中，请稍后再试。"
-        )
+    截取录播的高光片段，任务进入片段队列在后台运行，可通过 /jobs/{id} 查看生成的文件。
+
+    默认按弹幕密度峰值截取前后 CLIP_BEFORE_SECONDS / CLIP_AFTER_SECONDS 秒，边界对齐关键帧并直接复制流；
+    burn 为 true 时只烧录片段时间内的弹幕。
+    """
+    target_room, base = find_recording(name, request.room)
+    if base is None:
+        raise HTTPException(status_code=404, detail=f"录播 {name} 不存在")
+    job = job_manager.submit(
+        "clip",
+        lambda control: clip_recording(base, target_room, request.ranges, request.top, request.burn, control),
+        source="api",
+        key=base,
+    )
+    return {"message": "片段截取任务已加入队列。", "job_id": job.id, "job_ids": [job.id]}
+
+@app.get("/rooms")
+def list_rooms_endpoint():
+    """
+    列出已配置的房间及其目录、文件名规则、清理阈值和压制优先级。
+    """
+    return [room.to_dict() for room in rooms]
+
+@app.get("/jobs")
+def list_jobs_endpoint(type: str | None = None, status: str | None = None):
+    """
+    列出后台任务 (最新的在前)，可按类型 (process / upload / clip) 和状态 (queued / running / success / failed / cancelled) 过滤。
+    """
+    return job_manager.list(kind=type, status=status)
 
-    # 添加后台任务
-    background_tasks.add_task(run_upload_background_task)
+@app.get("/jobs/{job_id}")
+def get_job_endpoint(job_id: str):
+    """
+    获取单个后台任务的状态和执行结果。
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在")
+    return job.to_dict()
 
-    return {"message": "上传流程已在后台启动。"}
+@app.delete("/jobs/{job_id}")
+def cancel_job_endpoint(job_id: str):
+    """
+    取消后台任务：排队中的任务直接移除；运行中的任务会结束正在运行的 ffmpeg 或 biliup 进程
+    (先发送 SIGTERM，超过 JOB_KILL_GRACE_SECONDS 秒后强制结束)，并不再开始新的文件。
+    """
+    try:
+        job = job_manager.cancel(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在")
+    return job.to_dict()
 
 @app.get("/status", response_model=PipelineStatus)
 def get_status_endpoint():
     """
-    获取当前处理流程的运行状态以及上次执行的结果。
+    获取当前处理流程的运行状态、上次执行的结果、排队和运行中的任务、正在压制的任务的实时进度以及上传队列状态。
+    """
+    last_job = job_manager.last_finished()
+    return {
+        "is_running": bool(job_manager.active()),
+        "last_result": last_job["result"] if last_job else None,
+        "jobs": job_manager.active(),
+        "encoding": encode_progress.snapshot(),
+        "uploads": upload_queue.snapshot() if upload_queue is not None else [],
+    }
+
+@app.get("/status/stream")
+def stream_status_endpoint():
+    """
+    以 Server-Sent Events 推送正在压制的任务的实时进度 (帧数、fps、速度、剩余时间)。
+
+    进度变化时推送一次 progress 事件，空闲时每 15 秒发送一次心跳。
+    """
+    def event_stream():
+        version, entries = -1, None
+        while True:
+            new_version, entries = encode_progress.wait(version, timeout=15)
+            if new_version == version:
+                yield ": keepalive\n\n"
+                continue
+            version = new_version
+            payload = {"is_running": bool(job_manager.active()), "encoding": entries}
+            yield f"event: progress\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """
+    以 Prometheus 文本格式输出各阶段耗时、吞吐字节数、压制速度、弹幕数量、队列长度、
+    元数据缓存命中率和外部进程失败次数等指标。
     """
-    # 直接返回全局状态字典，它符合 PipelineStatus 模型
-    return background_task_status
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 # 注意：FastAPI 应用不需要 if __name__ == "__main__": app.run()
 # 它将通过 uvicorn 启动
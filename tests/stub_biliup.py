@@ -0,0 +1,38 @@
+"""
+测试用的 biliup 替身：记录每次上传的文件，可按文件模拟前几次上传失败。
+
+用法与 biliup-rs 相同: stub_biliup.py upload [参数...] 文件
+
+环境变量:
+    STUB_BILIUP_LOG: 记录上传文件的日志，每次调用追加一行文件路径。
+    STUB_BILIUP_FAILURES: 每个文件前几次调用以退出码 1 失败，默认 0。
+"""
+import os
+import sys
+
+
+def main() -> int:
+    if len(sys.argv) < 3 or sys.argv[1] != "upload":
+        print("usage: stub_biliup.py upload [options] FILE", file=sys.stderr)
+        return 2
+    path = sys.argv[-1]
+    if not os.path.isfile(path):
+        print(f"文件不存在: {path}", file=sys.stderr)
+        return 2
+    log = os.environ["STUB_BILIUP_LOG"]
+    failures = int(os.getenv("STUB_BILIUP_FAILURES", "0"))
+    previous = 0
+    if os.path.exists(log):
+        with open(log, encoding="utf-8") as f:
+            previous = sum(1 for line in f if line.rstrip("\n") == path)
+    with open(log, "a", encoding="utf-8") as f:
+        f.write(path + "\n")
+    if previous < failures:
+        print(f"模拟上传失败: {path} (第 {previous + 1} 次)")
+        return 1
+    print(f"上传成功: {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import subprocess
+
+import pytest
+
+from apis import encoder_backends, video_encoder
+from apis.encoder_backends import EncoderBackend, create_backends, select_backends
+
+# ffmpeg 编译了硬件编码器，但机器上没有可用的显卡
+ALL_ENCODERS = {"h264_qsv", "h264_vaapi", "libx264", "libx265"}
+
+
+@pytest.fixture
+def benchmarked(monkeypatch):
+    """替换微基准测试，记录被测试的后端；fps 中的后端返回对应速度，failing 中的后端初始化失败"""
+    calls = []
+    fps = {"qsv": 300.0, "vaapi": 200.0, "x264": 100.0, "x265": 40.0}
+    failing = set()
+
+    def benchmark(self, frames=encoder_backends.BENCHMARK_FRAMES, timeout=120):
+        calls.append(self.name)
+        if self.name in failing:
+            raise RuntimeError(f"{self.name} 初始化失败")
+        self.benchmark_fps = fps[self.name]
+        return self.benchmark_fps
+
+    monkeypatch.setattr(encoder_backends, "list_ffmpeg_encoders", lambda: set(ALL_ENCODERS))
+    monkeypatch.setattr(EncoderBackend, "benchmark", benchmark)
+    return calls, failing
+
+
+def cpu_only(monkeypatch, tmp_path):
+    """模拟只有 /dev/dri 目录而没有渲染节点的机器"""
+    monkeypatch.setattr(encoder_backends.glob, "glob", lambda pattern: [])
+    return create_backends("auto", vaapi_device=str(tmp_path / "renderD128"))
+
+
+def test_cpu_only_host_selects_x264(monkeypatch, tmp_path, benchmarked):
+    calls, _ = benchmarked
+    selected = select_backends(cpu_only(monkeypatch, tmp_path))
+    assert [backend.name for backend in selected] == ["x264"]
+    # 没有渲染节点的硬件后端不会运行基准测试
+    assert calls == ["x264"]
+
+
+def test_hardware_init_failure_falls_back_to_x264(monkeypatch, tmp_path, benchmarked):
+    calls, failing = benchmarked
+    render_node = tmp_path / "renderD128"
+    render_node.touch()
+    monkeypatch.setattr(encoder_backends.glob, "glob", lambda pattern: [str(render_node)])
+    failing.add("qsv")
+    selected = select_backends(create_backends("auto", vaapi_device=str(render_node)))
+    assert [backend.name for backend in selected] == ["vaapi", "x264"]
+    assert calls == ["qsv", "vaapi", "x264"]
+
+
+def test_encode_falls_back_to_x264_when_hardware_fails(monkeypatch, tmp_path, benchmarked):
+    monkeypatch.setattr(encoder_backends.glob, "glob", lambda pattern: ["/dev/dri/renderD128"])
+    backends = select_backends(create_backends("qsv,x264"))
+    assert [backend.name for backend in backends] == ["qsv", "x264"]
+
+    commands = []
+
+    def run_ffmpeg(cmd, **kwargs):
+        commands.append(cmd)
+        if "h264_qsv" in cmd:
+            raise subprocess.CalledProcessError(1, cmd, stderr="Device creation failed")
+        with open(cmd[-1], "wb") as f:
+            f.write(b"mp4")
+        return ""
+
+    monkeypatch.setattr(video_encoder, "run_ffmpeg", run_ffmpeg)
+    video, ass, mp4 = tmp_path / "a.flv", tmp_path / "a.ass", tmp_path / "a.mp4"
+    video.write_bytes(b"flv")
+    ass.write_text("[Script Info]\n", encoding="utf-8")
+
+    used = video_encoder.encode(str(video), str(ass), str(mp4), test_mode=True, backends=backends)
+    assert used == "x264"
+    assert [cmd[cmd.index("-c:v") + 1] for cmd in commands] == ["h264_qsv", "libx264"]
+    assert mp4.read_bytes() == b"mp4"
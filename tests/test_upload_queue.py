@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+from collections import Counter
+
+import pytest
+
+from apis.job_ledger import JobLedger
+from apis.upload_queue import UploadQueue
+
+STUB_BILIUP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_biliup.py")
+
+
+@pytest.fixture
+def upload_log(tmp_path, monkeypatch):
+    log = tmp_path / "uploads.log"
+    monkeypatch.setenv("STUB_BILIUP_LOG", str(log))
+    return log
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = JobLedger(str(tmp_path / "ledger.db"))
+    yield ledger
+    ledger.close()
+
+
+def make_queue(tmp_path, ledger, **kwargs):
+    command = f"{sys.executable} {STUB_BILIUP} upload --tid 171 {{file}}"
+    return UploadQueue(str(tmp_path), ledger=ledger, command=command, **kwargs)
+
+
+def make_videos(folder, count):
+    paths = []
+    for i in range(count):
+        path = folder / f"录播{i}.mp4"
+        path.write_bytes(b"video" * (i + 1))
+        os.utime(path, (time.time() - 3600, time.time() - 3600))
+        paths.append(str(path))
+    return paths
+
+
+def uploaded(log):
+    return Counter(log.read_text(encoding="utf-8").splitlines()) if log.exists() else Counter()
+
+
+def test_each_file_uploaded_exactly_once(tmp_path, upload_log, ledger):
+    videos = make_videos(tmp_path, 3)
+    queue = make_queue(tmp_path, ledger, workers=2)
+    queue.start()
+    try:
+        assert all(queue.submit(path) for path in videos)
+        # 重复提交排队中的文件不会再次加入队列
+        assert not queue.submit(videos[0])
+        assert queue.join(timeout=30)
+        # 已上传的文件记录在台账中，再次提交或扫描目录都会跳过
+        assert not any(queue.submit(path) for path in videos)
+        assert queue.scan_folder(str(tmp_path)) == 0
+        assert queue.join(timeout=30)
+    finally:
+        queue.stop()
+
+    assert uploaded(upload_log) == Counter(videos)
+    assert all(ledger.is_done(path, "upload") for path in videos)
+    assert {item["status"] for item in queue.snapshot()} == {"success"}
+
+
+def test_failed_upload_retries_with_backoff(tmp_path, upload_log, ledger, monkeypatch):
+    monkeypatch.setenv("STUB_BILIUP_FAILURES", "2")
+    [video] = make_videos(tmp_path, 1)
+    queue = make_queue(tmp_path, ledger, max_retries=3, backoff_base=0.2, backoff_max=1.0)
+    queue.start()
+    started = time.time()
+    try:
+        queue.submit(video)
+        assert queue.join(timeout=30)
+    finally:
+        queue.stop()
+
+    # 两次失败后分别等待 0.2s 和 0.4s 再重试
+    assert time.time() - started >= 0.6
+    assert uploaded(upload_log) == Counter({video: 3})
+    [item] = queue.snapshot()
+    assert item["status"] == "success"
+    assert item["attempts"] == 3
+    assert ledger.is_done(video, "upload")
+
+
+def test_gives_up_after_max_retries(tmp_path, upload_log, ledger, monkeypatch):
+    monkeypatch.setenv("STUB_BILIUP_FAILURES", "10")
+    [video] = make_videos(tmp_path, 1)
+    queue = make_queue(tmp_path, ledger, max_retries=1, backoff_base=0.05)
+    queue.start()
+    try:
+        queue.submit(video)
+        assert queue.join(timeout=30)
+    finally:
+        queue.stop()
+
+    assert uploaded(upload_log) == Counter({video: 2})
+    [item] = queue.snapshot()
+    assert item["status"] == "failed"
+    assert "模拟上传失败" in item["error"]
+    assert not ledger.is_done(video, "upload")